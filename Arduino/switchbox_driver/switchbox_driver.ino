@@ -8,6 +8,41 @@ If byte "0" is detected, all relays close.
 If byte "1" through "8" is detected, the according relay opens.
 If byte "9" is detected, all relays open.
 
+Besides the single ASCII digits the sketch understands binary frames that set
+the state of all relays at once:
+
+  request:  0xAA, command, payload bytes, XOR of command and payload bytes
+  reply:    0xAA, ACK (0x06) or NAK (0x15), relay mask, ACK/NAK XOR mask
+
+Command 'M' sets the relays to the mask in the payload (bit 0 is relay 1,
+bit 7 is relay 8), command 'Q' only reports the current mask. A frame with a
+wrong checksum or an unknown command is answered with NAK and changes nothing.
+
+The sketch can also run a schedule of up to 32 steps (relay mask and dwell
+time in ms) with its own timing:
+
+  'C' (payload 0)                       clears the schedule
+  'A' (index, mask, dwell low, high)    sets step index (at most one past
+                                        the last step)
+  'R' (payload 0)                       runs the schedule from the first step
+  'X' (payload 0)                       stops a running schedule and switches
+                                        all relays off
+
+When the last step has passed, the sketch sends 0xAA, 0x04, relay mask,
+0x04 XOR mask on its own.
+
+To synchronise the instruments with the relays, the sketch can send an
+active-low trigger pulse on pin 7 a fixed time after the relays were
+switched by 'M' or by a schedule step:
+
+  'T' (settle low, high, width low, high)   sets the time between switching
+                                            and the pulse and the width of
+                                            the pulse (both in us, a width
+                                            of 0 turns the pulse off)
+  'P' (payload 0)                           sends a pulse right away
+
+The reply to 'M' is only sent after the pulse.
+
 The board accessed may need to be changed depending on which board is actually used in the switchbox.
 */
 
@@ -21,6 +56,39 @@ int RELAY6 = 9;
 int RELAY7 = 10;
 int RELAY8 = 11;
 
+// relays in the order of their bits in the relay mask
+int RELAYS[8] = {RELAY1, RELAY2, RELAY3, RELAY4, RELAY5, RELAY6, RELAY7, RELAY8};
+
+// spare pin for the trigger output (idle high)
+int TRIGGER = 7;
+
+// define the bytes of the framed protocol
+const byte FRAME_START = 0xAA;
+const byte SET_RELAYS = 'M';
+const byte GET_RELAYS = 'Q';
+const byte CLEAR_SCHEDULE = 'C';
+const byte SET_STEP = 'A';
+const byte RUN_SCHEDULE = 'R';
+const byte STOP_SCHEDULE = 'X';
+const byte SET_TRIGGER = 'T';
+const byte PULSE_TRIGGER = 'P';
+const byte ACK = 0x06;
+const byte NAK = 0x15;
+const byte SCHEDULE_DONE = 0x04;
+
+// define the relay schedule
+const int MAX_STEPS = 32;
+byte stepMasks[MAX_STEPS];
+unsigned int stepDwells[MAX_STEPS];
+int stepCount = 0;
+int currentStep = 0;
+bool scheduleRunning = false;
+unsigned long stepStart = 0;
+
+// define the trigger pulse (in us, no pulse if the width is 0)
+unsigned int triggerSettle = 0;
+unsigned int triggerWidth = 0;
+
 void setup()
 {    
 // set Relays as Output
@@ -33,22 +101,178 @@ void setup()
   pinMode(RELAY7, OUTPUT);  
   pinMode(RELAY8, OUTPUT);  
 
+// set trigger as output that is idle high
+  digitalWrite(TRIGGER, HIGH);
+  pinMode(TRIGGER, OUTPUT);
+
 // Open serial communications and wait for port to open:
   Serial.begin(9600);
   while (!Serial) {
     ; // wait for serial port to connect. Needed for native USB port only
   }
+  // do not wait long for the rest of a frame
+  Serial.setTimeout(50);
+
   // send an intro:
   Serial.println("This is Uno. Ready to switch ...");
   Serial.println();
 }
 
+byte readRelays()
+{
+  // collect the state of all relays in one byte
+  byte mask = 0;
+  for (int i = 0; i < 8; i++) {
+    if (digitalRead(RELAYS[i]) == HIGH) {
+      mask |= 1 << i;
+    }
+  }
+  return mask;
+}
+
+void writeRelays(byte mask)
+{
+  // switch every relay to the state of its bit
+  for (int i = 0; i < 8; i++) {
+    digitalWrite(RELAYS[i], (mask >> i) & 1 ? HIGH : LOW);
+  }
+}
+
+void waitMicroseconds(unsigned int duration)
+{
+  // delayMicroseconds is only accurate up to 16383 us
+  unsigned long start = micros();
+  while (micros() - start < duration) {
+    ;
+  }
+}
+
+void pulseTrigger()
+{
+  // send one active-low pulse on the trigger output
+  digitalWrite(TRIGGER, LOW);
+  waitMicroseconds(triggerWidth);
+  digitalWrite(TRIGGER, HIGH);
+}
+
+void switchRelays(byte mask)
+{
+  // switch the relays and let the instruments know once they settled
+  writeRelays(mask);
+  if (triggerWidth > 0) {
+    waitMicroseconds(triggerSettle);
+    pulseTrigger();
+  }
+}
+
+void sendFrame(byte status)
+{
+  // answer with the state the relays are in now
+  byte mask = readRelays();
+  byte reply[4] = {FRAME_START, status, mask, (byte)(status ^ mask)};
+  Serial.write(reply, 4);
+}
+
+void advanceSchedule()
+{
+  // go to the next step once the dwell time of the current one has passed
+  if (scheduleRunning && millis() - stepStart >= stepDwells[currentStep]) {
+    // count from the planned end of the step so that delays do not add up
+    stepStart += stepDwells[currentStep];
+    currentStep++;
+
+    if (currentStep < stepCount) {
+      switchRelays(stepMasks[currentStep]);
+    }
+    else {
+      scheduleRunning = false;
+      sendFrame(SCHEDULE_DONE);
+    }
+  }
+}
+
+void handleFrame()
+{
+  // read command, payload and checksum that follow the start byte
+  byte frame[6];
+  byte status = NAK;
+  int length = 2;  // bytes after the command (payload and checksum)
+
+  if (Serial.readBytes(frame, 1) == 1) {
+    // setting a schedule step or the trigger has four payload bytes, all
+    // other commands one
+    if (frame[0] == SET_STEP || frame[0] == SET_TRIGGER) {
+      length = 5;
+    }
+
+    if (Serial.readBytes(frame + 1, length) == length) {
+      byte checksum = 0;
+      for (int i = 0; i < length; i++) {
+        checksum ^= frame[i];
+      }
+
+      if (checksum == frame[length]) {
+        if (frame[0] == SET_RELAYS && !scheduleRunning) {
+          switchRelays(frame[1]);
+          status = ACK;
+        }
+        else if (frame[0] == GET_RELAYS) {
+          status = ACK;
+        }
+        else if (frame[0] == CLEAR_SCHEDULE && !scheduleRunning) {
+          stepCount = 0;
+          status = ACK;
+        }
+        else if (frame[0] == SET_STEP && !scheduleRunning
+                 && frame[1] < MAX_STEPS && frame[1] <= stepCount) {
+          stepMasks[frame[1]] = frame[2];
+          stepDwells[frame[1]] = frame[3] | (frame[4] << 8);
+          stepCount = max(stepCount, frame[1] + 1);
+          status = ACK;
+        }
+        else if (frame[0] == RUN_SCHEDULE && stepCount > 0) {
+          currentStep = 0;
+          stepStart = millis();
+          switchRelays(stepMasks[0]);
+          scheduleRunning = true;
+          status = ACK;
+        }
+        else if (frame[0] == SET_TRIGGER) {
+          triggerSettle = frame[1] | (frame[2] << 8);
+          triggerWidth = frame[3] | (frame[4] << 8);
+          status = ACK;
+        }
+        else if (frame[0] == PULSE_TRIGGER && triggerWidth > 0) {
+          pulseTrigger();
+          status = ACK;
+        }
+        else if (frame[0] == STOP_SCHEDULE) {
+          scheduleRunning = false;
+          writeRelays(0);
+          status = ACK;
+        }
+      }
+    }
+  }
+
+  sendFrame(status);
+}
+
 void loop()
 {
+  // keep a running schedule going
+  advanceSchedule();
+
   // get any incoming bytes:
   if (Serial.available() > 0) {
     char thisChar = Serial.read();
-    
+
+    // binary frames are answered with a binary reply only
+    if ((byte)thisChar == FRAME_START) {
+      handleFrame();
+      return;
+    }
+
     // making sure the right byte has been received (for debugging):
     Serial.print("received: \'");
     Serial.print(thisChar);
@@ -7,6 +7,8 @@ import core_functions as cf
 import pandas as pd
 import numpy as np
 
+from hardware import RangePlanner
+
 
 class AutotubeMeasurement(QtCore.QThread):
     """
@@ -38,7 +40,7 @@ class AutotubeMeasurement(QtCore.QThread):
 
         # Assign hardware and reset
         self.uno = arduino
-        self.uno.init_serial_connection()
+        self.uno.ensure_connection()
         self.keithley_source = keithley_source
         self.keithley_source.as_voltage_source(
             measurement_parameters["scan_compliance"]
@@ -57,7 +59,16 @@ class AutotubeMeasurement(QtCore.QThread):
         # Since the data shall be plotted after each measurement (it could also
         # be done while measuring but I think there is not much benefit and the
         # programming is uglier), only one pixel is scanned at a time
-        self.df_data = pd.DataFrame(columns=["voltage", "current", "pd_voltage"])
+        self.df_data = pd.DataFrame(
+            columns=[
+                "voltage",
+                "current",
+                "pd_voltage",
+                "settling_time",
+                "source_nplc",
+                "pd_nplc",
+            ]
+        )
 
         # Connect the signals
         self.update_plot.connect(parent.plot_autotube_measurement)
@@ -138,10 +149,58 @@ class AutotubeMeasurement(QtCore.QThread):
         # To update progres bar
         progress = 0
 
+        # The script engine needs the Keithley source to be set to TSP
+        sweep_mode = self.measurement_parameters["sweep_mode"]
+        if sweep_mode == "tsp" and not self.keithley_source.script_engine_available():
+            cf.log_message(
+                "The Keithley source is not set to TSP. The buffered sweep is used instead."
+            )
+            sweep_mode = "buffered"
+        elif (
+            sweep_mode in ["buffered", "pulsed"]
+            and self.keithley_source.script_engine_available()
+        ):
+            # The trigger model can only be programmed with SCPI commands
+            cf.log_message(
+                "The Keithley source is set to TSP. The script sweep is used instead."
+            )
+            sweep_mode = "tsp"
+
         # Init buffer before the measurement
-        # self.keithley_source.init_buffer(
-        #     "OLEDbuffer", 10 * len(low_vlt) + len(high_vlt)
-        # )
+        if sweep_mode == "buffered":
+            self.keithley_source.init_voltage_sweep(
+                voltages_to_scan, "OLEDbuffer", self.multimeter_latency
+            )
+        elif sweep_mode == "pulsed":
+            try:
+                self.pulse_settling_time = (
+                    self.keithley_source.init_pulsed_voltage_sweep(
+                        voltages_to_scan,
+                        "OLEDbuffer",
+                        self.measurement_parameters["pulse_width"],
+                        self.measurement_parameters["pulse_duty_cycle"],
+                        self.measurement_parameters["photodiode_nplc"],
+                    )
+                )
+            except ValueError:
+                # The measurement does not fit into the pulse (the reason was
+                # logged already)
+                self.hide_progress_bar.emit()
+                self.reset_start_button.emit(False)
+                return
+
+        # The ranges of the current and photodiode readings of the stepwise
+        # sweeps are planned from the previous points and the curve of the
+        # previous pixel instead of auto ranging
+        range_planners = []
+        if self.measurement_parameters["range_headroom"] > 0:
+            range_planners = [
+                RangePlanner(self.measurement_parameters["range_headroom"]),
+                RangePlanner(self.measurement_parameters["range_headroom"]),
+            ]
+            self.keithley_source.set_range_planner(range_planners[0])
+            self.keithley_multimeter.set_range_planner(range_planners[1])
+
         # Turn all pixels off at the beginning
         self.parent.unselect_all_pixels()
 
@@ -155,92 +214,51 @@ class AutotubeMeasurement(QtCore.QThread):
 
             cf.log_message("Running on Pixel " + str(pixel))
 
+            # The integration time of each point of the stepwise sweeps is
+            # chosen from the previous point. The first point (and the
+            # background) of each pixel is measured with the longest one.
+            self.keithley_source.set_integration_policy(
+                self.measurement_parameters["source_noise_floor"],
+                self.measurement_parameters["nplc_target_noise"],
+            )
+            self.keithley_multimeter.set_integration_policy(
+                self.measurement_parameters["photodiode_noise_floor"],
+                self.measurement_parameters["nplc_target_noise"],
+                self.measurement_parameters["photodiode_nplc"],
+            )
+
+            # Each pixel is a new curve for the range planners
+            for range_planner in range_planners:
+                range_planner.next_curve()
+
             # Take PD voltage reading from Multimeter for background
-            background_diodevoltage = self.keithley_multimeter.measure_voltage()
+            background_diodevoltage = self.keithley_multimeter.measure_averaged_voltage(
+                self.measurement_parameters["photodiode_samples"],
+                self.measurement_parameters["photodiode_nplc"],
+            )
 
             # Activate the relay of the selected pixel
             self.uno.trigger_relay(pixel)
 
-            # Turn on the voltage
-            self.keithley_source.activate_output()
-
-            # Low Voltage Readings
-            i = 0
-            for voltage in voltages_to_scan:
-                # self.queue.put("\nOLED Voltage : " + str(voltage) + " V")
-                # Set voltage to source_value
-                self.keithley_source.set_voltage(str(voltage))
-
-                # Keithley has a latency. This value is higher if we consider
-                # the range change of the automatic function of our multimeter
-                # if self.measurement_parameters["fixed_multimeter_range"]:
-                # time.sleep(0.1)
-                # else:
-                time.sleep(self.multimeter_latency)
-
-                # Take PD voltage reading from Multimeter
-                # if self.measurement_parameters["fixed_multimeter_range"]:
-                # diode_voltage = self.keithley_multimeter.measure_voltage(1)
-                # else:
-                # Take OLED current reading from Sourcemeter
-                oled_current = self.keithley_source.read_current()
-
-                diode_voltage = self.keithley_multimeter.measure_voltage()
-
-                # check if compliance is reached
-                if abs(oled_current) >= self.measurement_parameters["scan_compliance"]:
-                    self.keithley_source.deactivate_output()
-                    self.log_message("Current compliance reached")
-                    break
-
-                # # check for a bad contact
-                # bad_contact = False
-
-                # if self.measurement_parameters["check_bad_contacts"] == True and (
-                #     voltage > 0 and voltage < 2
-                # ):
-                #     # If the OLED shows for a small voltage (lower 2 V) already
-                #     # 50 % of the compliance, it is regarded as being shorted
-                #     if (
-                #         abs(oled_current)
-                #         >= 0.5 * self.measurement_parameters["scan_compliance"]
-                #     ):
-                #         self.keithley_source.deactivate_output()  # Turn power off
-                #         cf.log_message(
-                #             "Pixel "
-                #             + str(pixel)
-                #             + " probably has a bad contact. Measurement aborted."
-                #         )
-
-                #         # Wait a second so that the user can read the message
-                #         time.sleep(1)
-                #         bad_contact = True
-                #         break
-
-                if (
-                    diode_voltage
-                    >= self.measurement_parameters["photodiode_saturation"]
-                ):
-                    cf.log_message(
-                        "Photodiode reached saturation. You might want to adjust the photodiode gain."
-                    )
-
-                    # Wait a second so that the user can read the message
-                    time.sleep(1)
-                    break
-
-                self.df_data.loc[i, "pd_voltage"] = (
-                    diode_voltage - background_diodevoltage
-                )
-                # Current should be in mA
-                self.df_data.loc[i, "current"] = oled_current * 1e3
-                self.df_data.loc[i, "voltage"] = voltage
-
-                i += 1
+            if sweep_mode == "buffered":
+                # The entire sweep runs on the Keithley source
+                self.measure_buffered_sweep(voltages_to_scan, background_diodevoltage)
+            elif sweep_mode == "pulsed":
+                # Each voltage is only applied as a short pulse
+                self.measure_pulsed_sweep(voltages_to_scan, background_diodevoltage)
+            elif sweep_mode == "tsp":
+                # The entire sweep runs as script on the Keithley source
+                self.measure_script_sweep(voltages_to_scan, background_diodevoltage)
+            elif sweep_mode == "adaptive":
+                # Turn on the voltage
+                self.keithley_source.activate_output()
+
+                self.measure_adaptive_sweep(background_diodevoltage)
+            else:
+                # Turn on the voltage
+                self.keithley_source.activate_output()
 
-                # Breaks out of the voltage loop
-                if self.stop == True:
-                    break
+                self.measure_stepwise_sweep(voltages_to_scan, background_diodevoltage)
 
             # If a bad contact was detected, jump this iteration (no saving etc.)
             # if bad_contact == True:
@@ -252,6 +270,10 @@ class AutotubeMeasurement(QtCore.QThread):
             # Turn off all relays
             self.uno.trigger_relay(pixel)
 
+            # Report everything the instruments complained about for this pixel
+            self.keithley_source.check_errors()
+            self.keithley_multimeter.check_errors()
+
             # Breaks the pixel loop so that only the output is deactivated etc.
             if self.stop == True:
                 break
@@ -283,6 +305,12 @@ class AutotubeMeasurement(QtCore.QThread):
             # Wait a few seconds so that the user can have a look at the graph
             time.sleep(1)
 
+        # Go back to a fixed integration time and auto range
+        self.keithley_source.set_integration_policy(0, 0)
+        self.keithley_multimeter.set_integration_policy(0, 0)
+        self.keithley_source.set_range_planner(None)
+        self.keithley_multimeter.set_range_planner(None)
+
         # Breaks the pixel loop so that only the output is deactivated etc.
         if self.stop == True:
             cf.log_message("Autotube measurement interrupted by user")
@@ -444,6 +472,551 @@ class AutotubeMeasurement(QtCore.QThread):
         # close COM port
         # self.uno.close_serial_connection()
 
+    def measure_point(self, voltage):
+        """
+        Apply a voltage and take the OLED current and photodiode voltage
+        readings. Returns the current, the photodiode voltage, the time
+        waited for settling and the integration times (in NPLC) of the OLED
+        current and photodiode readings.
+        """
+        # self.queue.put("\nOLED Voltage : " + str(voltage) + " V")
+        # Set voltage to source_value
+        self.keithley_source.set_voltage(str(voltage))
+
+        # Keithley has a latency. This value is higher if we consider
+        # the range change of the automatic function of our multimeter
+        # if self.measurement_parameters["fixed_multimeter_range"]:
+        # time.sleep(0.1)
+        # else:
+        if self.measurement_parameters["settling_tolerance"] > 0:
+            # Only wait until the photodiode reading settled but at most
+            # the multimeter latency. The multimeter is configured for the
+            # photodiode readings of this point right away and settles with
+            # them, so that it is only configured (and armed) once per point.
+            self.keithley_multimeter.configure_burst(
+                self.measurement_parameters["photodiode_samples"],
+                self.measurement_parameters["photodiode_nplc"],
+                voltage,
+            )
+            _, settling_time = self.keithley_multimeter.wait_for_settling(
+                self.measurement_parameters["settling_tolerance"],
+                self.multimeter_latency,
+                nplc=None,
+            )
+        else:
+            time.sleep(self.multimeter_latency)
+            settling_time = self.multimeter_latency
+
+        # Take PD voltage reading from Multimeter
+        # if self.measurement_parameters["fixed_multimeter_range"]:
+        # diode_voltage = self.keithley_multimeter.measure_voltage(1)
+        # else:
+        # Take OLED current reading from Sourcemeter and PD voltage
+        # reading from Multimeter at the same time
+        reading, diode_voltage, diode_nplc = (
+            self.keithley_source.measure_iv_with_photodiode(
+                self.keithley_multimeter,
+                self.measurement_parameters["photodiode_samples"],
+                self.measurement_parameters["photodiode_nplc"],
+            )
+        )
+
+        return (
+            reading.current,
+            diode_voltage,
+            settling_time,
+            reading.nplc,
+            diode_nplc,
+        )
+
+    def limits_reached(self, oled_current, diode_voltage):
+        """
+        Check if the current compliance or the photodiode saturation was
+        reached so that the sweep has to be stopped
+        """
+        # check if compliance is reached (the compliance is given in mA). The
+        # source clamps the current at the compliance, so the readings only
+        # come close to it.
+        if (
+            abs(oled_current) * 1e3
+            >= 0.99 * self.measurement_parameters["scan_compliance"]
+        ):
+            self.keithley_source.deactivate_output()
+            cf.log_message("Current compliance reached")
+            return True
+
+        # # check for a bad contact
+        # bad_contact = False
+
+        # if self.measurement_parameters["check_bad_contacts"] == True and (
+        #     voltage > 0 and voltage < 2
+        # ):
+        #     # If the OLED shows for a small voltage (lower 2 V) already
+        #     # 50 % of the compliance, it is regarded as being shorted
+        #     if (
+        #         abs(oled_current)
+        #         >= 0.5 * self.measurement_parameters["scan_compliance"]
+        #     ):
+        #         self.keithley_source.deactivate_output()  # Turn power off
+        #         cf.log_message(
+        #             "Pixel "
+        #             + str(pixel)
+        #             + " probably has a bad contact. Measurement aborted."
+        #         )
+
+        #         # Wait a second so that the user can read the message
+        #         time.sleep(1)
+        #         bad_contact = True
+        #         break
+
+        if diode_voltage >= self.measurement_parameters["photodiode_saturation"]:
+            cf.log_message(
+                "Photodiode reached saturation. You might want to adjust the photodiode gain."
+            )
+
+            # Wait a second so that the user can read the message
+            time.sleep(1)
+            return True
+
+        return False
+
+    def store_point(
+        self,
+        i,
+        voltage,
+        oled_current,
+        diode_voltage,
+        settling_time,
+        source_nplc,
+        diode_nplc,
+        background,
+    ):
+        """
+        Write a measured point to the data frame
+        """
+        self.df_data.loc[i, "pd_voltage"] = diode_voltage - background
+        # Current should be in mA
+        self.df_data.loc[i, "current"] = oled_current * 1e3
+        self.df_data.loc[i, "voltage"] = voltage
+        self.df_data.loc[i, "settling_time"] = settling_time
+        self.df_data.loc[i, "source_nplc"] = source_nplc
+        self.df_data.loc[i, "pd_nplc"] = diode_nplc
+
+    def measure_stepwise_sweep(self, voltages_to_scan, background_diodevoltage):
+        """
+        Scan the voltages point by point from the computer. The output of the
+        Keithley source must already be activated.
+        """
+        # Empty dataframe (the points are stored by index, so rows of the
+        # previous pixel would be kept if this sweep ends earlier)
+        self.df_data = self.df_data.iloc[0:0]
+
+        # Low Voltage Readings
+        i = 0
+        for voltage in voltages_to_scan:
+            (
+                oled_current,
+                diode_voltage,
+                settling_time,
+                source_nplc,
+                diode_nplc,
+            ) = self.measure_point(voltage)
+
+            if self.limits_reached(oled_current, diode_voltage):
+                break
+
+            self.store_point(
+                i,
+                voltage,
+                oled_current,
+                diode_voltage,
+                settling_time,
+                source_nplc,
+                diode_nplc,
+                background_diodevoltage,
+            )
+
+            i += 1
+
+            # Breaks out of the voltage loop
+            if self.stop == True:
+                break
+
+    def measure_adaptive_sweep(self, background_diodevoltage):
+        """
+        Scan the voltages with an adaptive step size. The sweep starts with
+        the (coarse) low voltage step and refines the step where the current
+        or the photodiode voltage change quickly (e.g. at turn-on). The
+        points that are left of the point budget are then spent on midpoints
+        of the intervals where the curves bend the most (see
+        next_refinement). No step is smaller than the minimum step. The
+        turn-on voltage is detected from the slopes of the measured curves.
+        The output of the Keithley source must already be activated.
+        """
+        min_voltage = self.measurement_parameters["min_voltage"]
+        max_voltage = self.measurement_parameters["max_voltage"]
+        coarse_step = self.measurement_parameters["low_voltage_step"]
+        minimum_step = min(
+            self.measurement_parameters["adaptive_minimum_step"], coarse_step
+        )
+        point_budget = int(self.measurement_parameters["adaptive_point_budget"])
+
+        voltages = []
+        currents = []
+        diode_voltages = []
+
+        # Empty dataframe (the points are stored by index, so rows of the
+        # previous pixel would be kept if this sweep ends earlier)
+        self.df_data = self.df_data.iloc[0:0]
+
+        voltage = min_voltage
+        step = coarse_step
+
+        # Sweep upwards with an adaptive step
+        i = 0
+        while i < point_budget:
+            measurement = self.measure_point(voltage)
+
+            if self.limits_reached(measurement[0], measurement[1]):
+                break
+
+            self.store_point(i, voltage, *measurement, background_diodevoltage)
+
+            voltages.append(voltage)
+            currents.append(measurement[0])
+            diode_voltages.append(measurement[1] - background_diodevoltage)
+
+            i += 1
+
+            # Breaks out of the voltage loop
+            if self.stop == True or np.isclose(voltage, max_voltage):
+                break
+
+            step = self.next_adaptive_step(
+                voltages, currents, diode_voltages, step, minimum_step, coarse_step
+            )
+
+            # Make sure that the maximum voltage can still be reached with
+            # the remaining points
+            remaining_points = point_budget - i
+            step = max(step, (max_voltage - voltage) / max(remaining_points, 1))
+
+            voltage = min(voltage + step, max_voltage)
+
+        # Spend the rest of the budget on the intervals that bend the most
+        sweep_points = i
+        while i < point_budget and self.stop == False:
+            voltage = self.next_refinement(
+                voltages, currents, diode_voltages, minimum_step
+            )
+            if voltage is None:
+                break
+
+            # The output was turned off if the sweep ended at the compliance
+            self.keithley_source.activate_output()
+            measurement = self.measure_point(voltage)
+
+            if self.limits_reached(measurement[0], measurement[1]):
+                break
+
+            self.store_point(i, voltage, *measurement, background_diodevoltage)
+
+            voltages.append(voltage)
+            currents.append(measurement[0])
+            diode_voltages.append(measurement[1] - background_diodevoltage)
+
+            i += 1
+
+        # The midpoints were measured after the sweep
+        if i > sweep_points:
+            self.df_data.iloc[:i] = (
+                self.df_data.iloc[:i].sort_values("voltage").to_numpy()
+            )
+
+        turn_on_voltage = self.detect_turn_on(
+            voltages, currents, diode_voltages, minimum_step
+        )
+        if turn_on_voltage is not None:
+            cf.log_message(
+                "Turn-on detected at " + str(round(turn_on_voltage, 2)) + " V"
+            )
+
+    def detect_turn_on(self, voltages, currents, diode_voltages, minimum_step):
+        """
+        Return the turn-on voltage of a measured curve (None if it can not
+        be told). It is the first voltage at which dL/dV exceeds ten times
+        the photodiode noise per minimum step, i.e. at which the light rises
+        faster than the noise of the photodiode could explain. If the
+        photodiode voltage never rises clearly above the noise, the first
+        voltage at which the logarithmic dI/dV reaches half its maximum is
+        used instead.
+        """
+        if len(voltages) < 3:
+            return None
+
+        order = np.argsort(voltages)
+        voltages = np.array(voltages, dtype=float)[order]
+        currents = np.array(currents, dtype=float)[order]
+        diode_voltages = np.array(diode_voltages, dtype=float)[order]
+
+        # The light has to rise well above the noise of the photodiode
+        noise = self.measurement_parameters["photodiode_noise_floor"]
+        if np.max(diode_voltages) - np.min(diode_voltages) > 100 * noise:
+            slopes = np.gradient(diode_voltages, voltages)
+            threshold = 10 * noise / minimum_step
+        else:
+            slopes = np.gradient(np.log10(np.abs(currents) + 1e-12), voltages)
+            threshold = 0.5 * np.max(slopes)
+
+        if threshold <= 0:
+            return None
+
+        return voltages[np.argmax(slopes >= threshold)]
+
+    def next_refinement(self, voltages, currents, diode_voltages, minimum_step):
+        """
+        Return the voltage of the next midpoint (None if no interval has to
+        be refined). The curvature at each point is measured as the distance
+        of the logarithmic current and the (normalised) photodiode voltage
+        from the straight line through the neighbouring points. The wider
+        interval next to the point that bends the most is halved if the
+        distance exceeds the tolerance and the halves are not smaller than
+        the minimum step.
+        """
+        if len(voltages) < 3:
+            return None
+
+        order = np.argsort(voltages)
+        voltages = np.array(voltages, dtype=float)[order]
+        log_currents = np.log10(np.abs(np.array(currents, dtype=float)[order]) + 1e-12)
+        diode_voltages = np.array(diode_voltages, dtype=float)[order]
+        diode_voltages = diode_voltages / max(np.max(np.abs(diode_voltages)), 1e-3)
+
+        best_voltage = None
+        best_curvature = 1
+        for k in range(1, len(voltages) - 1):
+            # Tolerated distance from the straight line: 0.1 decades of the
+            # current and 5 % of the photodiode voltage
+            weight = (voltages[k] - voltages[k - 1]) / (
+                voltages[k + 1] - voltages[k - 1]
+            )
+            curvature = max(
+                abs(
+                    log_currents[k]
+                    - log_currents[k - 1]
+                    - (log_currents[k + 1] - log_currents[k - 1]) * weight
+                )
+                / 0.1,
+                abs(
+                    diode_voltages[k]
+                    - diode_voltages[k - 1]
+                    - (diode_voltages[k + 1] - diode_voltages[k - 1]) * weight
+                )
+                / 0.05,
+            )
+
+            # Halve the wider of the two intervals next to the point
+            if voltages[k + 1] - voltages[k] > voltages[k] - voltages[k - 1]:
+                interval = (voltages[k], voltages[k + 1])
+            else:
+                interval = (voltages[k - 1], voltages[k])
+
+            if (
+                curvature > best_curvature
+                and interval[1] - interval[0] >= 2 * minimum_step
+            ):
+                best_curvature = curvature
+                best_voltage = (interval[0] + interval[1]) / 2
+
+        return best_voltage
+
+    def next_adaptive_step(
+        self, voltages, currents, diode_voltages, step, minimum_step, maximum_step
+    ):
+        """
+        Choose the next voltage step from the last measured points. The step
+        is decreased if the logarithmic current, its slope (curvature) or the
+        photodiode voltage changed a lot in the last step and increased if
+        they barely changed.
+        """
+        if len(voltages) < 2:
+            return step
+
+        # Change in decades of the current
+        log_currents = np.log10(np.abs(currents[-3:]) + 1e-12)
+        log_current_change = abs(log_currents[-1] - log_currents[-2])
+
+        # Change of the slope of the logarithmic current
+        curvature = 0
+        if len(voltages) >= 3:
+            slopes = np.diff(log_currents) / np.diff(voltages[-3:])
+            curvature = abs(slopes[-1] - slopes[-2]) * step
+
+        # Relative change of the photodiode voltage
+        diode_voltage_change = abs(diode_voltages[-1] - diode_voltages[-2]) / max(
+            np.max(np.abs(diode_voltages)), 1e-3
+        )
+
+        # Normalise the changes by the change that is tolerated per step
+        change = max(
+            log_current_change / 0.25, curvature / 0.1, diode_voltage_change / 0.1
+        )
+
+        # Do not change the step by more than a factor of two at once
+        step = step / min(max(change, 0.5), 2)
+
+        return min(max(step, minimum_step), maximum_step)
+
+    def measure_buffered_sweep(self, voltages_to_scan, background_diodevoltage):
+        """
+        Let the Keithley source run the entire sweep from its trigger model
+        and fetch all readings at once afterwards. The multimeter is
+        triggered by the source via its external trigger input (digital I/O
+        line 1 of the source must be connected to the Ext Trig input of the
+        multimeter).
+        """
+        self.keithley_multimeter.arm_external_acquisition(len(voltages_to_scan))
+
+        # The output is turned on and off by the trigger model itself
+        self.keithley_source.empty_buffer("OLEDbuffer")
+        self.keithley_source.run_sweep(
+            timeout=len(voltages_to_scan) * (self.multimeter_latency + 0.1) + 10
+        )
+
+        voltages, currents = self.keithley_source.fetch_sweep(
+            "OLEDbuffer", len(voltages_to_scan)
+        )
+        diode_voltages = self.keithley_multimeter.fetch_acquisition()
+
+        # Put the multimeter back into its default state
+        self.keithley_multimeter.reset()
+
+        self.store_sweep(
+            voltages_to_scan, currents, diode_voltages, background_diodevoltage
+        )
+
+    def measure_pulsed_sweep(self, voltages_to_scan, background_diodevoltage):
+        """
+        Let the Keithley source apply each voltage as a pulse from its
+        trigger model (pulse width and duty cycle are set in the global
+        settings). Current and photodiode voltage are both measured at the
+        end of each pulse. This keeps the devices from heating up at high
+        currents.
+        """
+        self.keithley_multimeter.arm_external_acquisition(
+            len(voltages_to_scan), self.measurement_parameters["photodiode_nplc"]
+        )
+
+        # The output is turned on and off by the trigger model itself
+        self.keithley_source.empty_buffer("OLEDbuffer")
+        self.keithley_source.run_sweep(
+            timeout=len(voltages_to_scan)
+            * self.measurement_parameters["pulse_width"]
+            / self.measurement_parameters["pulse_duty_cycle"]
+            + 10
+        )
+
+        voltages, currents = self.keithley_source.fetch_sweep(
+            "OLEDbuffer", len(voltages_to_scan)
+        )
+        diode_voltages = self.keithley_multimeter.fetch_acquisition()
+
+        # Put the multimeter back into its default state
+        self.keithley_multimeter.reset()
+
+        self.store_sweep(
+            voltages_to_scan,
+            currents,
+            diode_voltages,
+            background_diodevoltage,
+            self.pulse_settling_time,
+            self.measurement_parameters["photodiode_nplc"],
+        )
+
+    def measure_script_sweep(self, voltages_to_scan, background_diodevoltage):
+        """
+        Let the JVL sweep script run the entire sweep on the Keithley source.
+        The script stops at the current compliance by itself and streams the
+        readings back while it runs so that the user can still stop the
+        measurement. The multimeter is triggered via its external trigger
+        input as for the buffered sweep.
+        """
+        self.keithley_multimeter.arm_external_acquisition(len(voltages_to_scan))
+
+        voltages, currents, _, status = self.keithley_source.run_script_sweep(
+            voltages_to_scan,
+            self.measurement_parameters["scan_compliance"],
+            self.multimeter_latency,
+            chunk_callback=lambda voltages, currents: not self.stop,
+            timeout=len(voltages_to_scan) * (self.multimeter_latency + 0.1) + 10,
+        )
+
+        if status == "ABORTED":
+            # The photodiode acquisition did not get all its triggers
+            self.keithley_multimeter.reset(force=True)
+            return
+
+        diode_voltages = self.keithley_multimeter.fetch_acquisition()
+
+        # Put the multimeter back into its default state
+        self.keithley_multimeter.reset()
+
+        self.store_sweep(
+            voltages_to_scan, currents, diode_voltages, background_diodevoltage
+        )
+
+    def store_sweep(
+        self,
+        voltages_to_scan,
+        currents,
+        diode_voltages,
+        background_diodevoltage,
+        settling_time=None,
+        nplc=1,
+    ):
+        """
+        Write the readings of a sweep that ran on the instrument to the data
+        frame. The compliance and the photodiode saturation can only be
+        checked after the sweep. All points from the first violation on are
+        dropped to obtain the same data as with the stepwise sweep. The
+        settling time defaults to the multimeter latency. Both instruments
+        integrate for nplc power line cycles during these sweeps.
+        """
+        if settling_time is None:
+            settling_time = self.multimeter_latency
+
+        points = min(len(currents), len(diode_voltages))
+        violations = np.where(
+            (
+                np.abs(currents[:points]) * 1e3
+                >= 0.99 * self.measurement_parameters["scan_compliance"]
+            )
+            | (
+                diode_voltages[:points]
+                >= self.measurement_parameters["photodiode_saturation"]
+            )
+        )[0]
+
+        if np.size(violations) > 0:
+            points = violations[0]
+            cf.log_message(
+                "Current compliance or photodiode saturation reached at "
+                + str(round(voltages_to_scan[points], 2))
+                + " V"
+            )
+
+        # Current should be in mA
+        self.df_data = pd.DataFrame(
+            {
+                "voltage": voltages_to_scan[:points],
+                "current": currents[:points] * 1e3,
+                "pd_voltage": diode_voltages[:points] - background_diodevoltage,
+                "settling_time": np.full(points, settling_time),
+                "source_nplc": np.full(points, nplc),
+                "pd_nplc": np.full(points, nplc),
+            }
+        )
+
     def save_data(self, pixel):
         """
         Function to save the measured data to file. This should probably be
@@ -477,8 +1050,11 @@ class AutotubeMeasurement(QtCore.QThread):
             + " A"
         )
         line07 = "### Measurement data ###"
-        line08 = "OLEDVoltage\t OLEDCurrent\t Photodiode Voltage"
-        line09 = "V\t mA\t V\n"
+        line08 = (
+            "OLEDVoltage\t OLEDCurrent\t Photodiode Voltage\t Settling Time\t "
+            + "OLEDCurrent NPLC\t Photodiode NPLC"
+        )
+        line09 = "V\t mA\t V\t s\t NPLC\t NPLC\n"
 
         header_lines = [
             line03,
@@ -513,6 +1089,9 @@ class AutotubeMeasurement(QtCore.QThread):
         self.df_data["pd_voltage"] = self.df_data["pd_voltage"].map(
             lambda x: "{0:.7f}".format(x)
         )
+        self.df_data["settling_time"] = self.df_data["settling_time"].map(
+            lambda x: "{0:.3f}".format(x)
+        )
 
         # Save file
         cf.save_file(self.df_data, file_path, header_lines)
@@ -27,7 +27,9 @@ def read_global_settings(default=False):
         data = json.load(json_file)
     if default == False:
         try:
-            settings = data["overwrite"]
+            # Settings that were added later on might be missing in the
+            # overwrite section, take the default values for them
+            settings = dict(data["default"], **data["overwrite"])
 
             # Update statusbar
             log_message("Global Settings Read from File")
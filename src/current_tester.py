@@ -1,5 +1,7 @@
 from PySide6 import QtCore
 
+from hardware import set_command_priority, POLLING_PRIORITY
+
 # for testing reasons
 import time
 
@@ -52,8 +54,12 @@ class CurrentTester(QtCore.QThread):
 
         pydevd.settrace(suspend=False)
 
+        # The ammeter readings must not hold up the measurements but still
+        # come before commands from the UI
+        set_command_priority(POLLING_PRIORITY)
+
         while True:
-            current_reading = self.keithley_source.read_current()
+            current_reading = self.keithley_source.submit("read_current").result()
             self.update_ammeter_signal.emit(current_reading)
             time.sleep(0.5)
 
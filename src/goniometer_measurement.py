@@ -57,7 +57,7 @@ class GoniometerMeasurement(QtCore.QThread):
         self.motor = motor
 
         self.uno = arduino_uno
-        self.uno.init_serial_connection()
+        self.uno.ensure_connection()
         self.keithley_source = keithley_source
         self.keithley_source.as_voltage_source(
             autotube_measurement_parameters["scan_compliance"]
@@ -320,118 +320,123 @@ class GoniometerMeasurement(QtCore.QThread):
             step_angle,
         )
 
-        # Move motor by given increment while giving current to OLED and reading spectrum
-        for angle in all_angles:
-            # This is checked in each iteration so that the user can interrupt
-            # the measurement after each iterration by simply pressing the
-            # pushButton again
-            if self.pause == "return":
-                cf.log_message(
-                    "Goniometer measurement aborted at angle " + str(angle) + "°"
-                )
-                self.hide_progress_bar.emit()
-                self.reset_start_button.emit(False)
-                self.keithley_source.as_voltage_source(1050)
-                self.keithley_source.set_voltage(self.setup_parameters["test_voltage"])
-                return
+        # The spectra (and iv data) measured so far are saved if the
+        # measurement fails (e.g. an instrument can not be recovered)
+        try:
+            # Move motor by given increment while giving current to OLED and reading spectrum
+            for angle in all_angles:
+                # This is checked in each iteration so that the user can interrupt
+                # the measurement after each iterration by simply pressing the
+                # pushButton again
+                if self.pause == "return":
+                    cf.log_message(
+                        "Goniometer measurement aborted at angle " + str(angle) + "°"
+                    )
+                    self.hide_progress_bar.emit()
+                    self.reset_start_button.emit(False)
+                    self.keithley_source.as_voltage_source(1050)
+                    self.keithley_source.set_voltage(self.setup_parameters["test_voltage"])
+                    return
 
-            self.motor.move_to(angle)
-            # Wait until the motor move is finished
-            while not self.parent.motor_run.isFinished():
-                time.sleep(0.1)
+                self.motor.move_to(angle)
+                # Wait until the motor move is finished
+                while not self.parent.motor_run.isFinished():
+                    time.sleep(0.1)
 
-            # self.parent.gw_animation.move(angle)
-            # self.update_animation.emit(angle)
+                # self.parent.gw_animation.move(angle)
+                # self.update_animation.emit(angle)
 
-            # Instead of defining a moving time, just read the motor position and
-            # only start the measurement when the motor is at the right position
-            # motor_position = self.motor.read_position()
+                # Instead of defining a moving time, just read the motor position and
+                # only start the measurement when the motor is at the right position
+                # motor_position = self.motor.read_position()
 
-            # while not math.isclose(motor_position, angle, abs_tol=0.01):
-            #     motor_position = self.motor.read_position()
-            #     self.update_animation.emit(motor_position)
-            #     time.sleep(0.05)
+                # while not math.isclose(motor_position, angle, abs_tol=0.01):
+                #     motor_position = self.motor.read_position()
+                #     self.update_animation.emit(motor_position)
+                #     time.sleep(0.05)
 
-            # # Update animation once more since the position might be 0.9 at this
-            # # point (int comparison in the above while loop)
-            # self.update_animation.emit(motor_position)
+                # # Update animation once more since the position might be 0.9 at this
+                # # point (int comparison in the above while loop)
+                # self.update_animation.emit(motor_position)
 
-            # Wait an additional half a second (not really needed but only to be on the
-            # save side)
-            time.sleep(0.5)
+                # Wait an additional half a second (not really needed but only to be on the
+                # save side)
+                time.sleep(0.5)
 
-            # time.sleep(self.goniometer_measurement_parameters["moving_time"])
-            # cf.log_message("Moved to angle " + str(angle) + " °")
+                # time.sleep(self.goniometer_measurement_parameters["moving_time"])
+                # cf.log_message("Moved to angle " + str(angle) + " °")
 
-            # Only activate output for EL measurement
-            if not self.goniometer_measurement_parameters["el_or_pl"]:
-                if self.goniometer_measurement_parameters["background_every_step"]:
-                    # Take background readings
-                    self.spectrum_data[str(angle) + "_bg"] = (
-                        self.spectrometer.measure()[1]
+                # Only activate output for EL measurement
+                if not self.goniometer_measurement_parameters["el_or_pl"]:
+                    if self.goniometer_measurement_parameters["background_every_step"]:
+                        # Take background readings
+                        self.spectrum_data[str(angle) + "_bg"] = (
+                            self.spectrometer.measure()[1]
+                        )
+                    self.uno.trigger_relay(self.pixel[0])
+                    oled_on_time_start = time.time()
+
+                    # The pulse duration is a valid parameter for the EL
+                    # measurements but hinders fast scans for PL measurements
+                    time.sleep(
+                        self.goniometer_measurement_parameters["oled_on_time"]
+                        # - processing_time
                     )
-                self.uno.trigger_relay(self.pixel[0])
-                oled_on_time_start = time.time()
-
-                # The pulse duration is a valid parameter for the EL
-                # measurements but hinders fast scans for PL measurements
-                time.sleep(
-                    self.goniometer_measurement_parameters["oled_on_time"]
-                    # - processing_time
-                )
 
-            # start_process = time.process_time()
+                # start_process = time.process_time()
 
-            # These measurements are only taken for el measurements
-            if not self.goniometer_measurement_parameters["el_or_pl"]:
-                # Here the keithley switches from voltage measurement to current
-                # measurement
+                # These measurements are only taken for el measurements
+                if not self.goniometer_measurement_parameters["el_or_pl"]:
+                    # Here the keithley switches from voltage measurement to current
+                    # measurement
 
-                # In the case of a voltage scan
-                if self.goniometer_measurement_parameters["voltage_or_current"]:
-                    temp_buffer = self.keithley_source.read_voltage()
+                    # Voltage and current are taken from the same reading (the
+                    # source value is read back, the other one measured)
+                    temp_buffer = self.keithley_source.read_iv()
                     data_dict = {
                         "angle": angle,
-                        "voltage": temp_buffer,
-                        "current": self.goniometer_measurement_parameters["vc_value"],
-                    }
-                else:
-                    temp_buffer = self.keithley_source.read_current() * 1e3
-                    data_dict = {
-                        "angle": angle,
-                        "voltage": self.goniometer_measurement_parameters["vc_value"],
-                        "current": temp_buffer,
+                        "voltage": temp_buffer.voltage,
+                        "current": temp_buffer.current * 1e3,
                     }
 
-                rows_list.append(data_dict)
+                    rows_list.append(data_dict)
 
-            # Now measure spectrum (wavelength and intensity) (done for EL and pl)
-            self.spectrum_data[str(angle)] = self.spectrometer.measure()[1]
+                # Now measure spectrum (wavelength and intensity) (done for EL and pl)
+                self.spectrum_data[str(angle)] = self.spectrometer.measure()[1]
 
-            # Emit a signal to update the plot (unfortunately with python 3.9
-            # or windows one can not emit pandas dataframes. Therefore, it has
-            # to be converted to a list.)
-            self.update_goniometer_spectrum_signal.emit(
-                self.spectrum_data.columns.values.tolist(),
-                self.spectrum_data.values.tolist(),
-            )
+                # Emit a signal to update the plot (unfortunately with python 3.9
+                # or windows one can not emit pandas dataframes. Therefore, it has
+                # to be converted to a list.)
+                self.update_goniometer_spectrum_signal.emit(
+                    self.spectrum_data.columns.values.tolist(),
+                    self.spectrum_data.values.tolist(),
+                )
 
-            # Only deactivate output for el (otherwise it was never activated)
-            if not self.goniometer_measurement_parameters["el_or_pl"]:
-                # self.keithley_source.deactivate_output()
-                self.uno.trigger_relay(self.pixel[0])
-                self.total_oled_on_time += time.time() - oled_on_time_start
+                # Only deactivate output for el (otherwise it was never activated)
+                if not self.goniometer_measurement_parameters["el_or_pl"]:
+                    # self.keithley_source.deactivate_output()
+                    self.uno.trigger_relay(self.pixel[0])
+                    self.total_oled_on_time += time.time() - oled_on_time_start
 
-            # Calculate the processing time it took
-            # end_process = time.process_time()
-            # processing_time = end_process - start_process
+                # Calculate the processing time it took
+                # end_process = time.process_time()
+                # processing_time = end_process - start_process
 
-            progress += 1
+                progress += 1
 
-            self.update_progress_bar.emit(
-                "value",
-                progress / np.size(all_angles) * 100,
+                self.update_progress_bar.emit(
+                    "value",
+                    progress / np.size(all_angles) * 100,
+                )
+        except Exception:
+            cf.log_message(
+                "Goniometer measurement failed. Saving the data measured so far."
             )
+            self.save_spectrum_data(self.spectrum_data)
+            if not self.goniometer_measurement_parameters["el_or_pl"]:
+                self.iv_data = pd.DataFrame(rows_list)
+                self.save_iv_data()
+            raise
 
         if self.goniometer_measurement_parameters["el_or_pl"]:
             self.pl_min_to_max_on_time = round(time.time() - absolute_starting_time, 2)
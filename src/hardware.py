@@ -7,7 +7,11 @@ import seabreeze.spectrometers as sb  # MayaLSL Modules for Ocean Spectrometer
 
 import core_functions as cf
 
-import thorlabs_apt as apt  # thorlabs apt for thorlabs motor
+try:
+    import thorlabs_apt as apt  # thorlabs apt for thorlabs motor
+except Exception:
+    # The APT library is only available on Windows
+    apt = None
 
 import sys
 import time
@@ -16,26 +20,587 @@ import re
 import numpy as np
 import math
 import copy
+import collections
+import queue
+import itertools
+import threading
+import functools
+import concurrent.futures
 
 from PySide6 import QtCore
 
+# Priorities of the instrument commands (lower values are served first)
+MEASUREMENT_PRIORITY = 0
+POLLING_PRIORITY = 1
+UI_PRIORITY = 2
+
+# Priority of the commands that are sent from the current thread
+command_priority = threading.local()
+
+
+def set_command_priority(priority):
+    """
+    Set the priority of all instrument commands that are sent from the
+    calling thread (e.g. POLLING_PRIORITY for the current tester)
+    """
+    command_priority.priority = priority
+
+
+def get_command_priority():
+    """
+    Priority of the commands of the calling thread. If it was not set, the
+    main thread (GUI) sends UI commands and all other threads measurement
+    commands.
+    """
+    if hasattr(command_priority, "priority"):
+        return command_priority.priority
+    if threading.current_thread() is threading.main_thread():
+        return UI_PRIORITY
+    return MEASUREMENT_PRIORITY
+
+
+# VISA errors after which the broker reconnects to the instrument
+RECOVERABLE_VISA_ERRORS = [
+    pyvisa.constants.StatusCode.error_connection_lost,
+    pyvisa.constants.StatusCode.error_resource_not_found,
+]
+
+
+class InstrumentBroker(QtCore.QThread):
+    """
+    Thread that owns the communication with a single instrument. All
+    commands are put into a priority queue and executed one after the other
+    so that measurement traffic is served before the ammeter polling and
+    the UI, and commands of different threads can not interleave.
+    """
+
+    def __init__(self, address):
+        super(InstrumentBroker, self).__init__()
+        self.address = address
+        self.is_killed = False
+
+        self.queue = queue.PriorityQueue()
+        # Commands of the same priority are executed in the order they came in
+        self.counter = itertools.count()
+        self.broker_thread = None
+
+        # Function of the driver that reconnects to the instrument and
+        # restores its configuration if the connection dropped
+        self.recovery = None
+
+    def submit(self, function, *args, priority=None, **kwargs):
+        """
+        Queue a command and return a future of its result. Commands that are
+        issued by a command that is already executed by the broker are
+        executed right away (otherwise they would wait for themselves).
+        """
+        if self.is_killed:
+            raise IOError("The broker of " + self.address + " was already stopped.")
+
+        future = concurrent.futures.Future()
+
+        if threading.current_thread() is self.broker_thread:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+
+        if priority is None:
+            priority = get_command_priority()
+
+        self.queue.put((priority, next(self.counter), future, function, args, kwargs))
+
+        return future
+
+    def call(self, function, *args, **kwargs):
+        """
+        Queue a command and block until its result is available
+        """
+        return self.submit(function, *args, **kwargs).result()
+
+    def run(self):
+        """
+        Execute the commands in the queue until the broker is killed
+        """
+        self.broker_thread = threading.current_thread()
+
+        while True:
+            priority, number, future, function, args, kwargs = self.queue.get()
+
+            # The broker is stopped by an empty command
+            if function is None:
+                break
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(self.execute(function, args, kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def execute(self, function, args, kwargs):
+        """
+        Execute a command. If the connection to the instrument dropped (e.g.
+        the USB cable was unplugged or the instrument power cycled), the
+        instrument is recovered and the command is executed once more so
+        that a long measurement can go on with the step it was at. Commands
+        that only read (marked with the idempotent decorator) are recovered
+        and executed once more after a timeout as well. All other VISA
+        errors (e.g. a timeout of *OPC?) are raised since the command may
+        already have been executed.
+        """
+        try:
+            return function(*args, **kwargs)
+        except pyvisa.errors.VisaIOError as e:
+            if self.recovery is None:
+                raise
+
+            if e.error_code == pyvisa.constants.StatusCode.error_timeout:
+                if not getattr(function, "idempotent", False):
+                    raise
+                if self.probe():
+                    state = "answers"
+                else:
+                    state = "does not answer"
+                cf.log_message(
+                    "Communication with "
+                    + self.address
+                    + " timed out ("
+                    + str(e)
+                    + "), the instrument "
+                    + state
+                    + " to *IDN?. Reconnecting."
+                )
+            elif e.error_code in RECOVERABLE_VISA_ERRORS:
+                cf.log_message(
+                    "Communication with "
+                    + self.address
+                    + " failed ("
+                    + str(e)
+                    + "). Reconnecting."
+                )
+            else:
+                raise
+
+            self.recovery()
+            return function(*args, **kwargs)
+
+    def probe(self):
+        """
+        Check if the instrument still answers after a command timed out. The
+        commands and output that are still pending are discarded first (device
+        clear) so that the answer is not mistaken for the one of the timed out
+        command.
+        """
+        session = instrument_registry.open_resource(self.address)
+
+        try:
+            session.clear()
+            session.query("*IDN?")
+        except pyvisa.errors.VisaIOError:
+            return False
+
+        return True
+
+    def kill(self):
+        """
+        Stop the broker after all commands that were already queued
+        """
+        self.is_killed = True
+        self.queue.put((UI_PRIORITY + 1, next(self.counter), None, None, (), {}))
+        self.wait()
+
+
+def brokered(method):
+    """
+    Decorator for instrument methods that have to be executed by the broker
+    of the instrument. The caller is blocked until the command was executed.
+    """
+
+    @functools.wraps(method)
+    def brokered_method(self, *args, **kwargs):
+        return self.broker.call(method, self, *args, **kwargs)
+
+    return brokered_method
+
+
+def idempotent(method):
+    """
+    Decorator for instrument methods that only read and can therefore be
+    executed once more if they timed out (it has to be applied before
+    brokered)
+    """
+    method.idempotent = True
+
+    return method
+
+
+class InstrumentRegistry:
+    """
+    Process-wide registry that owns the only pyvisa resource manager, caches
+    the (slow) enumeration of the resources and hands out the open sessions
+    to the instruments so that they can be reused.
+    """
+
+    def __init__(self):
+        # Define a mutex
+        self.mutex = QtCore.QRecursiveMutex()
+
+        self.rm = None
+        self.visa_resources = None
+        self.sessions = {}
+        self.brokers = {}
+
+    def resource_manager(self):
+        """
+        Return the resource manager (it is only created on first use)
+        """
+        self.mutex.lock()
+        if self.rm is None:
+            self.rm = pyvisa.ResourceManager()
+        self.mutex.unlock()
+
+        return self.rm
+
+    def set_resource_manager(self, rm):
+        """
+        Replace the resource manager (e.g. by a simulated one). All open
+        sessions and the cached resources are dropped.
+        """
+        self.mutex.lock()
+        self.close()
+        self.rm = rm
+        self.mutex.unlock()
+
+    def list_resources(self, refresh=False):
+        """
+        Return the addresses of all connected resources. The enumeration is
+        only done if it was not done before or if refresh is True.
+        """
+        self.mutex.lock()
+        if self.visa_resources is None or refresh:
+            self.visa_resources = self.resource_manager().list_resources()
+        visa_resources = self.visa_resources
+        self.mutex.unlock()
+
+        return visa_resources
+
+    def refresh(self):
+        """
+        Enumerate the resources again (e.g. after reconnecting a device)
+        """
+        return self.list_resources(refresh=True)
+
+    def is_present(self, address):
+        """
+        Check if a resource is connected. If it is not in the cached list, the
+        resources are enumerated again before giving up.
+        """
+        self.mutex.lock()
+        present = address in self.list_resources() or address in self.refresh()
+        self.mutex.unlock()
+
+        return present
+
+    def open_resource(self, address):
+        """
+        Return an open session to the resource. An already open session is
+        reused instead of opening another one.
+        """
+        self.mutex.lock()
+        try:
+            if address not in self.sessions:
+                self.sessions[address] = self.resource_manager().open_resource(address)
+            session = self.sessions[address]
+        finally:
+            self.mutex.unlock()
+
+        return session
+
+    def reopen_resource(self, address, attempts=10, delay=1):
+        """
+        Close the session to a resource and open it again (e.g. after the
+        connection dropped). The session object stays the same so that all
+        drivers can keep using it. Opening is tried attempts times, delay s
+        apart, since a device takes a while to reappear after it reconnected.
+        """
+        self.mutex.lock()
+        try:
+            session = self.sessions[address]
+
+            # The timeout is a property of the session that is lost
+            try:
+                timeout = session.timeout
+            except pyvisa.errors.Error:
+                timeout = None
+            try:
+                session.close()
+            except pyvisa.errors.Error:
+                pass
+
+            for attempt in range(attempts):
+                try:
+                    session.open()
+                    break
+                except pyvisa.errors.Error:
+                    if attempt == attempts - 1:
+                        raise
+                    time.sleep(delay)
+
+            if timeout is not None:
+                session.timeout = timeout
+        finally:
+            self.mutex.unlock()
+
+        return session
+
+    def broker(self, address):
+        """
+        Return the broker thread of the resource (there is only one per
+        resource, no matter how many instances of the driver exist)
+        """
+        self.mutex.lock()
+        if address not in self.brokers:
+            self.brokers[address] = InstrumentBroker(address)
+            self.brokers[address].start()
+        broker = self.brokers[address]
+        self.mutex.unlock()
+
+        return broker
+
+    def close_resource(self, address):
+        """
+        Close the session to a single resource
+        """
+        self.mutex.lock()
+        if address in self.sessions:
+            self.sessions.pop(address).close()
+        self.mutex.unlock()
+
+    def close(self):
+        """
+        Close all sessions and the resource manager
+        """
+        self.mutex.lock()
+        # Let the brokers finish their last commands first
+        for address in list(self.brokers.keys()):
+            self.brokers.pop(address).kill()
+
+        for address in list(self.sessions.keys()):
+            try:
+                self.close_resource(address)
+            except pyvisa.errors.Error:
+                cf.log_message("Session to " + address + " could not be closed")
+
+        if self.rm is not None:
+            self.rm.close()
+            self.rm = None
+        self.visa_resources = None
+        self.mutex.unlock()
+
+
+# The one registry that is used by all instruments
+instrument_registry = InstrumentRegistry()
+
+
+def read_error_queue(
+    session, instrument_name, max_errors=100, error_query="SYSTem:ERRor?"
+):
+    """
+    Read all errors from the error queue of a SCPI instrument, log them and
+    return them as a list. The queue is only read at checkpoints (e.g. after
+    each pixel) instead of after every command to not slow down the
+    measurements. error_query must return the next error as
+    <code>,"<message>" (code 0 if the queue is empty).
+    """
+    errors = []
+    for i in range(max_errors):
+        error = session.query(error_query).strip()
+
+        # The queue is empty
+        if int(error.split(",")[0]) == 0:
+            break
+
+        errors.append(error)
+        cf.log_message(instrument_name + " reported error " + error)
+
+    return errors
+
+
+class ArduinoReader(QtCore.QThread):
+    """
+    Thread that reads everything the Arduino sends and puts the parsed
+    replies into a queue. Binary frames become ("frame", status, mask),
+    text lines become ("line", text). The text is only written to the debug
+    log so that the measurement loops do not have to wait for it.
+    """
+
+    def __init__(self, com):
+        super(ArduinoReader, self).__init__()
+        self.com = com
+        self.is_killed = False
+
+        self.replies = queue.Queue()
+        self.buffer = bytearray()
+
+        # The end of a relay schedule is announced by the Arduino on its own.
+        # It is not put into the queue so that other commands can not throw
+        # it away.
+        self.schedule_done = threading.Event()
+        self.schedule_mask = None
+
+    def run(self):
+        """
+        Read from the serial port until the reader is killed
+        """
+        while not self.is_killed:
+            try:
+                # Wait for at least one byte (the port has a short timeout)
+                data = self.com.read(max(self.com.in_waiting, 1))
+            except (serial.SerialException, TypeError, AttributeError, OSError):
+                # The port was closed underneath the reader
+                break
+
+            if data:
+                self.buffer += data
+                self.parse()
+
+    def parse(self):
+        """
+        Split the received bytes into frames and text lines
+        """
+        while self.buffer:
+            if self.buffer[0] == ArduinoUno.FRAME_START:
+                # Binary frames always have four bytes
+                if len(self.buffer) < 4:
+                    return
+                frame = bytes(self.buffer[:4])
+                del self.buffer[:4]
+
+                if frame[1] ^ frame[2] != frame[3]:
+                    logging.debug("Corrupted Arduino frame " + frame.hex())
+                elif frame[1] == ArduinoUno.SCHEDULE_DONE:
+                    self.schedule_mask = frame[2]
+                    self.schedule_done.set()
+                else:
+                    self.replies.put(("frame", frame[1], frame[2]))
+                continue
+
+            # Text lines end with a line feed. A frame can follow the text
+            # right away, so the text also ends before the next frame start
+            # (the bytes of a frame, e.g. a relay mask of 0x0A, are never
+            # taken as text).
+            end = self.buffer.find(b"\n")
+            frame_start = self.buffer.find(ArduinoUno.FRAME_START)
+            if frame_start != -1 and (end == -1 or frame_start < end):
+                end = frame_start - 1
+            elif end == -1:
+                return
+            line = bytes(self.buffer[: end + 1]).decode("ascii", "replace").strip()
+            del self.buffer[: end + 1]
+
+            if line:
+                logging.debug("Arduino: " + line)
+                self.replies.put(("line", line))
+
+    def clear(self):
+        """
+        Throw away all replies that were not collected yet
+        """
+        while True:
+            try:
+                self.replies.get_nowait()
+            except queue.Empty:
+                return
+
+    def wait_for(self, match, timeout=0.5):
+        """
+        Return the first reply for which match(reply) is true or None if
+        none arrived within the timeout. Replies that do not match (like the
+        echo of the firmware) are dropped.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                reply = self.replies.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if match(reply):
+                return reply
+
+    def kill(self):
+        """
+        Stop the reader
+        """
+        self.is_killed = True
+        self.wait()
+
 
 class ArduinoUno:
     """
     Class that manages all functionality of our arduino uno
     """
 
+    # Bytes of the framed relay protocol (see switchbox_driver.ino)
+    FRAME_START = 0xAA
+    SET_RELAYS = ord("M")
+    GET_RELAYS = ord("Q")
+    CLEAR_SCHEDULE = ord("C")
+    SET_STEP = ord("A")
+    RUN_SCHEDULE = ord("R")
+    STOP_SCHEDULE = ord("X")
+    SET_TRIGGER = ord("T")
+    PULSE_TRIGGER = ord("P")
+    ACK = 0x06
+    NAK = 0x15
+    SCHEDULE_DONE = 0x04
+
+    # Number of steps the firmware can store and the longest dwell time of a
+    # single step (in ms)
+    MAX_SCHEDULE_STEPS = 32
+    MAX_DWELL = 65535
+
+    # Longest settling time and pulse width of the trigger output (in s)
+    MAX_TRIGGER_TIME = 65535e-6
+
+    # Number of relays (pixels) of the switchbox
+    number_of_pixels = 8
+
     def __init__(self, com_address):
+        """
+        Connect to the Arduino. com_address is either its VISA address (e.g.
+        ASRL3::INSTR, as in the settings) or directly the name of its serial
+        port (e.g. COM3, /dev/ttyACM0 or the pseudo terminal of the switchbox
+        emulator in the tests). The program exits if the Arduino is missing.
+        """
         # Define a mutex
         self.mutex = QtCore.QRecursiveMutex()
 
-        # Check for devices on the pc
-        rm = pyvisa.ResourceManager()
-        # The actual addresses for the Keithleys can be accessed via rm.list_resources()
-        visa_resources = rm.list_resources()
+        # State of the relays as last reported by the Arduino (bit 0 is
+        # relay 1). The relays are all off after the Arduino started.
+        self.relay_mask = 0
+
+        # Thread that collects the replies of the Arduino
+        self.reader = None
+
+        # Duration and expected end of the last relay schedule (in s)
+        self.schedule_duration = 0
+        self.schedule_end = 0
+
+        # Time between switching the relays and the trigger pulse (in s,
+        # None if no pulse is sent)
+        self.trigger_settling_time = None
 
         # Open COM port to Arduino
-        if com_address not in visa_resources:
+        if self.is_visa_address(com_address) and not instrument_registry.is_present(
+            com_address
+        ):
             cf.log_message(
                 "The Arduino Uno seems to be missing. Try to reconnect to computer."
             )
@@ -45,13 +610,16 @@ class ArduinoUno:
             # )
             sys.exit()
 
-        # Instead of letting the user explicitly define the COM port after he
-        # already defined the com_address, search for the number in the
-        # com_address to construct the right string
-        uno_port = "COM" + re.findall(r"\d+", com_address)[0]
+        uno_port = self.serial_port(com_address)
 
         # assign name to Arduino and assign short timeout to be able to do things fast
-        self.uno = serial.Serial(uno_port, timeout=0.01)
+        try:
+            self.uno = serial.Serial(uno_port, timeout=0.01)
+        except serial.SerialException:
+            cf.log_message(
+                "The Arduino Uno seems to be missing. Try to reconnect to computer."
+            )
+            sys.exit()
 
         # Try to open the serial connection
         try:
@@ -73,7 +641,29 @@ class ArduinoUno:
 
         # cf.log_message("Arduino successfully initiated")
 
-    def init_serial_connection(self, wait=1):
+    @staticmethod
+    def is_visa_address(com_address):
+        """
+        Check if the Arduino is given by its VISA address instead of the name
+        of its serial port
+        """
+        return com_address.upper().startswith("ASRL")
+
+    @staticmethod
+    def serial_port(com_address):
+        """
+        Return the name of the serial port of the Arduino. Instead of letting
+        the user define the COM port on top of the com_address, the number in
+        a VISA address is searched for to construct the right string
+        (ASRL3::INSTR is COM3). The names of serial ports are returned as they
+        are.
+        """
+        if ArduinoUno.is_visa_address(com_address):
+            return "COM" + re.findall(r"\d+", com_address)[0]
+
+        return com_address
+
+    def init_serial_connection(self, wait=2):
         """
         Private function
         Initialise serial connection to com.
@@ -84,11 +674,15 @@ class ArduinoUno:
                 > uno = serial.Serial(2, timeout=0.2)
                 > uno_init(com=uno)
         wait: flt
-            time in seconds to wait before collecting initialisation message.
+            maximum time in seconds to wait for the initialisation message
+            (opening the port restarts the Uno).
         """
 
         self.mutex.lock()
 
+        # Stop a reader that is still running from an earlier connection
+        self.stop_reader()
+
         # Open serial port
         try:
             self.uno.open()
@@ -96,23 +690,80 @@ class ArduinoUno:
             # If port was already open, we do not have to open it obviously.
             cf.log_message("Arduino port was already open")
 
-        # Wait for a defined period of time
-        time.sleep(wait)
-
-        # Read serial port result
-        cf.log_message(
-            "Arduino serial port successfully initialised with "
-            + str(self.uno.readall())
-        )
         # self.queue.put(com.readall())
         self.serial_connection_open = True
+
+        # From now on all replies are collected by the reader thread
+        self.reader = ArduinoReader(self.uno)
+        self.reader.start()
+
+        # The Uno greets as soon as it is ready after the restart. If it
+        # was not restarted it has to answer a ping instead.
+        intro = self.reader.wait_for(
+            lambda reply: reply[0] == "line" and "Ready" in reply[1], wait
+        )
+        if intro is not None:
+            cf.log_message(
+                "Arduino serial port successfully initialised with " + intro[1]
+            )
+        elif self.ping():
+            cf.log_message("Arduino serial port successfully initialised")
+        else:
+            cf.log_message("Arduino does not answer on its serial port")
+
         self.mutex.unlock()
 
+    def ping(self, timeout=0.1):
+        """
+        Check if the Arduino answers (and read the state of its relays on
+        the way). Does not try to open the connection.
+        """
+        self.mutex.lock()
+
+        try:
+            if (
+                not self.serial_connection_open
+                or self.reader is None
+                or not self.reader.isRunning()
+            ):
+                return False
+
+            self.exchange_frame(self.GET_RELAYS, attempts=1, timeout=timeout)
+            return True
+        except IOError:
+            return False
+        finally:
+            self.mutex.unlock()
+
+    def ensure_connection(self):
+        """
+        Make sure the switchbox can be used. The session is kept open between
+        measurements and the port is only opened again (which restarts the
+        Uno) if the Arduino does not answer a ping.
+        """
+        self.mutex.lock()
+
+        if not self.ping():
+            cf.log_message("Arduino does not answer. Reopening the serial port.")
+            self.close_serial_connection()
+            self.init_serial_connection()
+
+        self.mutex.unlock()
+
+    def stop_reader(self):
+        """
+        Stop the thread that reads the replies of the Arduino
+        """
+        if self.reader is not None:
+            self.reader.kill()
+            self.reader = None
+
     def close_serial_connection(self):
         """
         Close connection to arduino
         """
         self.mutex.lock()
+        self.stop_reader()
         self.uno.close()
         self.serial_connection_open = False
         self.mutex.unlock()
@@ -124,7 +775,7 @@ class ArduinoUno:
         relay: int
             If relay == [1-8], the according relay opens or closes
             If relay == 0, all relays close
-            If relay == 9, all relays open
+            If relay == 9 (number_of_pixels + 1), all relays open
         """
         self.mutex.lock()
         com = self.uno
@@ -135,208 +786,1874 @@ class ArduinoUno:
         # If the number is in the range [0, 9] the command is correct
         if relay not in np.arange(0, 10, 1):
             cf.log_message("Unknown arduino serial communication command")
+            self.mutex.unlock()
+            return
+
+        self.reader.clear()
+        try:
+            com.write(str.encode(str(relay)))
+        except serial.SerialException:
+            cf.log_message(
+                "Serial connection not established. Please make sure to do so before attempting to trigger a relay."
+            )
+            self.mutex.unlock()
+            return
+
+        # The firmware acknowledges every switching with a line that starts
+        # with "Switched" (after echoing the received byte)
+        reply = self.reader.wait_for(
+            lambda reply: reply[0] == "line" and reply[1].startswith("Switched")
+        )
+
+        if reply is None:
+            cf.log_message("Arduino did not acknowledge relay command " + str(relay))
+        elif reply[1] == "Switched off all Relays":
+            self.relay_mask = 0
+        elif reply[1] == "Switched on all Relays":
+            self.relay_mask = 0xFF
         else:
-            try:
-                com.write(str.encode(str(relay)))
-            except serial.SerialException:
-                cf.log_message(
-                    "Serial connection not established. Please make sure to do so before attempting to trigger a relay."
-                )
+            # Keep track of what the toggle did to the relays
+            bit = 1 << (int(relay) - 1)
+            if reply[1].startswith("Switched on"):
+                self.relay_mask |= bit
+            else:
+                self.relay_mask &= ~bit
 
-        cf.log_message(com.readall())
         self.mutex.unlock()
 
-    def close(self):
+    @staticmethod
+    def pixels_to_mask(pixels):
         """
-        Function that is called before program is closed to make sure that
-        all relays are closed
+        Relay mask that turns on exactly the given pixels (1-8)
         """
-        self.mutex.lock()
-        self.trigger_relay(0)
-        time.sleep(1)
-        self.close_serial_connection()
-        self.mutex.unlock()
-
-
-class KeithleySource:
-    """
-    Class that manages all functionality of our Keithley voltage/current source
-    """
+        mask = 0
+        for pixel in pixels:
+            mask |= 1 << (int(pixel) - 1)
+        return mask
 
-    def __init__(self, keithley_source_address, current_compliance):
+    def exchange_frame(self, command, payload=0, attempts=3, timeout=0.5):
         """
-        Initialise Hardware. This function must be improved later as well.
-        For the time being it is probably alright.
+        Send one frame of the binary relay protocol and return the relay
+        mask the Arduino answers with. The payload is a single byte or a list
+        of bytes. Frames that are not acknowledged are sent again (up to
+        attempts times).
         """
-        # Define a mutex
-        self.mutex = QtCore.QRecursiveMutex()
+        self.mutex.lock()
+        com = self.uno
 
-        # Keithley Finding Device
-        rm = pyvisa.ResourceManager()
-        # The actual addresses for the Keithleys can be accessed via rm.list_resources()
-        visa_resources = rm.list_resources()
+        if self.serial_connection_open == False:
+            self.init_serial_connection()
+
+        if isinstance(payload, int):
+            payload = [payload]
+        checksum = functools.reduce(lambda a, b: a ^ b, payload, command)
+        frame = bytes([self.FRAME_START, command, *payload, checksum])
+
+        try:
+            for attempt in range(attempts):
+                # Throw away whatever is left over from earlier commands so
+                # that it can not be mistaken for the reply
+                self.reader.clear()
+                com.write(frame)
+
+                # Wait for the binary reply to this frame
+                reply = self.reader.wait_for(lambda reply: reply[0] == "frame", timeout)
+
+                if reply is not None and reply[1] == self.ACK:
+                    self.relay_mask = reply[2]
+                    return self.relay_mask
+
+                cf.log_message(
+                    "Arduino did not acknowledge relay frame "
+                    + frame.hex()
+                    + " (reply "
+                    + str(reply)
+                    + ")"
+                )
+        except serial.SerialException:
+            cf.log_message(
+                "Serial connection not established. Please make sure to do so before attempting to trigger a relay."
+            )
+        finally:
+            self.mutex.unlock()
+
+        raise IOError("Arduino did not acknowledge relay frame " + frame.hex())
+
+    def set_relays(self, mask):
+        """
+        Set all eight relays at once. Bit n of the mask (0-7) turns relay
+        n + 1 on, a cleared bit turns it off. Other than trigger_relay this
+        does not depend on the previous state of the relays and needs a
+        single round trip. Returns the relay mask reported by the Arduino.
+        """
+        if mask not in range(0, 256):
+            cf.log_message("Relay mask " + str(mask) + " out of range")
+            return self.relay_mask
+
+        reported_mask = self.exchange_frame(self.SET_RELAYS, int(mask))
+
+        if reported_mask != mask:
+            cf.log_message(
+                "Arduino reports relay mask "
+                + format(reported_mask, "08b")
+                + " instead of "
+                + format(mask, "08b")
+            )
+
+        return reported_mask
+
+    def read_relays(self):
+        """
+        Ask the Arduino which relays are on
+        """
+        return self.exchange_frame(self.GET_RELAYS)
+
+    def configure_trigger(self, settling_time, pulse_width=1e-5):
+        """
+        Let the switchbox send an active-low pulse on its trigger output
+        (pin 7) settling_time seconds after the relays were switched by
+        set_relays or a schedule step. The pulse can start the trigger model
+        of the Keithley source (see init_triggered_measurement) or an armed
+        acquisition of the multimeter (see arm_external_acquisition). A
+        pulse_width of 0 turns the pulse off.
+        """
+        if not (
+            0 <= settling_time <= self.MAX_TRIGGER_TIME
+            and 0 <= pulse_width <= self.MAX_TRIGGER_TIME
+        ):
+            raise ValueError(
+                "Trigger settling time and pulse width can be at most "
+                + str(self.MAX_TRIGGER_TIME)
+                + " s"
+            )
+
+        settle = int(round(settling_time * 1e6))
+        width = int(round(pulse_width * 1e6))
+
+        self.exchange_frame(
+            self.SET_TRIGGER, [settle & 0xFF, settle >> 8, width & 0xFF, width >> 8]
+        )
+
+        if width > 0:
+            self.trigger_settling_time = settling_time
+        else:
+            self.trigger_settling_time = None
+
+    def send_trigger(self):
+        """
+        Send a trigger pulse right away (the trigger output must be
+        configured)
+        """
+        if self.trigger_settling_time is None:
+            raise IOError("The trigger output of the Arduino is not configured")
+
+        self.exchange_frame(self.PULSE_TRIGGER)
+
+    def upload_schedule(self, steps):
+        """
+        Store a relay schedule on the Arduino. steps is a list of
+        (relay mask, dwell time in ms) that are switched one after the other
+        once the schedule is started. Dwell times that are longer than a
+        single step can hold are split into several steps.
+        """
+        # Split long dwell times
+        firmware_steps = []
+        for mask, dwell in steps:
+            dwell = int(round(dwell))
+            while dwell > self.MAX_DWELL:
+                firmware_steps.append((mask, self.MAX_DWELL))
+                dwell -= self.MAX_DWELL
+            firmware_steps.append((mask, dwell))
+
+        if len(firmware_steps) > self.MAX_SCHEDULE_STEPS:
+            raise ValueError(
+                "Relay schedules can have at most "
+                + str(self.MAX_SCHEDULE_STEPS)
+                + " steps"
+            )
+
+        self.mutex.lock()
+
+        try:
+            self.exchange_frame(self.CLEAR_SCHEDULE)
+
+            # Every step is written to its index so that a resent frame
+            # does not append it twice
+            for index, (mask, dwell) in enumerate(firmware_steps):
+                self.exchange_frame(
+                    self.SET_STEP, [index, int(mask), dwell & 0xFF, dwell >> 8]
+                )
+        finally:
+            self.mutex.unlock()
+
+        # Time the schedule will take (in s)
+        self.schedule_duration = sum(dwell for mask, dwell in firmware_steps) / 1000
+
+    def start_schedule(self):
+        """
+        Run the uploaded relay schedule. The timing is kept by the Arduino,
+        use await_schedule to wait for the end.
+        """
+        self.mutex.lock()
+
+        try:
+            if self.serial_connection_open == False:
+                self.init_serial_connection()
+
+            self.reader.schedule_done.clear()
+            self.exchange_frame(self.RUN_SCHEDULE)
+        finally:
+            self.mutex.unlock()
+
+        self.schedule_end = time.monotonic() + self.schedule_duration
 
+    def await_schedule(self, timeout=1):
+        """
+        Wait until the Arduino reports the end of the running schedule and
+        return the relay mask it ended with. timeout is the time in s that is
+        waited on top of the expected end of the schedule.
+        """
+        remaining = self.schedule_end - time.monotonic() + timeout
+
+        if not self.reader.schedule_done.wait(max(remaining, 0)):
+            raise IOError("Arduino did not report the end of the relay schedule")
+
+        self.relay_mask = self.reader.schedule_mask
+        return self.relay_mask
+
+    def run_schedule(self, steps):
+        """
+        Upload a relay schedule, run it and wait until it is done
+        """
+        self.upload_schedule(steps)
+        self.start_schedule()
+        return self.await_schedule()
+
+    def stop_schedule(self):
+        """
+        Stop a running schedule (this switches all relays off)
+        """
+        return self.exchange_frame(self.STOP_SCHEDULE)
+
+    def close(self):
+        """
+        Function that is called before program is closed to make sure that
+        all relays are closed
+        """
+        self.mutex.lock()
+        self.trigger_relay(0)
+        self.close_serial_connection()
+        self.mutex.unlock()
+
+
+class SwitchboxArray:
+    """
+    Several switchbox boards with eight relays each that are addressed like
+    a single switchbox with a flat pixel index (pixels 1-8 are on the first
+    board, 9-16 on the second and so on). It has the same interface as
+    ArduinoUno. The boards are driven in parallel so that switching any set
+    of pixels takes one frame per board and about the time of a single
+    round trip. Relay masks have one bit per pixel (bit 0 is pixel 1).
+    """
+
+    PIXELS_PER_BOARD = 8
+
+    def __init__(self, com_addresses, trigger_board=0):
+        # Define a mutex
+        self.mutex = QtCore.QRecursiveMutex()
+
+        # Every board gets its own thread so that they can be waited for at
+        # the same time
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(com_addresses)
+        )
+
+        # Connect to all boards at once (each might have to wait for its
+        # restart)
+        futures = [
+            self.executor.submit(ArduinoUno, address) for address in com_addresses
+        ]
+        concurrent.futures.wait(futures)
+        self.boards = [
+            future.result() for future in futures if future.exception() is None
+        ]
+
+        # Do not leave the boards that could be opened switched on and their
+        # ports open if one of them failed (ArduinoUno exits if it is
+        # missing)
+        failures = [
+            future.exception() for future in futures if future.exception() is not None
+        ]
+        if len(failures) > 0:
+            for board in self.boards:
+                board.close()
+            self.executor.shutdown()
+            raise failures[0]
+
+        self.number_of_pixels = self.PIXELS_PER_BOARD * len(self.boards)
+
+        # The board whose trigger output is connected to the instruments
+        self.trigger_board = trigger_board
+
+    def on_all_boards(self, method_name, arguments=None):
+        """
+        Call a method of all boards in parallel (arguments is a tuple of
+        arguments per board) and return the results in the order of the
+        boards
+        """
+        if arguments is None:
+            arguments = [()] * len(self.boards)
+
+        futures = [
+            self.executor.submit(getattr(board, method_name), *board_arguments)
+            for board, board_arguments in zip(self.boards, arguments)
+        ]
+
+        return [future.result() for future in futures]
+
+    def split_mask(self, mask):
+        """
+        Split a relay mask of all pixels into the masks of the boards
+        """
+        return [
+            (int(mask) >> (self.PIXELS_PER_BOARD * i)) & 0xFF
+            for i in range(len(self.boards))
+        ]
+
+    def join_masks(self, masks):
+        """
+        Combine the relay masks of the boards into one mask of all pixels
+        """
+        mask = 0
+        for i, board_mask in enumerate(masks):
+            mask |= board_mask << (self.PIXELS_PER_BOARD * i)
+        return mask
+
+    @property
+    def relay_mask(self):
+        """
+        State of all relays as last reported by the boards
+        """
+        return self.join_masks([board.relay_mask for board in self.boards])
+
+    @staticmethod
+    def pixels_to_mask(pixels):
+        """
+        Relay mask that turns on exactly the given pixels
+        """
+        return ArduinoUno.pixels_to_mask(pixels)
+
+    def init_serial_connection(self):
+        """
+        Initialise the serial connection to all boards
+        """
+        self.on_all_boards("init_serial_connection")
+
+    def close_serial_connection(self):
+        """
+        Close the connection to all boards
+        """
+        self.on_all_boards("close_serial_connection")
+
+    def ping(self):
+        """
+        Check if all boards answer
+        """
+        return all(self.on_all_boards("ping"))
+
+    def ensure_connection(self):
+        """
+        Make sure all boards can be used (only boards that do not answer a
+        ping are opened again)
+        """
+        self.on_all_boards("ensure_connection")
+
+    def trigger_relay(self, relay):
+        """
+        Toggle the relay of a pixel (1 to number_of_pixels), turn all relays
+        off (0) or on (number_of_pixels + 1). This is the same as for a
+        single ArduinoUno whose 9 turns all eight relays on.
+        """
+        if relay == 0:
+            self.on_all_boards("trigger_relay", [(0,)] * len(self.boards))
+        elif relay == self.number_of_pixels + 1:
+            self.on_all_boards(
+                "trigger_relay", [(self.PIXELS_PER_BOARD + 1,)] * len(self.boards)
+            )
+        elif relay in range(1, self.number_of_pixels + 1):
+            board, local_relay = divmod(int(relay) - 1, self.PIXELS_PER_BOARD)
+            self.boards[board].trigger_relay(local_relay + 1)
+        else:
+            cf.log_message("Unknown arduino serial communication command")
+
+    def set_relays(self, mask):
+        """
+        Set the relays of all pixels at once (one frame per board, the boards
+        in parallel). Returns the relay mask reported by the boards.
+        """
+        if mask not in range(0, 1 << self.number_of_pixels):
+            cf.log_message("Relay mask " + str(mask) + " out of range")
+            return self.relay_mask
+
+        return self.join_masks(
+            self.on_all_boards(
+                "set_relays", [(board_mask,) for board_mask in self.split_mask(mask)]
+            )
+        )
+
+    def read_relays(self):
+        """
+        Ask all boards which relays are on
+        """
+        return self.join_masks(self.on_all_boards("read_relays"))
+
+    def upload_schedule(self, steps):
+        """
+        Store a relay schedule (list of (relay mask of all pixels, dwell time
+        in ms)) on all boards. Each board only gets the steps that change its
+        own relays, the dwell times of the steps in between are added to
+        the step before. All boards therefore switch at the same times as
+        the whole schedule and finish together, and a board only has to
+        hold the steps of its own pixels (plus the steps that keep it in
+        time) instead of all steps of the schedule.
+        """
+        board_steps = [[] for board in self.boards]
+        for mask, dwell in steps:
+            for i, board_mask in enumerate(self.split_mask(mask)):
+                if len(board_steps[i]) > 0 and board_steps[i][-1][0] == board_mask:
+                    board_steps[i][-1] = (board_mask, board_steps[i][-1][1] + dwell)
+                else:
+                    board_steps[i].append((board_mask, dwell))
+
+        self.on_all_boards("upload_schedule", [(steps,) for steps in board_steps])
+
+    def start_schedule(self):
+        """
+        Run the uploaded schedule on all boards (they start within the time
+        of a round trip of each other)
+        """
+        self.on_all_boards("start_schedule")
+
+    def await_schedule(self, timeout=1):
+        """
+        Wait until all boards finished their schedule and return the relay
+        mask they ended with
+        """
+        return self.join_masks(
+            self.on_all_boards("await_schedule", [(timeout,)] * len(self.boards))
+        )
+
+    def run_schedule(self, steps):
+        """
+        Upload a relay schedule, run it and wait until it is done
+        """
+        self.upload_schedule(steps)
+        self.start_schedule()
+        return self.await_schedule()
+
+    def stop_schedule(self):
+        """
+        Stop a running schedule on all boards (this switches all relays off)
+        """
+        return self.join_masks(self.on_all_boards("stop_schedule"))
+
+    def configure_trigger(self, settling_time, pulse_width=1e-5):
+        """
+        Configure the trigger output of the trigger board. Since set_relays
+        always sends a frame to every board, the trigger board pulses on
+        every switching, no matter which pixels changed.
+        """
+        self.boards[self.trigger_board].configure_trigger(settling_time, pulse_width)
+
+    @property
+    def trigger_settling_time(self):
+        return self.boards[self.trigger_board].trigger_settling_time
+
+    def send_trigger(self):
+        """
+        Send a trigger pulse from the trigger board right away
+        """
+        self.boards[self.trigger_board].send_trigger()
+
+    def close(self):
+        """
+        Turn off all relays and close the connection to all boards
+        """
+        self.on_all_boards("close")
+        self.executor.shutdown()
+
+
+# TSP script that runs a complete JVL sweep on the Keithley source. The
+# levels are collected with jvl_append, jvl_sweep sources them one after the
+# other, pulses the digital I/O line (photodiode trigger) before each
+# measurement, stops at the current limit and prints the readings in chunks
+# (source value, reading, relative timestamp) followed by "END <status>".
+JVL_SWEEP_SCRIPT = """
+jvl_levels = {}
+function jvl_append(values)
+    for i = 1, table.getn(values) do
+        table.insert(jvl_levels, values[i])
+    end
+end
+function jvl_sweep(ilimit, source_delay, nplc, chunk, digout)
+    local n = table.getn(jvl_levels)
+    if jvl_buffer ~= nil then
+        buffer.delete(jvl_buffer)
+    end
+    jvl_buffer = buffer.make(math.max(n, 10))
+    smu.source.func = smu.FUNC_DC_VOLTAGE
+    smu.measure.func = smu.FUNC_DC_CURRENT
+    smu.source.ilimit.level = ilimit
+    smu.source.readback = smu.ON
+    smu.source.autodelay = smu.OFF
+    smu.measure.nplc = nplc
+    smu.measure.autozero.enable = smu.OFF
+    if digout > 0 then
+        digio.line[digout].mode = digio.MODE_TRIGGER_OUT
+        trigger.digout[digout].logic = trigger.LOGIC_NEGATIVE
+        trigger.digout[digout].pulsewidth = 1e-5
+    end
+    local status = "DONE"
+    local printed = 0
+    local i = 0
+    smu.source.level = jvl_levels[1]
+    smu.source.output = smu.ON
+    while i < n do
+        i = i + 1
+        smu.source.level = jvl_levels[i]
+        delay(source_delay)
+        if digout > 0 then
+            trigger.digout[digout].assert()
+        end
+        smu.measure.read(jvl_buffer)
+        if smu.source.ilimit.tripped == smu.ON then
+            status = "COMPLIANCE"
+        end
+        if i - printed >= chunk or status ~= "DONE" or i == n then
+            printbuffer(printed + 1, i, jvl_buffer.sourcevalues, jvl_buffer.readings, jvl_buffer.relativetimestamps)
+            printed = i
+        end
+        if status ~= "DONE" then
+            break
+        end
+    end
+    smu.source.output = smu.OFF
+    if digout > 0 then
+        for j = i + 1, n do
+            delay(source_delay)
+            trigger.digout[digout].assert()
+        end
+    end
+    print("END " .. status)
+end
+"""
+
+
+# Single reading of the Keithley source: voltage (V) and current (A) of the
+# same trigger, its timestamp (s) on the instrument's clock and the
+# integration time (in power line cycles) of the measured value
+IVReading = collections.namedtuple(
+    "IVReading", ["voltage", "current", "timestamp", "nplc"]
+)
+
+
+class IntegrationTimePolicy:
+    """
+    Chooses the integration time (in power line cycles) of a reading from
+    the magnitude of the previous one. The noise of a reading is assumed to
+    be noise_floor (in the unit of the reading) at 1 NPLC and to decrease
+    with the square root of the integration time. The shortest of the
+    instrument's nplc_values is chosen that keeps the noise relative to the
+    previous reading below target_noise, so that large signals are read
+    quickly and small ones still with the longest integration time.
+    """
+
+    def __init__(self, noise_floor, target_noise, nplc_values):
+        self.noise_floor = noise_floor
+        self.target_noise = target_noise
+        self.nplc_values = sorted(nplc_values)
+        self.last_reading = None
+
+    def next_nplc(self):
+        """
+        Return the integration time for the next reading (the longest one as
+        long as there is no previous reading)
+        """
+        if self.last_reading is None or self.last_reading == 0:
+            return self.nplc_values[-1]
+
+        required_nplc = (
+            self.noise_floor / (self.target_noise * abs(self.last_reading))
+        ) ** 2
+
+        for nplc in self.nplc_values:
+            if nplc >= required_nplc:
+                return nplc
+
+        return self.nplc_values[-1]
+
+    def update(self, reading):
+        """
+        Remember the reading the next integration time is chosen from
+        """
+        self.last_reading = reading
+
+    def reset(self):
+        """
+        Forget the previous reading (e.g. when the next pixel is measured)
+        """
+        self.last_reading = None
+
+
+# Value the Keithley instruments return for a reading beyond the fixed range
+OVERFLOW_READING = 9.9e37
+
+
+class RangePlanner:
+    """
+    Predicts the magnitude of the next reading so that a fixed range can be
+    set ahead of time instead of letting the instrument auto range (which
+    costs time whenever the range changes, e.g. while the OLED turns on).
+    The prediction is extrapolated from the last two readings of the present
+    curve (on a logarithmic scale since the values rise by decades) and
+    interpolated from the previous curve (e.g. of the previous pixel of the
+    same device) at the same position (e.g. the source voltage). The larger
+    of the two is taken and has to fit into the range headroom times.
+    """
+
+    def __init__(self, headroom=1.2):
+        self.headroom = headroom
+        self.curve = []
+
+        # Positions and logarithmic magnitudes of the previous curve (sorted
+        # by position)
+        self.previous_positions = np.array([])
+        self.previous_log_values = np.array([])
+
+    def next_curve(self):
+        """
+        Start a new curve. The present curve is kept for the predictions of
+        the new one.
+        """
+        previous_curve = sorted([point for point in self.curve if point[0] is not None])
+        if len(previous_curve) > 1:
+            positions, values = zip(*previous_curve)
+            self.previous_positions = np.array(positions)
+            self.previous_log_values = np.log10(np.maximum(values, 1e-15))
+        self.curve = []
+
+    def predict(self, position=None, floor=1e-15):
+        """
+        Return the predicted magnitude of the reading at position (None if
+        there is nothing to predict it from). Readings below floor are
+        regarded as noise and taken as floor for the extrapolation.
+        """
+        predictions = []
+
+        if len(self.curve) > 0:
+            last_position, last_value = self.curve[-1]
+            prediction = last_value
+
+            # Extrapolate the logarithmic slope of the last two readings (only
+            # rising values to stay on the safe side)
+            if len(self.curve) > 1 and position is not None:
+                previous_position, previous_value = self.curve[-2]
+                if (
+                    previous_position is not None
+                    and last_position is not None
+                    and previous_position != last_position
+                ):
+                    slope = (
+                        np.log10(max(last_value, floor))
+                        - np.log10(max(previous_value, floor))
+                    ) / (last_position - previous_position)
+                    prediction = max(last_value, floor) * 10 ** (
+                        max(slope, 0) * (position - last_position)
+                    )
+
+            predictions.append(prediction)
+
+        # Interpolate the previous curve if it covers the position
+        if (
+            position is not None
+            and len(self.previous_positions) > 1
+            and self.previous_positions[0] <= position <= self.previous_positions[-1]
+        ):
+            predictions.append(
+                10
+                ** np.interp(
+                    position, self.previous_positions, self.previous_log_values
+                )
+            )
+
+        if len(predictions) == 0:
+            return None
+
+        return max(predictions)
+
+    def select_range(self, ranges, position=None):
+        """
+        Return the smallest of the (ascending) ranges the predicted reading
+        fits into with headroom or 0 (auto range) if there is no prediction
+        or it does not fit into any of them
+        """
+        # Readings below a tenth of the smallest range are noise
+        prediction = self.predict(position, ranges[0] / 10)
+
+        if prediction is None:
+            return 0
+
+        for instrument_range in ranges:
+            if prediction * self.headroom <= instrument_range:
+                return instrument_range
+
+        return 0
+
+    def update(self, reading, position=None):
+        """
+        Add a reading (at position) to the present curve
+        """
+        self.curve.append((position, abs(reading)))
+
+
+class KeithleySource:
+    """
+    Class that manages all functionality of our Keithley voltage/current source
+    """
+
+    # Integration times (in power line cycles) the integration policy chooses
+    # from
+    NPLC_VALUES = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+
+    # Current measurement ranges (A) the range planner chooses from
+    CURRENT_RANGES = [1e-8, 1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1]
+
+    # TSP attributes of the settings in the shadow copy. In TSP mode
+    # (*LANG TSP) the Keithley rejects all SCPI commands, therefore the
+    # settings are written as these attributes instead.
+    TSP_SETTINGS = {
+        "Source:Function": "smu.source.func",
+        "Source:Volt": "smu.source.level",
+        "Source:Current": "smu.source.level",
+        "Sense:Function": "smu.measure.func",
+        "Source:Volt:ILimit": "smu.source.ilimit.level",
+        "Source:Current:VLimit": "smu.source.vlimit.level",
+        "Source:Volt:READ:BACK": "smu.source.readback",
+        "Source:Current:READ:BACK": "smu.source.readback",
+        "Current:NPLCycles": "smu.measure.nplc",
+        "Volt:NPLCycles": "smu.measure.nplc",
+        "Current:AZero": "smu.measure.autozero.enable",
+        "Volt:AZero": "smu.measure.autozero.enable",
+        "Source:Volt:Delay:AUTO": "smu.source.autodelay",
+        "Source:Current:Delay:AUTO": "smu.source.autodelay",
+        "Current:Range": "smu.measure.range",
+        "Current:Range:AUTO": "smu.measure.autorange",
+        "Output": "smu.source.output",
+    }
+
+    # TSP constants of the setting values (numbers are written as they are)
+    TSP_VALUES = {
+        "VOLT": "smu.FUNC_DC_VOLTAGE",
+        "CURRENT": "smu.FUNC_DC_CURRENT",
+        "ON": "smu.ON",
+        "OFF": "smu.OFF",
+    }
+
+    # Prints the next error of the TSP error queue in the format of
+    # SYSTem:ERRor? so that read_error_queue can read it
+    TSP_ERROR_QUERY = (
+        "if errorqueue.count > 0 then"
+        " local code, message = errorqueue.next()"
+        ' print(code .. ",\\"" .. message .. "\\"")'
+        ' else print("0,\\"No error\\"") end'
+    )
+
+    def __init__(self, keithley_source_address, current_compliance):
+        """
+        Initialise Hardware. This function must be improved later as well.
+        For the time being it is probably alright.
+        """
         # Check if keithley source is present at the given address
-        if keithley_source_address not in visa_resources:
+        if not instrument_registry.is_present(keithley_source_address):
             cf.log_message("The SourceMeter seems to be absent or switched off.")
             raise IOError("The SourceMeter seems to be absent or switched off.")
 
-        self.keith = rm.open_resource(keithley_source_address)
+        self.address = keithley_source_address
+        self.keith = instrument_registry.open_resource(keithley_source_address)
+
+        # All commands are sent by the broker thread of the instrument which
+        # recovers the instrument if the connection drops
+        self.broker = instrument_registry.broker(keithley_source_address)
+        self.broker.recovery = self.recover
+
+        # Shadow copy of the instrument state (empty as long as it is unknown)
+        self.state = {}
+
+        # Policy to choose the integration time of each reading (fixed
+        # integration time if None)
+        self.integration_policy = None
+
+        # Planner to choose the current range of each reading (auto range if
+        # None)
+        self.range_planner = None
+
+        # Command set the Keithley is set to ("SCPI" or "TSP", read on each
+        # reset)
+        self.language = "SCPI"
+
+        # As a standard initialise the Keithley as a voltage source
+        self.as_voltage_source(current_compliance)
+
+        # Set voltage mode indicator
+        self.mode = "voltage"
+
+        # Reverse voltages
+        self.reverse = 1
+
+    def submit(self, method_name, *args, **kwargs):
+        """
+        Queue a command without waiting for it and return a future of its
+        result
+        """
+        return self.broker.submit(getattr(self, method_name), *args, **kwargs)
+
+    @brokered
+    def as_voltage_source(self, current_compliance, force=False):
+        """
+        Function that initalises the Keithley as a voltage source. The
+        instrument is only reset if force is True (or its state is unknown),
+        otherwise only the settings that differ are written.
+        """
+        # Write operational parameters to Sourcemeter (Voltage to OLED)
+        if force or len(self.state) == 0:
+            self.reset()
+        else:
+            # Bring the output into the same state as after a reset
+            self.deactivate_output()
+        # set voltage as source
+        self.write_setting("Source:Function", "Volt")
+        self.write_setting("Source:Volt", 0)
+        # choose current for measuring
+        self.write_setting("Sense:Function", '"Current"')
+        # set compliance
+        self.write_setting("Source:Volt:ILimit", current_compliance * 1e-3)
+        # reads back the set voltage
+        self.write_setting("Source:Volt:READ:BACK", "ON")
+        # sets the read-out speed and accuracy (0.01 fastest, 10 slowest but highest accuracy)
+        self.write_setting("Current:NPLCycles", 1)
+        self.write_setting("Current:AZero", "OFF")  # turn off autozero
+        self.write_setting("Source:Volt:Delay:AUTO", "OFF")  # turn off autodelay
+
+        # Set voltage mode indicator
+        self.mode = "voltage"
+
+    @brokered
+    def as_current_source(self, voltage_compliance, force=False):
+        """
+        Initialise (or reinitialise) class as current source. The instrument
+        is only reset if force is True (or its state is unknown), otherwise
+        only the settings that differ are written.
+        """
+        # Write operational parameters to Sourcemeter (Voltage to OLED)
+        if force or len(self.state) == 0:
+            self.reset()
+        else:
+            # Bring the output into the same state as after a reset
+            self.deactivate_output()
+        # Write operational parameters to Sourcemeter (Current to OLED)
+        self.write_setting("Source:Function", "Current")  # set current as source
+        self.write_setting("Source:Current", 0)
+
+        self.write_setting("Sense:Function", '"Volt"')  # choose voltage for measuring
+        self.write_setting(
+            "Source:Current:VLimit", voltage_compliance
+        )  # set voltage compliance to compliance
+        self.write_setting(
+            "Source:Current:READ:BACK", "OFF"
+        )  # record preset source value instead of measuring it anew. NO CURRENT IS MEASURED!!! (Costs approx. 1.5 ms)
+        self.write_setting("Volt:AZero", "OFF")  # turn off autozero
+        self.write_setting("Source:Current:Delay:AUTO", "OFF")  # turn off autodelay
+
+        # Set current mode indicator
+        self.mode = "current"
+
+    @brokered
+    def reset(self):
+        """
+        reset instrument
+        """
+        self.keith.write("*rst")
+
+        # The command set can only be changed on the instrument (it takes
+        # effect after a restart), the common commands work in both
+        self.language = self.keith.query("*LANG?").strip().upper()
+
+        # Shadow copy of the settings the instrument is in after a reset
+        self.state = {
+            "Source:Function": "Volt",
+            "Source:Volt": 0,
+            "Source:Current": 0,
+            "Sense:Function": '"Current"',
+            "Current:Range:AUTO": "ON",
+            "Output": "OFF",
+        }
+        self.write_setting("Source:Volt:ILimit", 1.05)
+
+    def write_setting(self, command, value):
+        """
+        Write a setting to the Keithley only if it differs from the shadow
+        copy of the instrument state. Returns True if it was written.
+        """
+        if command in self.state and self.state[command] == value:
+            return False
+
+        if self.language == "TSP":
+            self.keith.write(self.tsp_setting(command, value))
+        else:
+            self.keith.write(command + " " + str(value))
+        self.state[command] = value
+
+        return True
+
+    def tsp_setting(self, command, value):
+        """
+        Translate a setting of the shadow copy into the TSP command that
+        writes it
+        """
+        if command not in self.TSP_SETTINGS:
+            raise IOError(
+                command + " can not be set while the Keithley source is in TSP mode"
+            )
+
+        value = str(value).strip('"')
+        return (
+            self.TSP_SETTINGS[command]
+            + " = "
+            + self.TSP_VALUES.get(value.upper(), value)
+        )
+
+    def require_language(self, language, feature):
+        """
+        Raise an error if the Keithley source is not set to the command set
+        (SCPI or TSP) that feature needs
+        """
+        if self.language != language:
+            cf.log_message(
+                feature
+                + " needs the Keithley source in "
+                + language
+                + " mode (*LANG "
+                + language
+                + ")"
+            )
+            raise IOError(
+                feature + " needs the Keithley source in " + language + " mode"
+            )
+
+    @brokered
+    def check_errors(self):
+        """
+        Read (and log) all errors the Keithley source reported since the
+        last check
+        """
+        if self.language == "TSP":
+            return read_error_queue(
+                self.keith, "Keithley source", error_query=self.TSP_ERROR_QUERY
+            )
+        return read_error_queue(self.keith, "Keithley source")
+
+    @brokered
+    def recover(self):
+        """
+        Reconnect to the Keithley source after the connection dropped and
+        bring it back into the state of the shadow copy (it might have been
+        power cycled). Uploaded scripts are not restored but uploaded again
+        when they are used next. The output is turned on last.
+        """
+        instrument_registry.reopen_resource(self.address)
+        self.keith.clear()
+
+        state = self.state
+        self.reset()
+
+        for command, value in state.items():
+            if command.startswith("Trace:Make"):
+                # Buffers are named in the key and sized in the value
+                buffer_name = command[len('Trace:Make "') : -1]
+                self.init_buffer(
+                    buffer_name,
+                    value,
+                    state.get('Trace:Fill:Mode "' + buffer_name + '"') == "CONT",
+                )
+            elif command not in ["Output", "Trigger:Load"] and not (
+                command.startswith("loadscript") or command.startswith("Trace:Fill")
+            ):
+                self.write_setting(command, value)
+
+        # The trigger model is built again with the same arguments
+        if "Trigger:Load" in state:
+            method_name, args = state["Trigger:Load"]
+            getattr(self, method_name)(*args)
+
+        if state.get("Output") == "ON":
+            self.activate_output()
+
+        cf.log_message("Keithley source recovered")
+
+    @brokered
+    def init_buffer(self, buffer_name, buffer_length, continuous=False):
+        """
+        Initialise buffer of source meter. If continuous is True, the
+        buffer overwrites its oldest readings once it is full instead of
+        taking no more readings.
+        """
+        # if the buffer already exists, delete it first to prevent the error
+        # "parameter error TRACe:MAKE cannot use an existing reading buffer name keithley"
+        # try:
+        # self.keith.write('TRACe:DELete "' + buffer_name + '"')
+        # except:
+        # cf.log_message("Buffer " + buffer_name + " does not exist yet")
+        # The buffer is only made once (or enlarged if it is too small)
+        buffer_size = self.state.get('Trace:Make "' + buffer_name + '"', 0)
+        if self.language == "TSP":
+            # TSP buffers are global variables that can not be resized
+            if buffer_size < buffer_length:
+                self.keith.write(
+                    "if "
+                    + buffer_name
+                    + " ~= nil then buffer.delete("
+                    + buffer_name
+                    + ") end "
+                    + buffer_name
+                    + " = buffer.make("
+                    + str(max(buffer_length, 10))
+                    + ")"
+                )
+        elif buffer_size == 0:
+            self.keith.write(
+                'Trace:Make "' + buffer_name + '", ' + str(max(buffer_length, 10))
+            )
+        elif buffer_size < buffer_length:
+            self.keith.write(
+                "Trace:Points " + str(buffer_length) + ', "' + buffer_name + '"'
+            )
+        self.state['Trace:Make "' + buffer_name + '"'] = max(
+            buffer_length, buffer_size, 10
+        )
+
+        fill_mode = "CONT" if continuous else "ONCE"
+        if self.state.get('Trace:Fill:Mode "' + buffer_name + '"') != fill_mode:
+            if self.language == "TSP":
+                self.keith.write(
+                    buffer_name
+                    + ".fillmode = buffer."
+                    + ("FILL_CONTINUOUS" if continuous else "FILL_ONCE")
+                )
+            else:
+                self.keith.write(
+                    "Trace:Fill:Mode " + fill_mode + ', "' + buffer_name + '"'
+                )
+            self.state['Trace:Fill:Mode "' + buffer_name + '"'] = fill_mode
+
+        # Keithley empties the buffer
+        self.empty_buffer(buffer_name)
+        self.buffer_name = buffer_name
+
+    @brokered
+    def empty_buffer(self, buffer_name):
+        """
+        Function that empties the Keithley's buffer for the next run
+        """
+        if self.language == "TSP":
+            self.keith.write(buffer_name + ".clear()")
+        else:
+            self.keith.write("Trace:Clear " + '"' + buffer_name + '"')
+
+    @brokered
+    def activate_output(self):
+        """
+        Activate output
+        """
+        self.write_setting("Output", "ON")
+
+    @brokered
+    def deactivate_output(self):
+        """
+        Turn power off
+        """
+        self.write_setting("Output", "OFF")
+
+    @brokered
+    def read_current(self):
+        """
+        Read current on Keithley source meter
+        """
+        if self.language == "TSP":
+            self.write_setting("Sense:Function", '"Current"')
+            return self.reverse * float(self.keith.query("print(smu.measure.read())"))
+
+        # MEASure? also changes the measure function
+        self.state["Sense:Function"] = '"Current"'
+        return self.reverse * float(self.keith.query("MEASure:CURRent:DC?"))
+
+    @brokered
+    def read_voltage(self):
+        """
+        Read voltage on Keithley source meter
+        """
+        if self.language == "TSP":
+            self.write_setting("Sense:Function", '"Volt"')
+            return self.reverse * float(self.keith.query("print(smu.measure.read())"))
+
+        # MEASure? also changes the measure function
+        self.state["Sense:Function"] = '"Volt"'
+        return self.reverse * float(self.keith.query("MEASure:VOLTage:DC?"))
+
+    @brokered
+    def set_nplc(self, nplc):
+        """
+        Set the integration time (in power line cycles) of the measured
+        quantity (0.01 fastest, 10 slowest but highest accuracy)
+        """
+        if self.mode == "voltage":
+            self.write_setting("Current:NPLCycles", nplc)
+        else:
+            self.write_setting("Volt:NPLCycles", nplc)
+
+    def set_integration_policy(self, noise_floor, target_noise, maximum_nplc=1):
+        """
+        Choose the integration time of each reading from the previous one so
+        that its noise relative to the reading stays below target_noise (see
+        IntegrationTimePolicy, noise_floor in the unit of the measured
+        quantity at 1 NPLC). The integration time is fixed to maximum_nplc if
+        target_noise is 0.
+        """
+        if target_noise <= 0:
+            self.integration_policy = None
+            self.set_nplc(maximum_nplc)
+            return
+
+        self.integration_policy = IntegrationTimePolicy(
+            noise_floor,
+            target_noise,
+            [nplc for nplc in self.NPLC_VALUES if nplc < maximum_nplc] + [maximum_nplc],
+        )
+
+    @brokered
+    def set_current_range(self, current_range):
+        """
+        Set a fixed range (in A) for the current measurement (0 for auto
+        range). Returns True if the range changed.
+        """
+        if current_range == 0:
+            changed = self.write_setting("Current:Range:AUTO", "ON")
+            # The fixed range is chosen by the Keithley from now on
+            if changed:
+                self.state.pop("Current:Range", None)
+        else:
+            changed = self.write_setting("Current:Range", current_range)
+            # A fixed range turns auto ranging off
+            if changed:
+                self.state["Current:Range:AUTO"] = "OFF"
+
+        return changed
+
+    def set_range_planner(self, range_planner):
+        """
+        Let range_planner choose the current range ahead of each reading of
+        read_iv in voltage mode (the Keithley auto ranges if it is None)
+        """
+        self.range_planner = range_planner
+
+        if range_planner is None:
+            self.set_current_range(0)
+
+    def source_level(self):
+        """
+        Return the source level set last (None if it is not known)
+        """
+        if self.mode == "voltage":
+            level = self.state.get("Source:Volt")
+        else:
+            level = self.state.get("Source:Current")
+
+        if level is None:
+            return None
+
+        return self.reverse * float(level)
+
+    @brokered
+    @idempotent
+    def read_iv(self, buffer_name="defbuffer1"):
+        """
+        Read voltage and current from a single trigger of the Keithley
+        source (the source value is read back, the other one measured) and
+        return them as IVReading together with the timestamp of the reading
+        on the instrument's clock (unlike the relative timestamp, it does not
+        depend on the oldest reading that is still in the buffer). If an
+        integration policy is set, the integration time is chosen from the
+        previous reading. If a range planner is set, the current range is
+        chosen from the previous readings at the source voltage and the
+        reading is repeated with auto range if it was beyond the range.
+        """
+        if self.integration_policy is not None:
+            self.set_nplc(self.integration_policy.next_nplc())
+
+        planned = self.range_planner is not None and self.mode == "voltage"
+        if planned:
+            position = self.source_level()
+            self.set_current_range(
+                self.range_planner.select_range(self.CURRENT_RANGES, position)
+            )
+
+        # The integration time defaults to 1 NPLC after a reset
+        if self.mode == "voltage":
+            nplc = self.state.get("Current:NPLCycles", 1)
+        else:
+            nplc = self.state.get("Volt:NPLCycles", 1)
+
+        if self.language == "TSP":
+            # The last reading of the buffer is printed right away
+            read_query = (
+                "smu.measure.read("
+                + buffer_name
+                + ") printbuffer("
+                + buffer_name
+                + ".n, "
+                + buffer_name
+                + ".n, "
+                + buffer_name
+                + ".sourcevalues, "
+                + buffer_name
+                + ".readings, "
+                + buffer_name
+                + ".seconds, "
+                + buffer_name
+                + ".fractionalseconds)"
+            )
+        else:
+            read_query = 'Read? "' + buffer_name + '", SOUR, READ, SEC, FRAC'
+
+        for attempt in range(2):
+            data = self.keith.query(read_query)
+
+            source_value, reading, seconds, fractional_seconds = [
+                float(value) for value in data.strip().split(",")
+            ]
+            timestamp = seconds + fractional_seconds
+
+            # Fall back to auto range if the planned range was too small
+            if not planned or abs(reading) < OVERFLOW_READING:
+                break
+            self.set_current_range(0)
+
+        if planned:
+            self.range_planner.update(reading, position)
+
+        if self.integration_policy is not None:
+            self.integration_policy.update(reading)
+
+        if self.mode == "voltage":
+            return IVReading(
+                self.reverse * source_value, self.reverse * reading, timestamp, nplc
+            )
+        else:
+            return IVReading(
+                self.reverse * reading, self.reverse * source_value, timestamp, nplc
+            )
+
+    def read_current_and_voltage(self):
+        """
+        Read current and voltage from a single measurement of the Keithley
+        source (the source value is read back, the other one measured)
+        """
+        reading = self.read_iv()
+
+        return reading.current, reading.voltage
+
+    def measure_with_photodiode(self, keithley_multimeter, number_of_samples=1, nplc=1):
+        """
+        Read current, voltage and photodiode voltage at the same instant.
+        Returns a tuple (current, voltage, photodiode voltage) where the
+        photodiode voltage is the mean of number_of_samples readings.
+        """
+        reading, diode_voltage, _ = self.measure_iv_with_photodiode(
+            keithley_multimeter, number_of_samples, nplc
+        )
+
+        return reading.current, reading.voltage, diode_voltage
+
+    def measure_iv_with_photodiode(
+        self, keithley_multimeter, number_of_samples=1, nplc=1, buffer_name="defbuffer1"
+    ):
+        """
+        The multimeter burst is handed to the multimeter's broker first and
+        integrates while the Keithley source does its measurement, so that
+        the integration times of both instruments overlap instead of adding
+        up. Returns the IVReading of the Keithley source (including its
+        timestamp in buffer_name), the mean photodiode voltage and the
+        integration time of the photodiode readings.
+        """
+        # Trigger and fetch are done in one go by the multimeter's broker so
+        # that no other command can get in between
+        diode_future = keithley_multimeter.submit(
+            "measure_burst", number_of_samples, nplc, self.source_level()
+        )
+        reading = self.read_iv(buffer_name)
+        _, diode_voltage, _, diode_nplc = diode_future.result()
+
+        return reading, diode_voltage, diode_nplc
+
+    @brokered
+    def read_buffer(self, buffer_name):
+        if self.language == "TSP":
+            return float(
+                self.keith.query("print(smu.measure.read(" + buffer_name + "))")
+            )
+        return float(self.keith.query('Read? "' + buffer_name + '"')[:-1])
+
+    @brokered
+    def set_voltage(self, voltage):
+        """
+        Set the voltage on the source meter (only in voltage mode)
+        """
+
+        voltage = float(voltage)
+        if self.mode == "voltage":
+            self.write_setting("Source:Volt", self.reverse * voltage)
+        else:
+            logging.warning(
+                "You can not set the voltage of the Keithley source in current mode"
+            )
+
+    @brokered
+    def set_current(self, current):
+        """
+        Set the current on the source meter (only in current mode)
+        """
+        current = float(current)
+        # set current to source_value
+        if self.mode == "current":
+            self.write_setting("Source:Current", self.reverse * current * 1e-3)
+        else:
+            logging.warning(
+                "You can not set the current of the Keithley source in voltage mode"
+            )
+
+    @brokered
+    def store_source_list(self, list_name, levels):
+        """
+        Store a list of source levels as a source configuration list on the
+        Keithley. The store commands are chained with semicolons so that a
+        few hundred points only cost a handful of USB transfers.
+        """
+        self.require_language("SCPI", "Source configuration lists")
+
+        # Delete the list first since it can not be created twice (if it does
+        # not exist yet, the instrument only logs an error to its queue)
+        self.keith.write('Source:Configuration:List:Delete "' + list_name + '"')
+        self.keith.write('Source:Configuration:List:Create "' + list_name + '"')
+
+        if self.mode == "voltage":
+            level_command = ":Source:Volt "
+        else:
+            level_command = ":Source:Current "
+
+        # The Keithley's input buffer is limited, therefore send the levels in
+        # chunks of 50 points
+        chunk_size = 50
+        for i in range(0, len(levels), chunk_size):
+            self.keith.write(
+                ";".join(
+                    [
+                        level_command
+                        + str(self.reverse * float(level))
+                        + ';:Source:Configuration:List:Store "'
+                        + list_name
+                        + '"'
+                        for level in levels[i : i + chunk_size]
+                    ]
+                )
+            )
+
+        # The source level was changed by storing the list
+        self.state.pop(level_command[1:-1], None)
+
+    @brokered
+    def init_voltage_sweep(
+        self, voltages, buffer_name, source_delay, notify_digital_line=1
+    ):
+        """
+        Load a voltage list into the trigger model of the Keithley so that the
+        entire sweep runs on the instrument. Each point is sourced, settles
+        for source_delay seconds and is measured into the buffer. Just before
+        each measurement a trigger pulse is sent on the digital I/O line
+        notify_digital_line (e.g. to trigger the multimeter, 0 to disable).
+        """
+        self.require_language("SCPI", "The buffered sweep")
+
+        self.store_source_list("JVLSweepList", voltages)
+
+        # Prepare the buffer the readings are stored in
+        self.init_buffer(buffer_name, len(voltages))
+
+        self.configure_trigger_output(notify_digital_line)
+
+        # Build the trigger model from scratch
+        self.keith.write('Trigger:Load "Empty"')
+        self.keith.write('Trigger:Block:Buffer:Clear 1, "' + buffer_name + '"')
+        self.keith.write('Trigger:Block:Config:Recall 2, "JVLSweepList", 1')
+        self.keith.write("Trigger:Block:Source:State 3, ON")
+        self.keith.write("Trigger:Block:Delay:Constant 4, " + str(source_delay))
+        self.keith.write("Trigger:Block:Notify 5, 1")
+        self.keith.write('Trigger:Block:Measure 6, "' + buffer_name + '", 1')
+        self.keith.write('Trigger:Block:Config:Next 7, "JVLSweepList"')
+        self.keith.write(
+            "Trigger:Block:Branch:Counter 8, " + str(len(voltages)) + ", 4"
+        )
+        self.keith.write("Trigger:Block:Source:State 9, OFF")
+
+        self.sweep_points = len(voltages)
 
-        # As a standard initialise the Keithley as a voltage source
-        self.as_voltage_source(current_compliance)
+        # The trigger model is part of the shadow copy so that it can be
+        # restored
+        self.state["Trigger:Load"] = (
+            "init_voltage_sweep",
+            (voltages, buffer_name, source_delay, notify_digital_line),
+        )
 
-        # Set voltage mode indicator
-        self.mode = "voltage"
+    @brokered
+    def init_pulsed_voltage_sweep(
+        self,
+        voltages,
+        buffer_name,
+        pulse_width,
+        duty_cycle,
+        nplc=1,
+        off_voltage=0,
+        notify_digital_line=1,
+    ):
+        """
+        Load a voltage list into the trigger model of the Keithley so that
+        each voltage is only applied as a pulse of pulse_width seconds. In
+        between the pulses the off voltage is applied so that the pulses are
+        repeated with the given duty cycle. The measurement (with nplc power
+        line cycles) is done at the end of each pulse and the trigger pulse
+        on notify_digital_line is sent right before, so that the multimeter
+        integrates within the pulse as well. Returns the time the voltage
+        settles within each pulse before the measurement.
+        """
+        self.require_language("SCPI", "The pulsed sweep")
+
+        # The measurement has to fit into the pulse
+        line_frequency = float(self.keith.query("System:LFRequency?"))
+        settling_time = pulse_width - nplc / line_frequency
+        if settling_time < 0:
+            message = (
+                "A measurement with "
+                + str(nplc)
+                + " NPLC takes "
+                + str(round(nplc / line_frequency * 1e3, 2))
+                + " ms and does not fit into a pulse of "
+                + str(round(pulse_width * 1e3, 2))
+                + " ms. Lower the NPLC or widen the pulse."
+            )
+            cf.log_message(message)
+            raise ValueError(message)
+        off_time = pulse_width * (1 / duty_cycle - 1)
+
+        self.store_source_list("JVLPulseList", voltages)
+        self.store_source_list("JVLPulseOffList", [off_voltage])
+
+        # Prepare the buffer the readings are stored in
+        self.init_buffer(buffer_name, len(voltages))
+
+        self.configure_trigger_output(notify_digital_line)
+
+        self.write_setting("Current:NPLCycles", nplc)
+
+        # Build the trigger model from scratch
+        self.keith.write('Trigger:Load "Empty"')
+        self.keith.write('Trigger:Block:Buffer:Clear 1, "' + buffer_name + '"')
+        self.keith.write('Trigger:Block:Config:Recall 2, "JVLPulseOffList", 1')
+        self.keith.write("Trigger:Block:Source:State 3, ON")
+        # Pulse
+        self.keith.write('Trigger:Block:Config:Recall 4, "JVLPulseList", 1')
+        self.keith.write("Trigger:Block:Delay:Constant 5, " + str(settling_time))
+        self.keith.write("Trigger:Block:Notify 6, 1")
+        self.keith.write('Trigger:Block:Measure 7, "' + buffer_name + '", 1')
+        # Off time between the pulses
+        self.keith.write('Trigger:Block:Config:Recall 8, "JVLPulseOffList", 1')
+        self.keith.write("Trigger:Block:Delay:Constant 9, " + str(off_time))
+        # Go to the next voltage unless it was the last one
+        self.keith.write(
+            "Trigger:Block:Branch:Counter 10, " + str(len(voltages)) + ", 12"
+        )
+        self.keith.write("Trigger:Block:Branch:Always 11, 14")
+        self.keith.write('Trigger:Block:Config:Next 12, "JVLPulseList"')
+        self.keith.write("Trigger:Block:Branch:Always 13, 5")
+        self.keith.write("Trigger:Block:Source:State 14, OFF")
+
+        self.sweep_points = len(voltages)
+
+        # The trigger model is part of the shadow copy so that it can be
+        # restored
+        self.state["Trigger:Load"] = (
+            "init_pulsed_voltage_sweep",
+            (
+                voltages,
+                buffer_name,
+                pulse_width,
+                duty_cycle,
+                nplc,
+                off_voltage,
+                notify_digital_line,
+            ),
+        )
 
-        # Reverse voltages
-        self.reverse = 1
+        return settling_time
 
-    def as_voltage_source(self, current_compliance):
+    def configure_trigger_input(self, trigger_digital_line):
         """
-        Function that initalises the Keithley as a voltage source
+        Let the digital I/O line trigger_digital_line receive trigger pulses
+        (active low, e.g. from the trigger output of the switchbox) that the
+        trigger model can wait for
         """
-        self.mutex.lock()
-        # Write operational parameters to Sourcemeter (Voltage to OLED)
-        self.reset()
-        # set voltage as source
-        self.keith.write("Source:Function Volt")
-        # choose current for measuring
-        self.keith.write('Sense:Function "Current"')
-        # set compliance
-        self.keith.write("Source:Volt:ILimit " + str(current_compliance * 1e-3))
-        # reads back the set voltage
-        self.keith.write("Source:Volt:READ:BACK ON")
-        # sets the read-out speed and accuracy (0.01 fastest, 10 slowest but highest accuracy)
-        self.keith.write("Current:NPLCycles 1")
-        self.keith.write("Current:AZero OFF")  # turn off autozero
-        self.keith.write("Source:Volt:Delay:AUTO OFF")  # turn off autodelay
+        line = str(int(trigger_digital_line))
+        self.write_setting("Digital:Line" + line + ":Mode", "Trigger, In")
+        self.write_setting("Trigger:Digital" + line + ":In:Edge", "Falling")
 
-        # Set voltage mode indicator
-        self.mode = "voltage"
-        self.mutex.unlock()
-
-    def as_current_source(self, voltage_compliance):
+    @brokered
+    def init_triggered_measurement(
+        self,
+        buffer_name,
+        number_of_points,
+        trigger_digital_line=2,
+        notify_digital_line=1,
+    ):
         """
-        Initialise (or reinitialise) class as current source
+        Load a trigger model that takes one measurement into the buffer for
+        each pulse at the digital I/O line trigger_digital_line (e.g. sent by
+        the switchbox once the relays settled). The source keeps its level
+        and output state. Before each measurement a trigger pulse is passed
+        on at notify_digital_line (e.g. to the multimeter, 0 to disable).
+        The trigger model is started with run_sweep.
         """
-        self.mutex.lock()
-        # Write operational parameters to Sourcemeter (Voltage to OLED)
-        self.reset()
-        # Write operational parameters to Sourcemeter (Current to OLED)
-        self.keith.write("Source:Function Current")  # set current as source
+        self.require_language("SCPI", "The triggered measurement")
+
+        # Prepare the buffer the readings are stored in
+        self.init_buffer(buffer_name, number_of_points)
+
+        self.configure_trigger_input(trigger_digital_line)
+        self.configure_trigger_output(notify_digital_line)
 
-        self.keith.write('Sense:Function "Volt"')  # choose voltage for measuring
+        # Build the trigger model from scratch
+        self.keith.write('Trigger:Load "Empty"')
+        self.keith.write('Trigger:Block:Buffer:Clear 1, "' + buffer_name + '"')
         self.keith.write(
-            "Source:Current:VLimit " + str(voltage_compliance)
-        )  # set voltage compliance to compliance
+            "Trigger:Block:Wait 2, Digital" + str(int(trigger_digital_line))
+        )
+        block = 3
+        if notify_digital_line != 0:
+            self.keith.write("Trigger:Block:Notify 3, 1")
+            block = 4
         self.keith.write(
-            "Source:Current:READ:BACK OFF"
-        )  # record preset source value instead of measuring it anew. NO CURRENT IS MEASURED!!! (Costs approx. 1.5 ms)
-        self.keith.write("Volt:AZero OFF")  # turn off autozero
-        self.keith.write("Source:Current:Delay:AUTO OFF")  # turn off autodelay
+            "Trigger:Block:Measure " + str(block) + ', "' + buffer_name + '", 1'
+        )
+        self.keith.write(
+            "Trigger:Block:Branch:Counter "
+            + str(block + 1)
+            + ", "
+            + str(int(number_of_points))
+            + ", 2"
+        )
 
-        # Set current mode indicator
-        self.mode = "current"
-        self.mutex.unlock()
+        self.sweep_points = number_of_points
 
-    def reset(self):
-        """
-        reset instrument
-        """
-        self.mutex.lock()
-        self.keith.write("*rst")
-        self.keith.write("Source:Volt:ILimit " + str(1.05))
-        self.mutex.unlock()
+        # The trigger model is part of the shadow copy so that it can be
+        # restored
+        self.state["Trigger:Load"] = (
+            "init_triggered_measurement",
+            (buffer_name, number_of_points, trigger_digital_line, notify_digital_line),
+        )
 
-    def init_buffer(self, buffer_name, buffer_length):
+    def configure_trigger_output(self, notify_digital_line):
         """
-        Initialise buffer of source meter
+        Let the digital I/O line notify_digital_line send a trigger pulse on
+        each notify block of the trigger model (0 to disable)
         """
-        self.mutex.lock()
-        # if the buffer already exists, delete it first to prevent the error
-        # "parameter error TRACe:MAKE cannot use an existing reading buffer name keithley"
-        # try:
-        # self.keith.write('TRACe:DELete "' + buffer_name + '"')
-        # except:
-        # cf.log_message("Buffer " + buffer_name + " does not exist yet")
-        self.keith.write(
-            'Trace:Make "' + buffer_name + '", ' + str(max(buffer_length, 10))
-        )
+        if notify_digital_line == 0:
+            return
 
-        # Keithley empties the buffer
-        self.keith.write("Trace:Clear " + '"' + buffer_name + '"')
-        self.buffer_name = buffer_name
-        self.mutex.unlock()
+        line = str(int(notify_digital_line))
+        self.write_setting("Digital:Line" + line + ":Mode", "Trigger, Out")
+        self.write_setting("Trigger:Digital" + line + ":Out:Logic", "Negative")
+        self.write_setting("Trigger:Digital" + line + ":Out:Pulsewidth", 1e-5)
+        self.write_setting("Trigger:Digital" + line + ":Out:Stimulus", "Notify1")
 
-    def empty_buffer(self, buffer_name):
+    @brokered
+    def run_sweep(self, timeout=60):
         """
-        Function that empties the Keithley's buffer for the next run
+        Start the trigger model and block until the sweep is finished. The
+        timeout (in s) must be longer than the entire sweep.
         """
-        self.mutex.lock()
-        self.keith.write("Trace:Clear " + '"' + buffer_name + '"')
-        self.mutex.unlock()
+        self.require_language("SCPI", "The trigger model")
 
-    def activate_output(self):
+        visa_timeout = self.keith.timeout
+        self.keith.timeout = timeout * 1000
+        try:
+            self.keith.write("Initiate")
+            # *OPC? only returns when the trigger model went back to idle
+            self.keith.query("*WAI;*OPC?")
+        finally:
+            self.keith.timeout = visa_timeout
+
+            # The trigger model changed the source level and the output state
+            for command in ["Source:Volt", "Source:Current", "Output"]:
+                self.state.pop(command, None)
+
+    def script_engine_available(self):
         """
-        Activate output
+        Check if the Keithley is set to the TSP command set that is needed to
+        run scripts (*LANG TSP, it only takes effect after a restart). The
+        trigger model sweeps need the SCPI command set instead.
         """
-        self.mutex.lock()
-        self.keith.write("Output ON")
-        self.mutex.unlock()
+        return self.language == "TSP"
 
-    def deactivate_output(self):
+    @brokered
+    def load_script(self, script_name, script):
         """
-        Turn power off
+        Upload a TSP script and run it once so that its functions are
+        defined. A script that was already uploaded is not sent again.
         """
-        self.mutex.lock()
-        self.keith.write("Output OFF")
-        self.mutex.unlock()
+        self.require_language("TSP", "Running scripts")
 
-    def read_current(self):
+        if self.state.get("loadscript " + script_name) == script:
+            return
+
+        self.keith.write(
+            "if "
+            + script_name
+            + ' ~= nil then script.delete("'
+            + script_name
+            + '") end'
+        )
+        self.keith.write("loadscript " + script_name)
+        for line in script.strip().split("\n"):
+            self.keith.write(line)
+        self.keith.write("endscript")
+        self.keith.write(script_name + ".run()")
+
+        self.state["loadscript " + script_name] = script
+
+    @brokered
+    def run_script_sweep(
+        self,
+        voltages,
+        current_compliance,
+        source_delay,
+        nplc=1,
+        notify_digital_line=1,
+        chunk_size=10,
+        chunk_callback=None,
+        timeout=60,
+    ):
         """
-        Read current on Keithley source meter
+        Run a JVL sweep entirely on the Keithley with the JVL sweep TSP
+        script. The script stops by itself at the current compliance (in mA)
+        and streams the readings back in chunks of chunk_size points while it
+        runs. chunk_callback(voltages, currents) is called for each chunk,
+        if it returns False the script is aborted. Returns the voltages,
+        currents and relative timestamps as numpy arrays together with the
+        status of the sweep ("DONE", "COMPLIANCE" or "ABORTED").
         """
-        return self.reverse * float(self.keith.query("MEASure:CURRent:DC?"))
+        self.load_script("JVLSweep", JVL_SWEEP_SCRIPT)
+
+        # Send the levels in chunks of 50 points (limited input buffer)
+        self.keith.write("jvl_levels = {}")
+        chunk = 50
+        for i in range(0, len(voltages), chunk):
+            self.keith.write(
+                "jvl_append({"
+                + ", ".join(
+                    [
+                        str(self.reverse * float(level))
+                        for level in voltages[i : i + chunk]
+                    ]
+                )
+                + "})"
+            )
 
-    def read_voltage(self):
+        visa_timeout = self.keith.timeout
+        self.keith.timeout = timeout * 1000
+
+        data = []
+        status = "ABORTED"
+        try:
+            self.keith.write(
+                "jvl_sweep("
+                + str(current_compliance * 1e-3)
+                + ", "
+                + str(source_delay)
+                + ", "
+                + str(nplc)
+                + ", "
+                + str(int(chunk_size))
+                + ", "
+                + str(int(notify_digital_line))
+                + ")"
+            )
+
+            # The script prints the readings while it runs
+            while True:
+                line = self.keith.read().strip()
+
+                if line.startswith("END"):
+                    status = line.split()[1]
+                    break
+
+                values = np.array(line.split(","), dtype=float).reshape(-1, 3)
+                data.append(values)
+
+                if chunk_callback is not None and not chunk_callback(
+                    self.reverse * values[:, 0], self.reverse * values[:, 1]
+                ):
+                    # A device clear stops the running script
+                    self.keith.clear()
+                    self.keith.write("smu.source.output = smu.OFF")
+                    break
+        finally:
+            self.keith.timeout = visa_timeout
+
+            # The script changed the source and measure settings
+            for command in [
+                "Source:Function",
+                "Source:Volt",
+                "Source:Current",
+                "Source:Volt:ILimit",
+                "Source:Volt:READ:BACK",
+                "Source:Volt:Delay:AUTO",
+                "Sense:Function",
+                "Current:NPLCycles",
+                "Current:AZero",
+                "Output",
+            ]:
+                self.state.pop(command, None)
+
+        if len(data) == 0:
+            return np.array([]), np.array([]), np.array([]), status
+
+        data = np.concatenate(data)
+
+        return (
+            self.reverse * data[:, 0],
+            self.reverse * data[:, 1],
+            data[:, 2],
+            status,
+        )
+
+    def fetch_sweep(self, buffer_name, points=None):
         """
-        Read voltage on Keithley source meter
+        Read back the source values and readings of a sweep from the buffer
+        in one transfer. Returns two numpy arrays (voltages, currents).
         """
-        return self.reverse * float(self.keith.query("MEASure:VOLTage:DC?"))
+        if points is None:
+            points = self.sweep_points
+
+        # The trigger model stops early if a trigger or a reading was missed
+        length = self.buffer_length(buffer_name)
+        if length < points:
+            raise IOError(
+                "The sweep only stored "
+                + str(length)
+                + " of "
+                + str(points)
+                + " readings in "
+                + buffer_name
+                + "."
+            )
 
-    def read_buffer(self, buffer_name):
-        return float(self.keith.query('Read? "' + buffer_name + '"')[:-1])
+        voltages, currents = self.fetch_buffer(
+            buffer_name, 1, points, elements=["SOUR", "READ"]
+        )
 
-    def set_voltage(self, voltage):
+        return voltages, currents
+
+    @brokered
+    def buffer_length(self, buffer_name):
         """
-        Set the voltage on the source meter (only in voltage mode)
+        Number of readings that are currently stored in the buffer
         """
+        if self.language == "TSP":
+            return int(float(self.keith.query("print(" + buffer_name + ".n)")))
 
-        self.mutex.lock()
-        voltage = float(voltage)
-        if self.mode == "voltage":
-            self.keith.write("Source:Volt " + str(self.reverse * voltage))
-        else:
-            logging.warning(
-                "You can not set the voltage of the Keithley source in current mode"
-            )
-        self.mutex.unlock()
+        length = int(self.keith.query('Trace:Actual? "' + buffer_name + '"'))
 
-    def set_current(self, current):
+        return length
+
+    @brokered
+    def fetch_buffer(
+        self,
+        buffer_name,
+        start=1,
+        end=None,
+        elements=["READ", "SOUR", "REL"],
+        precision="double",
+    ):
         """
-        Set the current on the source meter (only in current mode)
+        Fetch a whole trace of the buffer as a binary block and return one
+        numpy array per requested buffer element (e.g. READ for the readings,
+        SOUR for the source values and REL for the relative timestamps).
+        precision can be "double" (REAL64) or "single" (REAL32).
         """
-        self.mutex.lock()
-        current = float(current)
-        # set current to source_value
-        if self.mode == "current":
-            self.keith.write("Source:Current " + str(self.reverse * current * 1e-3))
+        self.require_language("SCPI", "Fetching a binary buffer")
+
+        if end is None:
+            end = self.buffer_length(buffer_name)
+
+        if end < start:
+            return [np.array([]) for element in elements]
+
+        if precision == "single":
+            data_format = "SReal"
+            datatype = "f"
         else:
-            logging.warning(
-                "You can not set the current of the Keithley source in voltage mode"
+            data_format = "Real"
+            datatype = "d"
+
+        # Binary data is sent little endian, without ASCII conversion on the
+        # instrument and parsing on our side
+        self.keith.write("Format:Data " + data_format)
+        self.keith.write("Format:Border Swapped")
+        try:
+            data = self.keith.query_binary_values(
+                "Trace:Data? "
+                + str(start)
+                + ", "
+                + str(end)
+                + ', "'
+                + buffer_name
+                + '", '
+                + ", ".join(elements),
+                datatype=datatype,
+                is_big_endian=False,
+                container=np.array,
             )
-        self.mutex.unlock()
+        finally:
+            # All other queries expect ASCII responses
+            self.keith.write("Format:Data Ascii")
+
+        # The elements are returned interleaved for each reading
+        data = data.reshape(-1, len(elements))
+
+        columns = []
+        for i, element in enumerate(elements):
+            if element.upper() in ["READ", "READING", "SOUR", "SOURCE"]:
+                columns.append(self.reverse * data[:, i])
+            else:
+                columns.append(data[:, i])
+
+        return columns
 
 
 class KeithleyMultimeter:
@@ -344,46 +2661,264 @@ class KeithleyMultimeter:
     Class that manages all functionality of our Keithley multi meter
     """
 
+    # Integration times (in power line cycles) the integration policy chooses
+    # from
+    NPLC_VALUES = [0.02, 0.2, 1, 10, 100]
+
+    # Voltage ranges (V) the range planner chooses from
+    VOLTAGE_RANGES = [0.1, 1, 10, 100, 1000]
+
+    # Number of readings the reading memory holds
+    MAX_READINGS = 2000
+
     def __init__(self, keithley_multimeter_address):
-        # Define a mutex
-        self.mutex = QtCore.QMutex()
+        # Shadow copy of the instrument state (empty as long as it is unknown)
+        self.state = {}
+        self.multimeter_range = 0
+
+        # Number of readings the armed acquisition takes
+        self.acquisition_samples = 0
 
-        # Keithley Finding Device
-        rm = pyvisa.ResourceManager()
-        # The actual addresses for the Keithleys can be accessed via rm.list_resources()
-        visa_resources = rm.list_resources()
+        # Policy to choose the integration time of each reading (fixed
+        # integration time if None)
+        self.integration_policy = None
 
-        if keithley_multimeter_address not in visa_resources:
+        # Planner to choose the range of each reading (fixed range set with
+        # set_range if None)
+        self.range_planner = None
+
+        # Check if keithley multimeter is present at the given address
+        if not instrument_registry.is_present(keithley_multimeter_address):
             cf.log_message("The Multimeter seems to be absent or switched off.")
             raise IOError("The Multimeter seems to be absent or switched off.")
 
-        self.keithmulti = rm.open_resource(keithley_multimeter_address)
+        self.address = keithley_multimeter_address
+        self.keithmulti = instrument_registry.open_resource(keithley_multimeter_address)
+
+        # All commands are sent by the broker thread of the instrument which
+        # recovers the instrument if the connection drops
+        self.broker = instrument_registry.broker(keithley_multimeter_address)
+        self.broker.recovery = self.recover
 
         # Write operational parameters to Multimeter (Voltage from Photodiode)
         # reset instrument
         self.reset()
 
-    def reset(self):
+    def submit(self, method_name, *args, **kwargs):
         """
-        Reset instrument
+        Queue a command without waiting for it and return a future of its
+        result
         """
-        self.mutex.lock()
-        self.keithmulti.write("*rst")
+        return self.broker.submit(getattr(self, method_name), *args, **kwargs)
 
-        # Write operational parameters to Multimeter (Voltage from Photodiode)
+    @brokered
+    def reset(self, force=False):
+        """
+        Reset instrument. The multimeter is only reset if force is True (or
+        its state is unknown), otherwise only the settings that differ from
+        the default configuration are written.
+        """
+        if force or len(self.state) == 0:
+            self.keithmulti.write("*rst")
+            self.state = {}
+
+            # Write operational parameters to Multimeter (Voltage from Photodiode)
+            # sets the voltage resolution
+            self.keithmulti.query("VOLTage:DC:RESolution?")
+        # Configure the multimeter once for triggered readings in the 10 V range
+        self.configure_voltage_measurement(10)
+
+    def write_setting(self, command, value):
+        """
+        Write a setting to the multimeter only if it differs from the shadow
+        copy of the instrument state. Returns True if it was written.
+        """
+        if command in self.state and self.state[command] == value:
+            return False
+
+        self.keithmulti.write(command + " " + str(value))
+        self.state[command] = value
+
+        return True
+
+    @brokered
+    def check_errors(self):
+        """
+        Read (and log) all errors the multimeter reported since the last
+        check
+        """
+        return read_error_queue(self.keithmulti, "Keithley multimeter")
+
+    @brokered
+    def recover(self):
+        """
+        Reconnect to the multimeter after the connection dropped and bring it
+        back into the state of the shadow copy (it might have been power
+        cycled). Readings that were not fetched yet are lost.
+        """
+        instrument_registry.reopen_resource(self.address)
+        self.keithmulti.clear()
+
+        state = self.state
+        multimeter_range = self.multimeter_range
+        self.reset(force=True)
+
+        for command, value in state.items():
+            if command != "CONFigure" and not command.startswith(
+                "SENSe:VOLTage:DC:RANGe"
+            ):
+                self.write_setting(command, value)
+        self.set_range(multimeter_range, arm=False)
+
+        # Wait for the next trigger again
+        self.keithmulti.write("INITiate")
+
+        cf.log_message("Keithley multimeter recovered")
+
+    def configure_dc_voltage(self):
+        """
+        Select DC voltage readings. CONFigure sets all other settings back to
+        their defaults, therefore it is only sent if the function changes.
+        Returns True if the multimeter was reconfigured.
+        """
+        if self.state.get("CONFigure") == "VOLTage:DC":
+            return False
+
+        self.keithmulti.write("CONFigure:VOLTage:DC")
+        self.state = {"CONFigure": "VOLTage:DC"}
+
+        return True
+
+    @brokered
+    def configure_voltage_measurement(
+        self, multimeter_range=0, number_of_samples=1, nplc=1
+    ):
+        """
+        Configure the multimeter for DC voltage readings on a bus trigger so
+        that measure_voltage only has to trigger and fetch a reading instead
+        of reconfiguring the instrument with MEASure? every time. Only the
+        settings that changed are written and the multimeter is only armed
+        again if anything changed. Returns True if that was the case.
+        multimeter_range: flt
+            fixed range in V (0 for auto range)
+        """
+        changed = self.configure_dc_voltage()
         # sets the voltage range
-        self.keithmulti.write("SENSe:VOLTage:DC:RANGe 10")
-        # sets the voltage resolution
-        self.keithmulti.query("VOLTage:DC:RESolution?")
+        changed = self.set_range(multimeter_range, arm=False) or changed
         # sets the read-out speed and accuracy (0.01 fastest, 10 slowest but highest accuracy)
-        self.keithmulti.write("VOLTage:NPLCycles 1")
+        changed = self.write_setting("VOLTage:NPLCycles", nplc) or changed
         # sets the trigger to activate immediately after 'idle' -> 'wait-for-trigger'
-        self.keithmulti.write("TRIGer:SOURce BUS")
+        changed = self.write_setting("TRIGer:SOURce", "BUS") or changed
         # sets the trigger to activate immediately after 'idle' -> 'wait-for-trigger'
-        self.keithmulti.write("TRIGer:DELay 0")
+        changed = self.write_setting("TRIGer:DELay", 0) or changed
+        # One trigger with number_of_samples readings
+        changed = self.write_setting("TRIGer:COUNt", 1) or changed
+        changed = self.write_setting("SAMPle:COUNt", int(number_of_samples)) or changed
+
         # Activate wait for trigger mode
+        if changed:
+            self.keithmulti.write("INITiate")
+
+        return changed
+
+    @brokered
+    def set_range(self, multimeter_range, arm=True):
+        """
+        Change the voltage range of the configured measurement (0 for auto
+        range). The multimeter falls back to idle when it is reconfigured and
+        is therefore armed again if arm is True. Returns True if the range
+        changed.
+        """
+        if multimeter_range == 0:
+            changed = self.write_setting("SENSe:VOLTage:DC:RANGe:AUTO", "ON")
+            # The fixed range is chosen by the multimeter from now on
+            if changed:
+                self.state.pop("SENSe:VOLTage:DC:RANGe", None)
+        else:
+            changed = self.write_setting("SENSe:VOLTage:DC:RANGe", multimeter_range)
+            # A fixed range turns auto ranging off
+            if changed:
+                self.state["SENSe:VOLTage:DC:RANGe:AUTO"] = "OFF"
+
+        if arm and changed:
+            self.keithmulti.write("INITiate")
+
+        self.multimeter_range = multimeter_range
+
+        return changed
+
+    @brokered
+    def arm_external_acquisition(self, number_of_samples, nplc=1):
+        """
+        Arm the multimeter to take one reading (with nplc power line cycles)
+        on each pulse at its external trigger input (e.g. sent by the
+        Keithley source during a sweep or by the switchbox after switching
+        the relays). The readings are kept in the multimeter's memory until
+        they are fetched, so the number of samples is limited to
+        MAX_READINGS.
+        """
+        if not 1 <= number_of_samples <= self.MAX_READINGS:
+            raise ValueError(
+                "The multimeter can only acquire between 1 and "
+                + str(self.MAX_READINGS)
+                + " readings, not "
+                + str(number_of_samples)
+                + "."
+            )
+
+        self.configure_dc_voltage()
+        self.write_setting("VOLTage:NPLCycles", nplc)
+        self.write_setting("SAMPle:COUNt", 1)
+        self.write_setting("TRIGer:SOURce", "EXT")
+        self.write_setting("TRIGer:DELay", 0)
+        self.write_setting("TRIGer:COUNt", int(number_of_samples))
         self.keithmulti.write("INITiate")
-        self.mutex.unlock()
+        self.acquisition_samples = int(number_of_samples)
+
+    @brokered
+    @idempotent
+    def fetch_acquisition(self):
+        """
+        Fetch all readings of an armed acquisition at once and return them as
+        numpy array. The multimeter only answers once it got a trigger for
+        each sample. If it times out or returns a different number of
+        readings, the acquisition is aborted and an IOError is raised (the
+        trigger cable from digital I/O line 1 of the Keithley source to the
+        Ext Trig input of the multimeter is probably missing).
+        """
+        try:
+            data = self.keithmulti.query("FETCh?")
+        except pyvisa.errors.VisaIOError as e:
+            if e.error_code != pyvisa.constants.StatusCode.error_timeout:
+                raise
+
+            # If the multimeter does not answer at all, the broker recovers it
+            # and fetches again (the readings are lost if it power cycled)
+            if not self.broker.probe():
+                raise
+            data = ""
+
+        readings = np.array(
+            [value for value in data.strip().split(",") if value != ""], dtype=float
+        )
+
+        if len(readings) != self.acquisition_samples:
+            # Abort the acquisition that still waits for its triggers
+            self.keithmulti.clear()
+            self.reset(force=True)
+
+            message = (
+                "The multimeter took "
+                + str(len(readings))
+                + " of "
+                + str(self.acquisition_samples)
+                + " readings. Check the cable from digital I/O line 1 of the "
+                + "Keithley source to the Ext Trig input of the multimeter."
+            )
+            cf.log_message(message)
+            raise IOError(message)
+
+        return readings
 
     # def set_fixed_range(self, value):
     #     """
@@ -401,17 +2936,232 @@ class KeithleyMultimeter:
     #     # Turn on the auto range function of the multimeter
     #     self.keithmulti.write("SENSe:VOLTage:DC:RANGe:AUTO ON")
 
+    @brokered
     def measure_voltage(self, multimeter_range=0):
         """
-        Returns an actual voltage reading on the keithley multimeter
+        Returns an actual voltage reading on the keithley multimeter. The
+        multimeter is only (re)configured if that was not done before or if
+        the range changed, otherwise it is only triggered and read out.
         """
-        if multimeter_range == 0:
-            return float(self.keithmulti.query("MEASure:VOLTage:DC?"))
+        self.trigger_measurement(1, 1, multimeter_range)
+        voltage = self.fetch_measurement()[0]
+
+        return voltage
+
+    @brokered
+    def trigger_measurement(self, number_of_samples=1, nplc=1, multimeter_range=None):
+        """
+        Trigger the armed multimeter without waiting for the result so that
+        other instruments can be read while the multimeter integrates. The
+        readings must be collected with fetch_measurement afterwards.
+        """
+        if multimeter_range is None:
+            multimeter_range = self.multimeter_range
+
+        # Only the settings that changed since the last trigger are written
+        self.configure_voltage_measurement(multimeter_range, number_of_samples, nplc)
+
+        self.keithmulti.write("*TRG")
+
+    @brokered
+    def send_bus_trigger(self):
+        """
+        Trigger a reading of the armed multimeter with the present settings
+        (see configure_voltage_measurement)
+        """
+        self.keithmulti.write("*TRG")
+
+    @brokered
+    def fetch_measurement(self):
+        """
+        Fetch the readings of the last trigger as numpy array and arm the
+        multimeter again for the next reading
+        """
+        data = self.keithmulti.query("FETCh?")
+        self.keithmulti.write("INITiate")
+
+        return np.array(data.strip().split(","), dtype=float)
+
+    @brokered
+    def set_burst(self, number_of_samples, nplc):
+        """
+        Set the number of samples that are taken on each trigger and their
+        integration time (in number of power line cycles) and arm the
+        multimeter again.
+        """
+        changed = self.write_setting("VOLTage:NPLCycles", nplc)
+        changed = self.write_setting("SAMPle:COUNt", int(number_of_samples)) or changed
+
+        if changed:
+            self.keithmulti.write("INITiate")
+
+    def set_integration_policy(self, noise_floor, target_noise, maximum_nplc=1):
+        """
+        Choose the integration time of each burst from the previous one so
+        that its noise relative to the reading stays below target_noise (see
+        IntegrationTimePolicy, noise_floor in V at 1 NPLC). The integration
+        time passed to measure_burst is used if target_noise is 0.
+        """
+        if target_noise <= 0:
+            self.integration_policy = None
+            return
+
+        self.integration_policy = IntegrationTimePolicy(
+            noise_floor,
+            target_noise,
+            [nplc for nplc in self.NPLC_VALUES if nplc < maximum_nplc] + [maximum_nplc],
+        )
+
+    def set_range_planner(self, range_planner):
+        """
+        Let range_planner choose the range ahead of each burst of
+        measure_burst (the multimeter auto ranges if it is None)
+        """
+        self.range_planner = range_planner
+
+        if range_planner is None:
+            self.set_range(0)
+
+    def burst_settings(self, nplc=1, position=None):
+        """
+        Return the integration time and range of the next burst of
+        measure_burst (from the integration policy and range planner if
+        they are set)
+        """
+        if self.integration_policy is not None:
+            nplc = self.integration_policy.next_nplc()
+
+        if self.range_planner is None:
+            multimeter_range = self.multimeter_range
         else:
-            return float(
-                self.keithmulti.query("MEASure:VOLTage:DC? " + str(multimeter_range))
+            multimeter_range = self.range_planner.select_range(
+                self.VOLTAGE_RANGES, position
+            )
+
+        return nplc, multimeter_range
+
+    @brokered
+    def configure_burst(self, number_of_samples, nplc=1, position=None):
+        """
+        Configure the multimeter for the next burst of measure_burst ahead of
+        time (e.g. so that wait_for_settling takes its readings with the same
+        settings and the burst does not have to configure the multimeter
+        again). Returns the integration time of the burst.
+        """
+        nplc, multimeter_range = self.burst_settings(nplc, position)
+        self.configure_voltage_measurement(multimeter_range, number_of_samples, nplc)
+
+        return nplc
+
+    @brokered
+    @idempotent
+    def measure_burst(self, number_of_samples, nplc=1, position=None):
+        """
+        Take number_of_samples readings on a single trigger and return them
+        all at once with one FETCh? together with their mean, standard
+        deviation and integration time. This allows to average noisy readings
+        without a USB round trip for each of them. If an integration policy
+        is set, the integration time is chosen from the previous mean instead
+        of nplc. If a range planner is set, the range is chosen from the
+        previous readings at position (e.g. the source voltage) and the burst
+        is repeated with auto range if a reading was beyond the range.
+        """
+        nplc, multimeter_range = self.burst_settings(nplc, position)
+
+        self.trigger_measurement(number_of_samples, nplc, multimeter_range)
+        samples = self.fetch_measurement()
+
+        if self.range_planner is not None:
+
+            # Fall back to auto range if the planned range was too small
+            if np.any(np.abs(samples) >= OVERFLOW_READING):
+                self.trigger_measurement(number_of_samples, nplc, 0)
+                samples = self.fetch_measurement()
+
+            self.range_planner.update(np.mean(samples), position)
+
+        if self.integration_policy is not None:
+            self.integration_policy.update(np.mean(samples))
+
+        return samples, np.mean(samples), np.std(samples), nplc
+
+    @brokered
+    def wait_for_settling(
+        self, tolerance, max_wait, nplc=0.02, noise_floor=1e-4, consecutive=2
+    ):
+        """
+        Take quick successive low NPLC readings until they converge, i.e.
+        until consecutive readings in a row differ by less than tolerance
+        (relative to the reading but at least noise_floor in V) from their
+        predecessor, or until max_wait seconds have passed. Returns the last
+        reading and the time it took to settle in s. nplc must be one of
+        NPLC_VALUES. If nplc is None, the readings are taken with the
+        present configuration of the multimeter (e.g. the one of
+        configure_burst, the mean of each burst is compared).
+        """
+        if nplc is not None and nplc not in self.NPLC_VALUES:
+            raise ValueError(
+                "The multimeter can only integrate over "
+                + ", ".join([str(value) for value in self.NPLC_VALUES])
+                + " power line cycles"
             )
 
+        starting_time = time.monotonic()
+
+        # The multimeter is configured once (nothing is written and it is not
+        # armed again if it is already set up for single readings at this
+        # integration time), each reading then only needs a trigger
+        if nplc is not None:
+            self.configure_voltage_measurement(self.multimeter_range, 1, nplc)
+
+        self.send_bus_trigger()
+        last_voltage = np.mean(self.fetch_measurement())
+        agreeing_readings = 0
+
+        while time.monotonic() - starting_time < max_wait:
+            self.send_bus_trigger()
+            samples = self.fetch_measurement()
+            voltage = np.mean(samples)
+
+            # Readings beyond a fixed range do not count, the multimeter
+            # auto ranges from then on
+            if np.any(np.abs(samples) >= OVERFLOW_READING):
+                self.set_range(0)
+                agreeing_readings = 0
+            elif abs(voltage - last_voltage) <= max(
+                tolerance * abs(voltage), noise_floor
+            ):
+                agreeing_readings += 1
+                if agreeing_readings >= consecutive:
+                    break
+            else:
+                agreeing_readings = 0
+
+            last_voltage = voltage
+
+        settling_time = time.monotonic() - starting_time
+
+        return last_voltage, settling_time
+
+    @brokered
+    def measure_averaged_voltage(self, number_of_samples=1, nplc=1):
+        """
+        Returns the photodiode voltage averaged over number_of_samples
+        readings (a single reading if number_of_samples is 1) that integrate
+        for nplc power line cycles each. The readings (e.g. the background
+        before a sweep) are no point of a curve, therefore they neither feed
+        the integration policy nor the range planner. The multimeter auto
+        ranges if a range planner is set, otherwise the fixed range is used.
+        """
+        if self.range_planner is None:
+            multimeter_range = self.multimeter_range
+        else:
+            multimeter_range = 0
+
+        self.trigger_measurement(max(int(number_of_samples), 1), nplc, multimeter_range)
+
+        return np.mean(self.fetch_measurement())
+
 
 class OceanSpectrometer:
     """
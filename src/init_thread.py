@@ -4,10 +4,12 @@ import time
 
 from hardware import (
     ArduinoUno,
+    SwitchboxArray,
     KeithleySource,
     KeithleyMultimeter,
     OceanSpectrometer,
     ThorlabMotor,
+    instrument_registry,
 )
 from tests.tests import (
     MockArduinoUno,
@@ -63,10 +65,29 @@ class InitThread(QtCore.QThread):
         self.update_loading_dialog.emit(0, "Initialising Arduino Connection")
         global_settings = cf.read_global_settings()
 
+        # Enumerate the connected devices once for all instruments (on a
+        # retry the user might have reconnected some of them in between)
+        try:
+            instrument_registry.refresh()
+        except Exception as e:
+            cf.log_message("VISA resources could not be listed")
+            cf.log_message(e)
+
         # Try if Arduino can be initialised
         try:
             try:
-                uno = ArduinoUno(global_settings["arduino_com_address"])
+                # Several switchbox boards are given as comma separated list
+                # of addresses
+                arduino_addresses = [
+                    address.strip()
+                    for address in str(global_settings["arduino_com_address"]).split(
+                        ","
+                    )
+                ]
+                if len(arduino_addresses) > 1:
+                    uno = SwitchboxArray(arduino_addresses)
+                else:
+                    uno = ArduinoUno(arduino_addresses[0])
                 cf.log_message("Arduino UNO successfully initialised")
                 arduino_init = True
             except:
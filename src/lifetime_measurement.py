@@ -6,6 +6,8 @@ import core_functions as cf
 
 import pandas as pd
 
+from hardware import RangePlanner
+
 
 class LifetimeMeasurement(QtCore.QThread):
     """
@@ -18,6 +20,10 @@ class LifetimeMeasurement(QtCore.QThread):
     hide_progress_bar = QtCore.Signal()
     reset_start_button = QtCore.Signal(bool)
 
+    # Number of readings the buffer of the Keithley source holds (the oldest
+    # are overwritten)
+    BUFFER_LENGTH = 1000
+
     def __init__(
         self,
         keithley_source,
@@ -35,7 +41,7 @@ class LifetimeMeasurement(QtCore.QThread):
 
         # Assign hardware and reset
         self.uno = arduino
-        self.uno.init_serial_connection()
+        self.uno.ensure_connection()
         self.keithley_source = keithley_source
         self.keithley_source.as_voltage_source(measurement_parameters["max_current"])
         self.keithley_multimeter = keithley_multimeter
@@ -51,7 +57,15 @@ class LifetimeMeasurement(QtCore.QThread):
         # be done while measuring but I think there is not much benefit and the
         # programming is uglier), only one pixel is scanned at a time
         self.df_data = pd.DataFrame(
-            columns=["time", "pd_voltage", "oled_current", "oled_voltage"]
+            columns=[
+                "time",
+                "host_time",
+                "pd_voltage",
+                "oled_current",
+                "oled_voltage",
+                "source_nplc",
+                "pd_nplc",
+            ]
         )
 
         # Connect the signals
@@ -99,97 +113,172 @@ class LifetimeMeasurement(QtCore.QThread):
             self.keithley_source.set_current(self.measurement_parameters["max_current"])
             cf.log_message("Keithley source initialised as current source")
 
+        # The ranges are planned from the previous readings instead of auto
+        # ranging (the source's current range only in voltage mode)
+        range_planners = []
+        if self.measurement_parameters["range_headroom"] > 0:
+            range_planners = [
+                RangePlanner(self.measurement_parameters["range_headroom"]),
+                RangePlanner(self.measurement_parameters["range_headroom"]),
+            ]
+            self.keithley_source.set_range_planner(range_planners[0])
+            self.keithley_multimeter.set_range_planner(range_planners[1])
+
         # Iterate over all selected pixels
         for pixel in self.selected_pixels:
             # self.keithley_source.empty_buffer("OLEDbuffer")
             # Empty dataframe
             self.df_data = self.df_data.iloc[0:0]
 
+            # The Keithley source stores the readings in its own buffer. Each
+            # reading is read right away with its timestamp on the
+            # instrument's clock, so the buffer only has to hold the latest
+            # readings and overwrites the oldest ones no matter how long the
+            # measurement runs.
+            self.keithley_source.init_buffer(
+                "LifetimeBuffer", self.BUFFER_LENGTH, continuous=True
+            )
+
             cf.log_message("Running on Pixel " + str(pixel))
 
+            # The integration time of each reading is chosen from the
+            # previous one. The noise floor of the Keithley source refers to
+            # the measured current, in current mode the (much larger) voltage
+            # is read with a fixed integration time.
+            if not self.measurement_parameters["current_mode"]:
+                self.keithley_source.set_integration_policy(
+                    self.measurement_parameters["source_noise_floor"],
+                    self.measurement_parameters["nplc_target_noise"],
+                )
+            self.keithley_multimeter.set_integration_policy(
+                self.measurement_parameters["photodiode_noise_floor"],
+                self.measurement_parameters["nplc_target_noise"],
+                self.measurement_parameters["photodiode_nplc"],
+            )
+
+            # Each pixel is a new curve for the range planners
+            for range_planner in range_planners:
+                range_planner.next_curve()
+
             # Take PD voltage reading from Multimeter for background
-            background_diodevoltage = self.keithley_multimeter.measure_voltage()
+            background_diodevoltage = self.keithley_multimeter.measure_averaged_voltage(
+                self.measurement_parameters["photodiode_samples"],
+                self.measurement_parameters["photodiode_nplc"],
+            )
 
-            # Activate the relay of the selected pixel
+            # Activate the relay of the selected pixel (or all selected
+            # pixels at once)
             if self.measurement_parameters["all_pixel_mode"]:
-                for pixel in self.selected_pixels:
-                    self.uno.trigger_relay(pixel)
+                self.uno.set_relays(self.uno.pixels_to_mask(self.selected_pixels))
             else:
-                self.uno.trigger_relay(pixel)
+                self.uno.set_relays(self.uno.pixels_to_mask([pixel]))
 
             # Turn on the voltage
             self.keithley_source.activate_output()
 
-            # Define starting time and elapsed time
-            starting_time = time.time()
-
-            i = 0
-            while (
-                time.time() - starting_time < self.measurement_parameters["on_time"] + 1
-            ):
-                beginning_time = time.time()
-
-                # Time is recorded before the measurement
-                self.df_data.loc[i, "time"] = time.time() - starting_time
-
-                # Take PD voltage reading from Multimeter
-                # if self.measurement_parameters["fixed_multimeter_range"]:
-                # diode_voltage = self.keithley_multimeter.measure_voltage(1)
-                # else:
-                # Take OLED current reading from Sourcemeter
-                diode_voltage = self.keithley_multimeter.measure_voltage()
-                oled_current = self.keithley_source.read_current()
-                oled_voltage = self.keithley_source.read_voltage()
-
-                # Check if PD saturation is reached
-                if (
-                    diode_voltage
-                    >= self.measurement_parameters["photodiode_saturation"]
+            # Define starting time and elapsed time (the monotonic clock does
+            # not jump with adjustments of the system time)
+            starting_time = time.monotonic()
+
+            # The data measured so far is saved if the measurement fails
+            # (e.g. an instrument can not be recovered)
+            try:
+                i = 0
+                while (
+                    time.monotonic() - starting_time
+                    < self.measurement_parameters["on_time"] + 1
                 ):
-                    cf.log_message(
-                        "Photodiode reached saturation. You might want to adjust the photodiode gain."
+                    # Host time is recorded right before the measurement
+                    beginning_time = time.monotonic()
+
+                    # Take PD voltage reading from Multimeter
+                    # if self.measurement_parameters["fixed_multimeter_range"]:
+                    # diode_voltage = self.keithley_multimeter.measure_voltage(1)
+                    # else:
+                    # Take OLED current reading from Sourcemeter (both instruments
+                    # integrate at the same time)
+                    reading, diode_voltage, diode_nplc = (
+                        self.keithley_source.measure_iv_with_photodiode(
+                            self.keithley_multimeter,
+                            self.measurement_parameters["photodiode_samples"],
+                            self.measurement_parameters["photodiode_nplc"],
+                            buffer_name="LifetimeBuffer",
+                        )
                     )
 
-                    # Wait a second so that the user can read the message
-                    time.sleep(1)
-                    break
+                    # Check if PD saturation is reached
+                    if (
+                        diode_voltage
+                        >= self.measurement_parameters["photodiode_saturation"]
+                    ):
+                        cf.log_message(
+                            "Photodiode reached saturation. You might want to adjust the photodiode gain."
+                        )
+
+                        # Wait a second so that the user can read the message
+                        time.sleep(1)
+                        break
+
+                    # The time axis is given by the timestamp of the Keithley
+                    # source's reading (from the first reading of the pixel on),
+                    # the host time is kept for reference
+                    if i == 0:
+                        first_timestamp = reading.timestamp
+                    self.df_data.loc[i, "time"] = reading.timestamp - first_timestamp
+                    self.df_data.loc[i, "host_time"] = beginning_time - starting_time
+
+                    # Current should be in mA
+                    self.df_data.loc[i, "pd_voltage"] = (
+                        diode_voltage - background_diodevoltage
+                    )
 
-                # Current should be in mA
-                self.df_data.loc[i, "pd_voltage"] = (
-                    diode_voltage - background_diodevoltage
-                )
+                    self.df_data.loc[i, "oled_current"] = reading.current
+                    self.df_data.loc[i, "oled_voltage"] = reading.voltage
+                    self.df_data.loc[i, "source_nplc"] = reading.nplc
+                    self.df_data.loc[i, "pd_nplc"] = diode_nplc
+                    if self.measurement_parameters["current_mode"]:
+                        additional_data = self.df_data.oled_voltage
+                    else:
+                        additional_data = self.df_data.oled_current
+
+                    self.update_plot.emit(
+                        self.df_data.time.to_numpy(dtype=float),
+                        self.df_data.pd_voltage.to_numpy(dtype=float),
+                        additional_data,
+                        self.measurement_parameters["current_mode"],
+                    )
 
-                self.df_data.loc[i, "oled_current"] = oled_current
-                self.df_data.loc[i, "oled_voltage"] = oled_voltage
-                if self.measurement_parameters["current_mode"]:
-                    additional_data = self.df_data.oled_voltage
-                else:
-                    additional_data = self.df_data.oled_current
-
-                self.update_plot.emit(
-                    self.df_data.time.to_numpy(dtype=float),
-                    self.df_data.pd_voltage.to_numpy(dtype=float),
-                    additional_data,
-                    self.measurement_parameters["current_mode"],
-                )
+                    # increment counter
+                    i += 1
 
-                # increment counter
-                i += 1
+                    # Look for instrument errors now and then so that a problem
+                    # shows up in the log while the measurement is still running
+                    if i % 100 == 0:
+                        self.keithley_source.check_errors()
+                        self.keithley_multimeter.check_errors()
 
-                # Breaks out of the time loop
-                if self.stop == True:
-                    break
+                    # Breaks out of the time loop
+                    if self.stop == True:
+                        break
 
-                # Sleep for the time of measurement interval
-                if (
-                    self.measurement_parameters["measurement_interval"]
-                    - (time.time() - beginning_time)
-                    > 0
-                ):
-                    time.sleep(
+                    # Sleep for the time of measurement interval
+                    if (
                         self.measurement_parameters["measurement_interval"]
-                        - (time.time() - beginning_time)
-                    )
+                        - (time.monotonic() - beginning_time)
+                        > 0
+                    ):
+                        time.sleep(
+                            self.measurement_parameters["measurement_interval"]
+                            - (time.monotonic() - beginning_time)
+                        )
+            except Exception:
+                cf.log_message(
+                    "Lifetime measurement of pixel "
+                    + str(pixel)
+                    + " failed. Saving the data measured so far."
+                )
+                self.save_data(pixel)
+                raise
 
             # If a bad contact was detected, jump this iteration (no saving etc.)
             # if bad_contact == True:
@@ -199,11 +288,15 @@ class LifetimeMeasurement(QtCore.QThread):
             self.keithley_source.deactivate_output()
 
             # Turn off all relays
-            self.uno.trigger_relay(pixel)
+            self.uno.set_relays(0)
 
             # Save data
             self.save_data(pixel)
 
+            # Report everything the instruments complained about for this pixel
+            self.keithley_source.check_errors()
+            self.keithley_multimeter.check_errors()
+
             # Breaks the pixel loop so that only the output is deactivated etc.
             if self.stop == True:
                 break
@@ -222,6 +315,13 @@ class LifetimeMeasurement(QtCore.QThread):
             # separate threads but for now this is the easiest way
             # app.processEvents()
 
+        # Go back to a fixed integration time and auto range
+        if not self.measurement_parameters["current_mode"]:
+            self.keithley_source.set_integration_policy(0, 0)
+        self.keithley_multimeter.set_integration_policy(0, 0)
+        self.keithley_source.set_range_planner(None)
+        self.keithley_multimeter.set_range_planner(None)
+
         # Breaks the pixel loop so that only the output is deactivated etc.
         if self.stop == True:
             cf.log_message("Lifetime measurement interrupted by user")
@@ -261,8 +361,11 @@ class LifetimeMeasurement(QtCore.QThread):
             + " s"
         )
         line02 = "### Measurement data ###"
-        line03 = "Time\t Photodiode Voltage\t OLED Current\t OLED Voltage"
-        line04 = "s\t V\t A\t V\n"
+        line03 = (
+            "Time\t Host Time\t Photodiode Voltage\t OLED Current\t OLED Voltage\t "
+            + "OLED NPLC\t Photodiode NPLC"
+        )
+        line04 = "s\t s\t V\t A\t V\t NPLC\t NPLC\n"
 
         header_lines = [
             line01,
@@ -285,7 +388,10 @@ class LifetimeMeasurement(QtCore.QThread):
         )
 
         # Format the dataframe for saving (no. of digits)
-        self.df_data["time"] = self.df_data["time"].map(lambda x: "{0:.2f}".format(x))
+        self.df_data["time"] = self.df_data["time"].map(lambda x: "{0:.3f}".format(x))
+        self.df_data["host_time"] = self.df_data["host_time"].map(
+            lambda x: "{0:.3f}".format(x)
+        )
         self.df_data["pd_voltage"] = self.df_data["pd_voltage"].map(
             lambda x: "{0:.7f}".format(x)
         )
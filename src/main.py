@@ -7,6 +7,7 @@ from spectrum_measurement import SpectrumMeasurement
 from lifetime_measurement import LifetimeMeasurement
 from goniometer_measurement import GoniometerMeasurement
 from loading_window import LoadingWindow
+from prebias import Prebias
 
 from tests.tests import MockThorlabMotor
 from hardware import (
@@ -16,6 +17,7 @@ from hardware import (
     KeithleyMultimeter,
     KeithleySource,
     MotorMoveThread,
+    instrument_registry,
 )
 
 import core_functions as cf
@@ -733,9 +735,9 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         https://stackoverflow.com/questions/17045368/qthread-emits-finished-signal-but-isrunning-returns-true-and-isfinished-re
         """
         # Reset the keithley by reseting it as voltage source
-        self.keithley_source.as_voltage_source(1050)
-        self.keithley_multimeter.reset()
-        self.arduino_uno.init_serial_connection()
+        self.keithley_source.as_voltage_source(1050, force=True)
+        self.keithley_multimeter.reset(force=True)
+        self.arduino_uno.ensure_connection()
 
         # # Kill process and delete old current tester object
         # self.current_tester.kill()
@@ -842,8 +844,12 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         Selects all pixels and applies the given voltage
         """
 
-        # Toggle all buttons for the unselected pixels
-        self.current_tester.uno.trigger_relay(9)
+        # Turn on the relays of all pixels at once
+        self.current_tester.uno.set_relays(
+            self.current_tester.uno.pixels_to_mask(
+                range(1, len(self.sw_pushbutton_array) + 1)
+            )
+        )
 
         for i in range(len(self.sw_pushbutton_array)):
             self.sw_pushbutton_array[i].setChecked(True)
@@ -891,45 +897,18 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         # Unselect all pixels first (in case some have been selected before)
         self.unselect_all_pixels()
 
-        # Set voltage to prebias voltage
-        self.keithley_source.set_voltage(pre_bias_voltage)
-        self.sw_ct_voltage_spinBox.setValue(pre_bias_voltage)
-
-        # Pre-bias all pixels automatically
-        for pixel in range(len(self.sw_pushbutton_array)):
-            # Close all relays
-            self.arduino_uno.trigger_relay(0)
-
-            # Set push button to checked and open relay of the pixel
-            self.sw_pushbutton_array[pixel].setChecked(True)
-            self.specw_pushbutton_array[pixel].setChecked(True)
-            self.arduino_uno.trigger_relay(pixel + 1)
-
-            # Turn on the voltage
-            self.keithley_source.activate_output()
-
-            # Update GUI while being in a loop. It would be better to use
-            # separate threads but for now this is the easiest way
-            app.processEvents()
-
-            # Bias for half a second
-            time.sleep(biasing_time)
-
-            # Deactivate the pixel again
-            self.sw_pushbutton_array[pixel].setChecked(False)
-            self.specw_pushbutton_array[pixel].setChecked(False)
-            self.arduino_uno.trigger_relay(pixel + 1)
-
-            # Turn off the voltage
-            self.keithley_source.deactivate_output()
-
-        # Set voltage to prebias voltage
-        self.keithley_source.activate_output()
-        self.keithley_source.set_voltage(set_voltage)
-        self.sw_ct_voltage_spinBox.setValue(set_voltage)
-
-        # Update statusbar
-        cf.log_message("Finished prebiasing")
+        # The pixels are switched by the Arduino in a separate thread so
+        # that the GUI stays responsive
+        self.prebias = Prebias(
+            self.keithley_source,
+            self.arduino_uno,
+            pre_bias_voltage,
+            set_voltage,
+            range(1, len(self.sw_pushbutton_array) + 1),
+            biasing_time,
+            parent=self,
+        )
+        self.prebias.start()
 
     def autotest_pixels(self):
         """
@@ -971,7 +950,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         working_pixels = []
 
         # Close all relays
-        self.arduino_uno.trigger_relay(0)
+        self.arduino_uno.set_relays(0)
 
         for pixel in range(len(self.sw_pushbutton_array)):
 
@@ -979,7 +958,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self.sw_pushbutton_array[pixel].setChecked(True)
             self.specw_pushbutton_array[pixel].setChecked(True)
             self.aw_pushbutton_array[pixel].setChecked(True)
-            self.arduino_uno.trigger_relay(pixel + 1)
+            self.arduino_uno.set_relays(1 << pixel)
 
             # Measure baseline pd_voltage to compare value with
             pd_voltage_baseline = self.keithley_multimeter.measure_voltage()
@@ -1021,7 +1000,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self.sw_pushbutton_array[pixel].setChecked(False)
             self.specw_pushbutton_array[pixel].setChecked(False)
             self.aw_pushbutton_array[pixel].setChecked(False)
-            self.arduino_uno.trigger_relay(pixel + 1)
+            self.arduino_uno.set_relays(0)
 
             # Turn off the voltage
             self.keithley_source.set_voltage(0)
@@ -1108,6 +1087,18 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             # "fixed_multimeter_range": self.aw_set_fixed_multimeter_range_toggleSwitch.isChecked(),
             "photodiode_saturation": float(global_parameters["photodiode_saturation"]),
             # "check_pd_saturation": self.aw_pd_saturation_toggleSwitch.isChecked(),
+            "sweep_mode": global_parameters["jvl_sweep_mode"],
+            "settling_tolerance": global_parameters["settling_tolerance"],
+            "adaptive_minimum_step": global_parameters["adaptive_minimum_step"],
+            "adaptive_point_budget": global_parameters["adaptive_point_budget"],
+            "photodiode_samples": int(global_parameters["photodiode_samples"]),
+            "photodiode_nplc": global_parameters["photodiode_nplc"],
+            "pulse_width": global_parameters["pulse_width"],
+            "pulse_duty_cycle": global_parameters["pulse_duty_cycle"],
+            "nplc_target_noise": global_parameters["nplc_target_noise"],
+            "source_noise_floor": global_parameters["source_noise_floor"],
+            "photodiode_noise_floor": global_parameters["photodiode_noise_floor"],
+            "range_headroom": global_parameters["range_headroom"],
         }
 
         # Boolean list for selected pixels
@@ -1430,6 +1421,12 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             # "fixed_multimeter_range": self.aw_set_fixed_multimeter_range_toggleSwitch.isChecked(),
             "photodiode_saturation": float(global_parameters["photodiode_saturation"]),
             # "check_pd_saturation": self.aw_pd_saturation_toggleSwitch.isChecked(),
+            "photodiode_samples": int(global_parameters["photodiode_samples"]),
+            "photodiode_nplc": global_parameters["photodiode_nplc"],
+            "nplc_target_noise": global_parameters["nplc_target_noise"],
+            "source_noise_floor": global_parameters["source_noise_floor"],
+            "photodiode_noise_floor": global_parameters["photodiode_noise_floor"],
+            "range_headroom": global_parameters["range_headroom"],
         }
 
         # Boolean list for selected pixels
@@ -2021,7 +2018,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
         # Kill connection to Keithleys
         try:
-            pyvisa.ResourceManager().close()
+            instrument_registry.close()
         except Exception as e:
             cf.log_message("Connection to Keithleys could not be closed savely")
             cf.log_message(e)
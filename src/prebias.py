@@ -0,0 +1,107 @@
+from PySide6 import QtCore
+
+import core_functions as cf
+
+
+class Prebias(QtCore.QThread):
+    """
+    QThread that prebiases all pixels one after the other. The Arduino
+    switches the pixels with its own timing while the Keithley source holds
+    the prebias voltage, so the GUI is not blocked and the biasing time
+    does not depend on the host.
+    """
+
+    update_voltage = QtCore.Signal(float)
+    enable_prebias_button = QtCore.Signal(bool)
+
+    # Time in ms all relays are off between two pixels so that two pixels
+    # are never connected at the same time (break before make)
+    BREAK_TIME = 20
+
+    def __init__(
+        self,
+        keithley_source,
+        arduino,
+        pre_bias_voltage,
+        set_voltage,
+        pixels,
+        biasing_time=0.5,
+        parent=None,
+    ):
+        """
+        Initialise class. pixels are the pixels that are prebiased (counted
+        from 1) and biasing_time the time in s each pixel is biased for.
+        set_voltage is the voltage the source is set to afterwards.
+        """
+        super(Prebias, self).__init__()
+
+        self.keithley_source = keithley_source
+        self.uno = arduino
+
+        self.pre_bias_voltage = pre_bias_voltage
+        self.set_voltage = set_voltage
+        self.pixels = pixels
+        self.biasing_time = biasing_time
+
+        # Connect the signals
+        self.update_voltage.connect(parent.sw_ct_voltage_spinBox.setValue)
+        self.enable_prebias_button.connect(parent.sw_prebias_pushButton.setEnabled)
+
+    def relay_schedule(self):
+        """
+        Relay schedule that switches each pixel on for the biasing time and
+        all relays off in between and at the end
+        """
+        steps = []
+        for pixel in self.pixels:
+            steps.append((self.uno.pixels_to_mask([pixel]), self.biasing_time * 1000))
+            steps.append((0, self.BREAK_TIME))
+
+        # All relays stay off once the schedule is done
+        steps.append((0, 0))
+
+        return steps
+
+    def run(self):
+        """
+        Function that does the actual prebiasing. It is started with the
+        .start() method from the QThread class.
+        """
+        import pydevd
+
+        pydevd.settrace(suspend=False)
+
+        self.prebias()
+
+    def prebias(self):
+        """
+        Hold the prebias voltage on the source and let the Arduino switch
+        through the pixels
+        """
+        self.enable_prebias_button.emit(False)
+
+        # Start from all relays off so that no pixel is biased while the
+        # voltage changes
+        self.uno.set_relays(0)
+        self.keithley_source.set_voltage(self.pre_bias_voltage)
+        self.update_voltage.emit(self.pre_bias_voltage)
+
+        # The output stays on for the whole schedule, only the relays switch
+        self.keithley_source.activate_output()
+
+        try:
+            self.uno.run_schedule(self.relay_schedule())
+        except Exception:
+            # Do not leave a pixel biased if the schedule did not finish
+            self.uno.stop_schedule()
+            self.keithley_source.deactivate_output()
+            self.enable_prebias_button.emit(True)
+            raise
+
+        # Set voltage back to the one set before (all relays are off)
+        self.keithley_source.set_voltage(self.set_voltage)
+        self.update_voltage.emit(self.set_voltage)
+        self.enable_prebias_button.emit(True)
+
+        # Update statusbar
+        cf.log_message("Finished prebiasing")
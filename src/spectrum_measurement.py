@@ -29,7 +29,7 @@ class SpectrumMeasurement(QtCore.QThread):
 
         # Assign hardware and reset
         self.uno = arduino
-        self.uno.init_serial_connection()
+        self.uno.ensure_connection()
         self.keithley_source = keithley_source
         self.keithley_source.as_voltage_source(1050)
         self.spectrometer = spectrometer
@@ -0,0 +1,157 @@
+import types
+import pytest
+
+from autotube_measurement import AutotubeMeasurement
+from hardware import (
+    ArduinoUno,
+    KeithleySource,
+    KeithleyMultimeter,
+    instrument_registry,
+)
+from tests.simulated_instruments import SimulatedResourceManager
+from tests.simulated_switchbox import SimulatedSwitchbox
+
+# The trigger test drives the real motor and spectrometer
+collect_ignore = ["trigger_test.py"]
+
+# Addresses the simulated resource manager hands the instruments out at
+SOURCE_ADDRESS = "USB0::0x05E6::0x2450::04426583::INSTR"
+MULTIMETER_ADDRESS = "USB0::0x05E6::0x2100::8011801::INSTR"
+
+# Measurement parameters of the autotube measurement (the defaults of the
+# global settings with a shorter sweep)
+AUTOTUBE_PARAMETERS = {
+    "min_voltage": -2,
+    "max_voltage": 5,
+    "changeover_voltage": 2,
+    "low_voltage_step": 0.5,
+    "high_voltage_step": 0.25,
+    "scan_compliance": 105,
+    "auto_spectrum": False,
+    "photodiode_saturation": 10,
+    "sweep_mode": "stepwise",
+    "settling_tolerance": 0.005,
+    "adaptive_minimum_step": 0.05,
+    "adaptive_point_budget": 40,
+    "photodiode_samples": 1,
+    "photodiode_nplc": 1,
+    "pulse_width": 0.05,
+    "pulse_duty_cycle": 0.2,
+    "nplc_target_noise": 0.001,
+    "source_noise_floor": 1e-09,
+    "photodiode_noise_floor": 1e-05,
+    "range_headroom": 1.2,
+}
+
+
+@pytest.fixture
+def simulated_instruments():
+    """
+    Connect the drivers of both Keithleys to simulated instruments. The
+    fixture returns a function that takes the language of the source, the
+    time scale of the simulation and further options of the simulation
+    (e.g. trigger_cable) and returns the resource manager (which holds the
+    simulated instruments) and both drivers.
+    """
+
+    def connect(language="SCPI", time_scale=0.01, **options):
+        resource_manager = SimulatedResourceManager(
+            language=language, time_scale=time_scale, **options
+        )
+        instrument_registry.set_resource_manager(resource_manager)
+
+        keithley_source = KeithleySource(SOURCE_ADDRESS, 105)
+        keithley_multimeter = KeithleyMultimeter(MULTIMETER_ADDRESS)
+
+        return resource_manager, keithley_source, keithley_multimeter
+
+    yield connect
+
+    # Stop the brokers of the instruments
+    instrument_registry.set_resource_manager(None)
+
+
+@pytest.fixture
+def switchbox():
+    """
+    Connect an ArduinoUno to the switchbox emulator. Returns the emulator
+    and the driver.
+    """
+    emulator = SimulatedSwitchbox()
+    uno = ArduinoUno(emulator.port)
+
+    yield emulator, uno
+
+    uno.close()
+    emulator.close()
+
+
+@pytest.fixture
+def main_window():
+    """
+    Stand-in for the main window that the measurement threads report to
+    """
+    return types.SimpleNamespace(
+        plot_autotube_measurement=lambda voltage, current, pd_voltage: None,
+        progressBar=types.SimpleNamespace(
+            setProperty=lambda name, value: None, hide=lambda: None
+        ),
+        aw_start_measurement_pushButton=types.SimpleNamespace(
+            setChecked=lambda checked: None
+        ),
+        unselect_all_pixels=lambda: None,
+    )
+
+
+@pytest.fixture
+def autotube_measurement(simulated_instruments, switchbox, main_window):
+    """
+    Autotube measurement on the simulated instruments and the switchbox
+    emulator. The fixture returns a function that takes the language of the
+    source and the measurement parameters that differ from
+    AUTOTUBE_PARAMETERS and returns the measurement (the resource manager
+    is kept as its resource_manager).
+    """
+
+    def create(language="SCPI", **parameters):
+        resource_manager, keithley_source, keithley_multimeter = simulated_instruments(
+            language
+        )
+        measurement = AutotubeMeasurement(
+            keithley_source,
+            keithley_multimeter,
+            switchbox[1],
+            dict(AUTOTUBE_PARAMETERS, **parameters),
+            {},
+            0.01,
+            [1, 2, 3],
+            0,
+            parent=main_window,
+        )
+        measurement.resource_manager = resource_manager
+
+        return measurement
+
+    return create
+
+
+@pytest.fixture
+def sent_commands(monkeypatch):
+    """
+    Record the messages that are written to a simulated instrument. The
+    fixture returns a function that starts the recording for an instrument
+    and returns the list the messages are collected in.
+    """
+
+    def record(instrument):
+        messages = []
+        write = instrument.write
+
+        def recording_write(message):
+            messages.append(message)
+            return write(message)
+
+        monkeypatch.setattr(instrument, "write", recording_write)
+        return messages
+
+    return record
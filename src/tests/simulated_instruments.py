@@ -0,0 +1,1429 @@
+import re
+import time
+import struct
+import threading
+import queue
+import numpy as np
+import pyvisa
+
+try:
+    from lupa.lua51 import LuaRuntime, LuaSyntaxError
+except ImportError:
+    # The TSP mode of the simulated source needs lupa (pip install lupa)
+    LuaRuntime = None
+
+
+def normalise_header(header):
+    """
+    Bring a SCPI command header (e.g. "Source:Volt:ILimit" or ":SOUR:VOLT:ILIM")
+    into a canonical form so that short and long forms can be compared. Each
+    node is reduced to its first four letters and numeric suffixes (e.g. the
+    1 in "Line1") are returned separately.
+    """
+    nodes = []
+    suffixes = []
+    header = header.strip().lstrip(":")
+    query = header.endswith("?")
+    for node in header.rstrip("?").split(":"):
+        match = re.match(r"^(\*?[A-Za-z]+?)(\d*)$", node)
+        if match is None:
+            nodes.append(node.upper())
+            continue
+        # Common commands (e.g. *LANG) are not abbreviated
+        if match.group(1).startswith("*"):
+            nodes.append(match.group(1).upper())
+        else:
+            nodes.append(match.group(1).upper()[:4])
+        if match.group(2) != "":
+            suffixes.append(int(match.group(2)))
+
+    return ":".join(nodes) + ("?" if query else ""), suffixes
+
+
+def split_arguments(arguments):
+    """
+    Split the comma separated arguments of a command (quotes are removed)
+    """
+    if arguments.strip() == "":
+        return []
+    return [
+        argument.strip().strip('"')
+        for argument in re.findall(r'(?:[^,"]|"[^"]*")+', arguments)
+    ]
+
+
+class OLEDModel:
+    """
+    Diode-like model of an OLED pixel with a photodiode in front of it. The
+    current follows the Shockley equation with series and shunt resistance,
+    the photodiode voltage is proportional to the diode current (minus
+    leakage) and settles with a first order time constant after each change.
+    """
+
+    def __init__(
+        self,
+        saturation_current=1e-13,
+        ideality_voltage=0.15,
+        series_resistance=50,
+        shunt_resistance=1e8,
+        photodiode_gain=2e3,
+        photodiode_offset=5e-4,
+        photodiode_noise=2e-5,
+        photodiode_saturation=10,
+        settling_time_constant=0.02,
+        time_scale=1,
+    ):
+        self.saturation_current = saturation_current
+        self.ideality_voltage = ideality_voltage
+        self.series_resistance = series_resistance
+        self.shunt_resistance = shunt_resistance
+        self.photodiode_gain = photodiode_gain
+        self.photodiode_offset = photodiode_offset
+        self.photodiode_noise = photodiode_noise
+        self.photodiode_saturation = photodiode_saturation
+        self.settling_time_constant = settling_time_constant
+        self.time_scale = time_scale
+
+        # Applied voltage, current and the time it was applied
+        self.voltage = 0
+        self.current = 0
+        self.photodiode_voltage_before = photodiode_offset
+        self.change_time = time.time()
+
+    def diode_current(self, current, voltage):
+        """
+        Current through the diode itself (without shunt) at a given terminal
+        voltage and total current
+        """
+        junction_voltage = voltage - current * self.series_resistance
+        exponent = min(junction_voltage / self.ideality_voltage, 200)
+        return self.saturation_current * (np.exp(exponent) - 1)
+
+    def current_at(self, voltage):
+        """
+        Solve for the total current at a given terminal voltage (bisection)
+        """
+        low = -abs(voltage) / self.shunt_resistance - 1e-3
+        high = abs(voltage) / self.series_resistance + 1e-3
+        for i in range(100):
+            current = (low + high) / 2
+            junction_voltage = voltage - current * self.series_resistance
+            residual = (
+                current
+                - self.diode_current(current, voltage)
+                - junction_voltage / self.shunt_resistance
+            )
+            if residual > 0:
+                high = current
+            else:
+                low = current
+
+        return (low + high) / 2
+
+    def voltage_at(self, current):
+        """
+        Solve for the terminal voltage at a given current (bisection)
+        """
+        low = -1e3
+        high = 1e3
+        for i in range(100):
+            voltage = (low + high) / 2
+            if self.current_at(voltage) > current:
+                high = voltage
+            else:
+                low = voltage
+
+        return (low + high) / 2
+
+    def settled_photodiode_voltage(self):
+        """
+        Photodiode voltage the pixel settles to at the present operating point
+        """
+        light = (
+            max(self.diode_current(self.current, self.voltage), 0)
+            * self.photodiode_gain
+        )
+        return min(light + self.photodiode_offset, self.photodiode_saturation)
+
+    def apply(self, voltage=None, current=None, output=True):
+        """
+        Change the operating point (either voltage or current is given)
+        """
+        self.photodiode_voltage_before = self.photodiode_voltage(time.time(), False)
+        if not output:
+            self.voltage = 0
+            self.current = 0
+        elif current is None:
+            self.voltage = voltage
+            self.current = self.current_at(voltage)
+        else:
+            self.current = current
+            self.voltage = self.voltage_at(current)
+        self.change_time = time.time()
+
+    def photodiode_voltage(self, at_time, noise=True):
+        """
+        Photodiode voltage at a given time including settling and noise
+        """
+        settled = self.settled_photodiode_voltage()
+        voltage = settled + (self.photodiode_voltage_before - settled) * np.exp(
+            -max(at_time - self.change_time, 0)
+            / (self.settling_time_constant * self.time_scale)
+        )
+        if noise:
+            voltage += np.random.normal(0, self.photodiode_noise)
+
+        return min(voltage, self.photodiode_saturation)
+
+
+# Lua environment of the simulated source in TSP mode. The scripts of
+# hardware.py are executed by a Lua 5.1 interpreter, only the instrument
+# functions they call (smu, buffer, digio, trigger, errorqueue, delay,
+# printbuffer and print) are provided by the simulation (sim).
+TSP_ENVIRONMENT = """
+local sim = ...
+
+-- The attributes of the smu table are kept by the simulation, the tables in
+-- it (e.g. smu.source) are looked up on each access
+local function node(path)
+    return setmetatable({}, {
+        __index = function(t, key)
+            local value = sim.tsp_get(path .. key)
+            if value == nil then
+                return node(path .. key .. ".")
+            end
+            return value
+        end,
+        __newindex = function(t, key, value)
+            sim.tsp_set(path .. key, value)
+        end,
+    })
+end
+smu = node("")
+
+buffer = {
+    make = sim.tsp_make_buffer,
+    delete = function(buffer_variable) end,
+    FILL_CONTINUOUS = "CONTINUOUS",
+    FILL_ONCE = "ONCE",
+}
+defbuffer1 = sim.tsp_default_buffer
+defbuffer2 = sim.tsp_make_buffer(100000)
+
+digio = {MODE_TRIGGER_IN = "TRIGGER_IN", MODE_TRIGGER_OUT = "TRIGGER_OUT", line = {}}
+trigger = {LOGIC_NEGATIVE = "NEGATIVE", LOGIC_POSITIVE = "POSITIVE", digout = {}}
+for line = 1, 6 do
+    digio.line[line] = {mode = "DIGITAL_IN"}
+    trigger.digout[line] = {
+        logic = "NEGATIVE",
+        pulsewidth = 1e-5,
+        assert = function() sim.tsp_assert_digout(line) end,
+    }
+end
+
+errorqueue = setmetatable({
+    next = function()
+        local entry = sim.tsp_next_error()
+        return entry[1], entry[2]
+    end,
+    clear = sim.tsp_clear_errors,
+}, {
+    __index = function(t, key)
+        if key == "count" then
+            return sim.tsp_error_count()
+        end
+    end,
+})
+
+script = {delete = function(name) _G[name] = nil end}
+delay = sim.tsp_delay
+printbuffer = sim.tsp_printbuffer
+print = function(...)
+    local values = {}
+    for i = 1, select("#", ...) do
+        values[i] = tostring(select(i, ...))
+    end
+    sim.tsp_print(table.concat(values, "\t"))
+end
+"""
+
+
+class TspAbort(Exception):
+    """
+    Raised in the simulated source to stop a running TSP command (device
+    clear)
+    """
+
+
+class ReadingBuffer(list):
+    """
+    Reading buffer of the simulated source in SCPI mode (Trace:Make). Once it
+    is full, the oldest readings are overwritten (fill mode CONT) or no more
+    readings are stored (fill mode ONCE).
+    """
+
+    def __init__(self, capacity=100000, fill_mode="CONT"):
+        super(ReadingBuffer, self).__init__()
+        self.capacity = int(capacity)
+        self.fill_mode = fill_mode
+
+    def append(self, entry):
+        if len(self) >= self.capacity:
+            if self.fill_mode != "CONT":
+                return
+            del self[: len(self) - self.capacity + 1]
+        super(ReadingBuffer, self).append(entry)
+
+
+class TspBuffer:
+    """
+    Reading buffer of the simulated source in TSP mode (buffer.make). The
+    oldest readings are overwritten once it is full (unless its fillmode is
+    buffer.FILL_ONCE).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.fillmode = "CONTINUOUS"
+        self.entries = []
+
+    def append(self, entry):
+        if len(self.entries) >= self.capacity and self.fillmode != "CONTINUOUS":
+            return
+        self.entries.append(entry)
+        del self.entries[: -self.capacity]
+
+    def clear(self):
+        self.entries.clear()
+
+    @property
+    def n(self):
+        return len(self.entries)
+
+    @property
+    def sourcevalues(self):
+        return [entry[0] for entry in self.entries]
+
+    @property
+    def readings(self):
+        return [entry[1] for entry in self.entries]
+
+    @property
+    def relativetimestamps(self):
+        return [entry[2] - self.entries[0][2] for entry in self.entries]
+
+    @property
+    def seconds(self):
+        return [float(int(entry[2])) for entry in self.entries]
+
+    @property
+    def fractionalseconds(self):
+        return [entry[2] % 1 for entry in self.entries]
+
+
+class SimulatedInstrument:
+    """
+    Base class of the simulated instruments. It mimics the parts of a pyvisa
+    message based resource that are used in hardware.py (write, query,
+    query_binary_values, timeout, close) and adds USB latency as well as
+    integration time to each transfer. All times can be scaled with
+    time_scale to speed up simulations.
+    """
+
+    def __init__(self, model, usb_latency=1e-3, line_frequency=50, time_scale=1):
+        self.model = model
+        self.usb_latency = usb_latency
+        self.line_frequency = line_frequency
+        self.time_scale = time_scale
+        self.timeout = 2000
+        self.errors = []
+        self.pending_response = None
+        self.lock = threading.RLock()
+
+        # Number of messages sent to the instrument (for benchmarks)
+        self.transfers = 0
+
+        # The USB connection and the VISA session to the instrument
+        self.connected = True
+        self.session_open = True
+
+    def wait(self, duration):
+        """
+        Sleep for a (scaled) time
+        """
+        if duration > 0:
+            time.sleep(duration * self.time_scale)
+
+    def integration_time(self, nplc):
+        """
+        Integration time of a single measurement in s
+        """
+        return nplc / self.line_frequency
+
+    def transfer(self, number_of_bytes=0):
+        """
+        Time it takes to transfer a message via USB
+        """
+        self.transfers += 1
+        self.wait(self.usb_latency + number_of_bytes / 1e6)
+
+    def check_connection(self):
+        """
+        Raise the VISA error of a lost connection if the instrument was
+        disconnected or the session closed
+        """
+        if not self.connected or not self.session_open:
+            raise pyvisa.errors.VisaIOError(
+                pyvisa.constants.StatusCode.error_connection_lost
+            )
+
+    def write(self, message):
+        self.check_connection()
+        self.transfer(len(message))
+        responses = []
+        for command in self.split_message(message):
+            # Wait for pending operations without blocking the instrument
+            # (the trigger model runs in its own thread)
+            if normalise_header(command.split()[0])[0] in ["*WAI", "*OPC?"]:
+                self.wait_until_idle()
+            with self.lock:
+                response = self.execute(command)
+            if response is not None:
+                responses.append(response)
+        if len(responses) == 1:
+            self.pending_response = responses[0]
+        elif len(responses) > 1:
+            self.pending_response = ";".join(responses)
+        return len(message)
+
+    def read(self):
+        self.check_connection()
+        response = self.pending_response
+        self.pending_response = None
+        if response is None:
+            raise IOError("Query UNTERMINATED: nothing to read")
+        self.transfer(len(response))
+        return response + "\n"
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def query_binary_values(
+        self, message, datatype="f", is_big_endian=False, container=list
+    ):
+        self.write(message)
+        values = self.pending_response
+        self.pending_response = None
+
+        # Binary blocks are sent as #<digits><length><data>
+        data = struct.pack(
+            (">" if is_big_endian else "<") + str(len(values)) + datatype, *values
+        )
+        self.transfer(len(data) + 2 + len(str(len(data))))
+
+        return container(
+            struct.unpack(
+                (">" if is_big_endian else "<") + str(len(values)) + datatype, data
+            )
+        )
+
+    def open(self):
+        if not self.connected:
+            raise pyvisa.errors.VisaIOError(
+                pyvisa.constants.StatusCode.error_resource_not_found
+            )
+        self.session_open = True
+
+    def close(self):
+        self.session_open = False
+
+    def clear(self):
+        self.check_connection()
+
+    def disconnect(self, duration, power_cycle=False):
+        """
+        Drop the USB connection for duration s (scaled). The session has to
+        be opened again afterwards. If power_cycle is True, the instrument
+        also loses its settings.
+        """
+        self.connected = False
+        self.session_open = False
+        if power_cycle:
+            with self.lock:
+                self.reset()
+                self.errors = []
+        threading.Timer(duration * self.time_scale, self.reconnect).start()
+
+    def reconnect(self):
+        self.connected = True
+
+    def split_message(self, message):
+        """
+        Split a message into its commands (separated by semicolons, quoted
+        semicolons are kept)
+        """
+        return [
+            command.strip()
+            for command in re.findall(r'(?:[^;"]|"[^"]*")+', message.strip())
+            if command.strip() != ""
+        ]
+
+    def execute(self, command):
+        """
+        Execute a single command and return the response (None if there is
+        none)
+        """
+        match = re.match(r"^([^\s]+)\s*(.*)$", command)
+        header, suffixes = normalise_header(match.group(1))
+        arguments = split_arguments(match.group(2))
+
+        if header == "*WAI":
+            return None
+        if header == "*OPC?":
+            return "1"
+        if header == "*IDN?":
+            return self.identification
+        if header in ["SYST:ERR?", "SYST:ERR:NEXT?", "SYST:ERRO?", "SYST:ERRO:NEXT?"]:
+            if len(self.errors) == 0:
+                return '0,"No error"'
+            return self.errors.pop(0)
+
+        try:
+            return self.execute_command(header, suffixes, arguments)
+        except KeyError:
+            self.errors.append('-113,"Undefined header;' + command + '"')
+            return None
+
+    def wait_until_idle(self):
+        pass
+
+
+class SimulatedKeithleySource(SimulatedInstrument):
+    """
+    Simulated Keithley 2450 SourceMeter that understands the SCPI subset
+    used by KeithleySource (sourcing, measuring, reading buffers, source
+    configuration lists and the trigger model). If the language is set to
+    TSP it only accepts TSP commands (and the common commands) like the
+    real instrument. They are executed by a Lua interpreter in its own
+    thread with the functions of TSP_ENVIRONMENT.
+    """
+
+    identification = "KEITHLEY INSTRUMENTS,MODEL 2450,00000000,SIMULATED"
+
+    # Current measurement ranges of the source
+    current_ranges = [1e-8, 1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1]
+
+    def __init__(self, model, language="SCPI", **kwargs):
+        super(SimulatedKeithleySource, self).__init__(model, **kwargs)
+        self.language = language
+        self.digital_outputs = {}
+        self.trigger_thread = None
+        self.aborted = False
+
+        # TSP interpreter (started with the first TSP command), the commands
+        # it still has to execute, the lines of a script that is loaded and
+        # the output of print commands
+        self.lua = None
+        self.tsp_thread = None
+        self.tsp_commands = queue.Queue()
+        self.tsp_script_name = None
+        self.tsp_script_lines = []
+        self.tsp_output = queue.Queue()
+        self.tsp_default_buffer = TspBuffer(100000)
+
+        # Instruments that are connected to the digital I/O lines
+        self.trigger_listeners = {}
+
+        # Set by trigger pulses at the digital inputs (the simulation does
+        # not distinguish the lines)
+        self.digital_trigger = threading.Event()
+        self.reset()
+
+    def reset(self):
+        """
+        *RST state
+        """
+        self.source_function = "VOLT"
+        self.sense_function = "CURR"
+        self.levels = {"VOLT": 0, "CURR": 0}
+        self.limits = {"VOLT": 21, "CURR": 1.05e-4}
+        self.nplc = 1
+        self.autozero = True
+        self.current_range = 0
+        self.present_range = 1e-4
+        self.output = False
+        self.data_format = "ASC"
+        self.buffers = {"DEFBUFFER1": ReadingBuffer(), "DEFBUFFER2": ReadingBuffer()}
+        self.configuration_lists = {}
+        self.trigger_blocks = {}
+        self.model.apply(output=False)
+
+    def apply(self):
+        """
+        Apply the present source level to the model
+        """
+        if self.source_function == "VOLT":
+            self.model.apply(voltage=self.levels["VOLT"], output=self.output)
+        else:
+            self.model.apply(current=self.levels["CURR"], output=self.output)
+
+    def measure(self):
+        """
+        Do a measurement and return (source value, reading, timestamp)
+        """
+        self.wait(self.integration_time(self.nplc) * (2 if self.autozero else 1))
+
+        if self.source_function == "VOLT":
+            source_value = self.model.voltage
+            reading = max(
+                min(self.model.current, self.limits["CURR"]), -self.limits["CURR"]
+            )
+        else:
+            source_value = self.model.current
+            reading = max(
+                min(self.model.voltage, self.limits["VOLT"]), -self.limits["VOLT"]
+            )
+
+        # Measurement noise of the source (relative)
+        reading *= 1 + np.random.normal(0, 1e-5)
+
+        if self.sense_function == "CURR":
+            # Auto ranging takes time when the range has to be changed
+            if self.current_range == 0:
+                needed_range = next(
+                    (r for r in self.current_ranges if abs(reading) < 1.05 * r), 1
+                )
+                if needed_range != self.present_range:
+                    self.present_range = needed_range
+                    self.wait(0.01)
+            elif abs(reading) > 1.05 * self.current_range:
+                reading = 9.9e37
+
+        return source_value, reading, time.time()
+
+    def element(self, entry, element, entries):
+        """
+        Return a single element of a buffer entry (the relative timestamp
+        counts from the first reading in the buffer like on the 2450, seconds
+        and fractional seconds are the time of the reading)
+        """
+        element = element.upper()[:4]
+        if element == "SOUR":
+            return entry[0]
+        elif element == "REL":
+            return entry[2] - entries[0][2]
+        elif element in ["SEC", "SECO"]:
+            return float(int(entry[2]))
+        elif element == "FRAC":
+            return entry[2] % 1
+        return entry[1]
+
+    def buffer(self, name):
+        return self.buffers[name.upper()]
+
+    def format_values(self, values):
+        """
+        Either format values as ASCII or keep them for a binary transfer
+        """
+        if self.data_format == "ASC":
+            return ",".join(["{0:.9e}".format(value) for value in values])
+        return values
+
+    def execute_command(self, header, suffixes, arguments):
+        if header == "*RST":
+            self.reset()
+        elif header == "*LANG?":
+            return self.language
+        elif header == "SYST:LFRE?":
+            return str(self.line_frequency)
+        elif header == "SOUR:FUNC":
+            self.source_function = arguments[0].upper()[:4]
+        elif header == "SENS:FUNC":
+            self.sense_function = arguments[0].upper()[:4]
+        elif header in ["SOUR:VOLT:ILIM", "SOUR:VOLT:ILIM:LEV"]:
+            self.limits["CURR"] = float(arguments[0])
+        elif header in ["SOUR:CURR:VLIM", "SOUR:CURR:VLIM:LEV"]:
+            self.limits["VOLT"] = float(arguments[0])
+        elif header in ["SOUR:VOLT", "SOUR:VOLT:LEV"]:
+            self.levels["VOLT"] = float(arguments[0])
+            self.apply()
+        elif header in ["SOUR:CURR", "SOUR:CURR:LEV"]:
+            self.levels["CURR"] = float(arguments[0])
+            self.apply()
+        elif header in ["CURR:RANG", "SENS:CURR:RANG"]:
+            self.current_range = float(arguments[0])
+        elif header in ["CURR:RANG:AUTO", "SENS:CURR:RANG:AUTO"]:
+            if arguments[0].upper() in ["ON", "1"]:
+                self.current_range = 0
+            else:
+                self.current_range = self.present_range
+        elif header in ["CURR:NPLC", "VOLT:NPLC", "SENS:CURR:NPLC", "SENS:VOLT:NPLC"]:
+            self.nplc = float(arguments[0])
+        elif header in ["CURR:AZER", "VOLT:AZER", "SENS:CURR:AZER", "SENS:VOLT:AZER"]:
+            self.autozero = arguments[0].upper() in ["ON", "1"]
+        elif header in [
+            "SOUR:VOLT:READ:BACK",
+            "SOUR:CURR:READ:BACK",
+            "SOUR:VOLT:DELA:AUTO",
+            "SOUR:CURR:DELA:AUTO",
+            "DIGI:LINE:MODE",
+            "TRIG:DIGI:OUT:LOGI",
+            "TRIG:DIGI:OUT:PULS",
+            "TRIG:DIGI:IN:EDGE",
+            "FORM:BORD",
+        ]:
+            pass
+        elif header == "TRIG:DIGI:OUT:STIM":
+            self.digital_outputs[suffixes[0]] = arguments[0].upper()
+        elif header in ["OUTP", "OUTP:STAT"]:
+            self.output = arguments[0].upper() in ["ON", "1"]
+            self.apply()
+        elif header in ["MEAS:CURR:DC?", "MEAS:CURR?", "MEAS:VOLT:DC?", "MEAS:VOLT?"]:
+            # MEASure? changes the sense function and autoranges
+            self.sense_function = header[5:9]
+            self.wait(5e-3)
+            source_value, reading, timestamp = self.measure()
+            self.buffers["DEFBUFFER1"].append((source_value, reading, timestamp))
+            if self.sense_function == self.source_function:
+                return "{0:.9e}".format(source_value)
+            return "{0:.9e}".format(reading)
+        elif header in ["READ?", "MEAS?"]:
+            entry = self.measure()
+            name = arguments[0] if len(arguments) > 0 else "defbuffer1"
+            self.buffer(name).append(entry)
+            elements = arguments[1:] if len(arguments) > 1 else ["READ"]
+            return self.format_values(
+                [
+                    self.element(entry, element, self.buffer(name))
+                    for element in elements
+                ]
+            )
+        elif header == "TRAC:MAKE":
+            if arguments[0].upper() in self.buffers:
+                self.errors.append(
+                    '-222,"Parameter error TRACe:MAKE cannot use an existing '
+                    + 'reading buffer name"'
+                )
+            else:
+                self.buffers[arguments[0].upper()] = ReadingBuffer(
+                    int(float(arguments[1])) if len(arguments) > 1 else 10
+                )
+        elif header == "TRAC:POIN":
+            name = arguments[1] if len(arguments) > 1 else "defbuffer1"
+            self.buffer(name).capacity = int(float(arguments[0]))
+        elif header == "TRAC:FILL:MODE":
+            name = arguments[1] if len(arguments) > 1 else "defbuffer1"
+            self.buffer(name).fill_mode = arguments[0].upper()[:4]
+        elif header == "TRAC:CLEA":
+            name = arguments[0] if len(arguments) > 0 else "defbuffer1"
+            self.buffer(name).clear()
+        elif header == "TRAC:ACTU?":
+            name = arguments[0] if len(arguments) > 0 else "defbuffer1"
+            return str(len(self.buffer(name)))
+        elif header == "TRAC:DATA?":
+            start, end = int(arguments[0]), int(arguments[1])
+            entries = self.buffer(arguments[2])[start - 1 : end]
+            elements = arguments[3:] if len(arguments) > 3 else ["READ"]
+            return self.format_values(
+                [
+                    self.element(entry, element, self.buffer(arguments[2]))
+                    for entry in entries
+                    for element in elements
+                ]
+            )
+        elif header == "FORM:DATA":
+            self.data_format = arguments[0].upper()[:3]
+        elif header == "SOUR:CONF:LIST:CREA":
+            self.configuration_lists[arguments[0].upper()] = []
+        elif header == "SOUR:CONF:LIST:DELE":
+            if self.configuration_lists.pop(arguments[0].upper(), None) is None:
+                self.errors.append('-222,"Configuration list does not exist"')
+        elif header == "SOUR:CONF:LIST:STOR":
+            self.configuration_lists[arguments[0].upper()].append(
+                (self.source_function, self.levels[self.source_function])
+            )
+        elif header == "TRIG:LOAD":
+            self.trigger_blocks = {}
+        elif header.startswith("TRIG:BLOC:"):
+            self.trigger_blocks[int(arguments[0])] = (header[10:], arguments[1:])
+        elif header in ["INIT", "INIT:IMM"]:
+            self.aborted = False
+            self.digital_trigger.clear()
+            self.trigger_thread = threading.Thread(target=self.run_trigger_model)
+            self.trigger_thread.start()
+        elif header == "ABOR":
+            self.aborted = True
+        else:
+            raise KeyError(header)
+
+        return None
+
+    def write(self, message):
+        if self.language != "TSP" or message.strip().startswith("*"):
+            return super(SimulatedKeithleySource, self).write(message)
+
+        self.check_connection()
+        self.transfer(len(message))
+        if self.tsp_thread is None:
+            self.start_tsp()
+        self.tsp_commands.put(message.strip())
+        return len(message)
+
+    def read(self):
+        if self.language != "TSP" or self.pending_response is not None:
+            return super(SimulatedKeithleySource, self).read()
+
+        # Output of print commands
+        try:
+            response = self.tsp_output.get(timeout=self.timeout / 1000)
+        except queue.Empty:
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+        self.transfer(len(response))
+        return response + "\n"
+
+    def clear(self):
+        """
+        Device clear (aborts a running script and discards the commands and
+        output that are still pending)
+        """
+        self.check_connection()
+        self.aborted = True
+        if self.tsp_thread is not None:
+            while True:
+                try:
+                    self.tsp_commands.get_nowait()
+                except queue.Empty:
+                    break
+                self.tsp_commands.task_done()
+        self.wait_until_idle()
+        if self.tsp_thread is not None:
+            self.aborted = False
+            self.tsp_output = queue.Queue()
+
+    def start_tsp(self):
+        """
+        Start the Lua interpreter of the TSP mode
+        """
+        if LuaRuntime is None:
+            raise ImportError("The TSP mode of the simulated source needs lupa")
+
+        self.lua = LuaRuntime()
+        self.lua.compile(TSP_ENVIRONMENT)(self)
+        self.tsp_thread = threading.Thread(target=self.run_tsp, daemon=True)
+        self.tsp_thread.start()
+
+    def run_tsp(self):
+        """
+        Execute the TSP commands one after the other like the instrument
+        """
+        while True:
+            command = self.tsp_commands.get()
+            try:
+                if not self.aborted:
+                    self.execute_tsp(command)
+            finally:
+                self.tsp_commands.task_done()
+
+    def execute_tsp(self, command):
+        """
+        Execute a single TSP command. The lines between loadscript and
+        endscript are stored as a script that is run with <name>.run().
+        """
+        if self.tsp_script_name is not None:
+            if command == "endscript":
+                self.lua.execute(self.tsp_script_name + " = {}")
+                self.lua.globals()[self.tsp_script_name].run = self.compile_tsp(
+                    "\n".join(self.tsp_script_lines)
+                )
+                self.tsp_script_name = None
+            else:
+                self.tsp_script_lines.append(command)
+            return
+
+        match = re.match(r"^loadscript (\w+)$", command)
+        if match is not None:
+            self.tsp_script_name = match.group(1)
+            self.tsp_script_lines = []
+            return
+
+        chunk = self.compile_tsp(command)
+        if chunk is None:
+            return
+        try:
+            chunk()
+        except TspAbort:
+            pass
+        except Exception as error:
+            self.errors.append(
+                '-286,"TSP Runtime error: ' + str(error).replace('"', "'") + '"'
+            )
+
+    def compile_tsp(self, code):
+        """
+        Compile TSP code into a Lua function (None if it is no valid Lua)
+        """
+        try:
+            return self.lua.compile(code)
+        except LuaSyntaxError as error:
+            self.errors.append(
+                '-285,"TSP Syntax error: ' + str(error).replace('"', "'") + '"'
+            )
+            return None
+
+    def check_abort(self):
+        """
+        Stop the running TSP command after a device clear
+        """
+        if self.aborted:
+            raise TspAbort()
+
+    def tsp_get(self, path):
+        """
+        Value of an attribute of the smu table (None for the tables in it)
+        """
+        constants = {
+            "ON": 1,
+            "OFF": 0,
+            "FUNC_DC_VOLTAGE": "VOLT",
+            "FUNC_DC_CURRENT": "CURR",
+        }
+        if path in constants:
+            return constants[path]
+        if path in [
+            "source",
+            "source.ilimit",
+            "source.vlimit",
+            "measure",
+            "measure.autozero",
+        ]:
+            return None
+
+        with self.lock:
+            if path == "source.func":
+                return self.source_function
+            elif path == "source.level":
+                return self.levels[self.source_function]
+            elif path == "source.ilimit.level":
+                return self.limits["CURR"]
+            elif path == "source.vlimit.level":
+                return self.limits["VOLT"]
+            elif path == "source.ilimit.tripped":
+                return int(
+                    self.source_function == "VOLT"
+                    and abs(self.model.current) >= self.limits["CURR"]
+                )
+            elif path == "source.output":
+                return int(self.output)
+            elif path == "measure.func":
+                return self.sense_function
+            elif path == "measure.nplc":
+                return self.nplc
+            elif path == "measure.autozero.enable":
+                return int(self.autozero)
+            elif path == "measure.read":
+                return self.tsp_measure_read
+
+        raise KeyError("smu." + path)
+
+    def tsp_set(self, path, value):
+        """
+        Set an attribute of the smu table
+        """
+        with self.lock:
+            if path == "source.func":
+                self.source_function = value
+            elif path == "source.level":
+                self.levels[self.source_function] = float(value)
+                self.apply()
+            elif path == "source.ilimit.level":
+                self.limits["CURR"] = float(value)
+            elif path == "source.vlimit.level":
+                self.limits["VOLT"] = float(value)
+            elif path in ["source.readback", "source.autodelay"]:
+                pass
+            elif path == "source.output":
+                self.output = value == 1
+                self.apply()
+            elif path == "measure.func":
+                self.sense_function = value
+            elif path == "measure.nplc":
+                self.nplc = float(value)
+            elif path == "measure.autozero.enable":
+                self.autozero = value == 1
+            elif path == "measure.range":
+                self.current_range = float(value)
+            elif path == "measure.autorange":
+                if value == 1:
+                    self.current_range = 0
+                else:
+                    self.current_range = self.present_range
+            else:
+                raise KeyError("smu." + path)
+
+    def tsp_measure_read(self, buffer_variable=None):
+        """
+        smu.measure.read: measure into the buffer and return the reading
+        """
+        self.check_abort()
+        with self.lock:
+            entry = self.measure()
+        if buffer_variable is None:
+            buffer_variable = self.tsp_default_buffer
+        buffer_variable.append(entry)
+        if self.sense_function == self.source_function:
+            return entry[0]
+        return entry[1]
+
+    def tsp_make_buffer(self, capacity):
+        return TspBuffer(capacity)
+
+    def tsp_assert_digout(self, line):
+        """
+        Trigger pulse on a digital I/O line
+        """
+        for instrument in self.trigger_listeners.get(int(line), []):
+            instrument.external_trigger()
+
+    def tsp_delay(self, duration):
+        self.check_abort()
+        self.wait(float(duration))
+        self.check_abort()
+
+    def tsp_printbuffer(self, start, end, *columns):
+        """
+        Print the entries start to end of buffer columns (e.g.
+        buffer.readings), the values of each entry one after the other
+        """
+        self.tsp_print(
+            ",".join(
+                [
+                    "{0:.9e}".format(column[i - 1])
+                    for i in range(int(start), int(end) + 1)
+                    for column in columns
+                ]
+            )
+        )
+
+    def tsp_print(self, line):
+        self.tsp_output.put(line)
+
+    def tsp_error_count(self):
+        return len(self.errors)
+
+    def tsp_next_error(self):
+        """
+        Oldest error of the error queue as table {code, message}
+        """
+        if len(self.errors) == 0:
+            return self.lua.table_from([0, "No error"])
+        code, message = self.errors.pop(0).split(",", 1)
+        return self.lua.table_from([int(code), message.strip('"')])
+
+    def tsp_clear_errors(self):
+        self.errors = []
+
+    def wait_until_idle(self):
+        trigger_thread = self.trigger_thread
+        if trigger_thread is not None:
+            trigger_thread.join()
+            self.trigger_thread = None
+
+        # All TSP commands that were sent are executed
+        if self.tsp_thread is not None:
+            self.tsp_commands.join()
+
+    def recall(self, list_name, index):
+        """
+        Recall a source configuration from a configuration list
+        """
+        function, level = self.configuration_lists[list_name.upper()][index - 1]
+        self.source_function = function
+        self.levels[function] = level
+        self.apply()
+
+    def notify(self, notify_id):
+        """
+        Send trigger pulses on all digital outputs that listen to the
+        notification
+        """
+        for line, stimulus in self.digital_outputs.items():
+            if stimulus == "NOTIFY" + str(notify_id) or stimulus == "NOT" + str(
+                notify_id
+            ):
+                for instrument in self.trigger_listeners.get(line, []):
+                    instrument.external_trigger()
+
+    def run_trigger_model(self):
+        """
+        Execute the trigger model block by block
+        """
+        block = 1
+        counters = {}
+        list_indices = {}
+        while block in self.trigger_blocks and not self.aborted:
+            kind, arguments = self.trigger_blocks[block]
+            block += 1
+            with self.lock:
+                if kind == "BUFF:CLEA":
+                    self.buffer(arguments[0] if arguments else "defbuffer1").clear()
+                elif kind == "CONF:RECA":
+                    list_indices[arguments[0].upper()] = int(arguments[1])
+                    self.recall(arguments[0], int(arguments[1]))
+                elif kind == "CONF:NEXT":
+                    name = arguments[0].upper()
+                    list_indices[name] = (
+                        list_indices.get(name, 1) % len(self.configuration_lists[name])
+                        + 1
+                    )
+                    self.recall(name, list_indices[name])
+                elif kind == "SOUR:STAT":
+                    self.output = arguments[0].upper() in ["ON", "1"]
+                    self.apply()
+                elif kind == "NOTI":
+                    self.notify(int(arguments[0]))
+                elif kind in ["MEAS", "MDIG"]:
+                    count = int(arguments[1]) if len(arguments) > 1 else 1
+                    for i in range(count):
+                        self.buffer(arguments[0]).append(self.measure())
+                elif kind == "BRAN:COUN":
+                    counters[block - 1] = counters.get(block - 1, 0) + 1
+                    if counters[block - 1] < int(arguments[0]):
+                        block = int(arguments[1])
+                elif kind == "BRAN:ALWA":
+                    block = int(arguments[0])
+            if kind == "DELA:CONS":
+                self.wait(float(arguments[0]))
+            elif kind == "WAIT":
+                # Wait for a pulse at a digital input
+                while not self.aborted and not self.digital_trigger.wait(0.01):
+                    pass
+                self.digital_trigger.clear()
+
+    def external_trigger(self):
+        """
+        Pulse at a digital input line
+        """
+        self.digital_trigger.set()
+
+    def connect_trigger(self, line, instrument):
+        """
+        Connect a digital I/O line to the external trigger input of another
+        simulated instrument
+        """
+        self.trigger_listeners.setdefault(line, []).append(instrument)
+
+
+class SimulatedKeithleyMultimeter(SimulatedInstrument):
+    """
+    Simulated Keithley 2100 multimeter that measures the photodiode voltage
+    of the OLED model
+    """
+
+    identification = "KEITHLEY INSTRUMENTS INC.,MODEL 2100,0000000,SIMULATED"
+
+    # Voltage ranges of the multimeter
+    ranges = [0.1, 1, 10, 100, 1000]
+
+    def __init__(self, model, **kwargs):
+        super(SimulatedKeithleyMultimeter, self).__init__(model, **kwargs)
+        self.reset()
+
+    def reset(self):
+        """
+        *RST state
+        """
+        self.nplc = 10
+        self.autozero = True
+        self.range = 0
+        self.present_range = 10
+        self.trigger_source = "IMM"
+        self.trigger_count = 1
+        self.sample_count = 1
+        self.triggers_left = 0
+        self.memory = []
+        self.busy_until = time.time()
+
+    def take_readings(self):
+        """
+        Take the samples of one trigger. The values are taken at the moment
+        of the trigger, the multimeter is busy for the integration time.
+        """
+        at_time = time.time()
+        integration_time = self.integration_time(self.nplc) * (
+            2 if self.autozero else 1
+        )
+        duration = 0
+        for i in range(self.sample_count):
+            voltage = self.model.photodiode_voltage(at_time + duration)
+
+            # Auto ranging takes time when the range has to be changed
+            if self.range == 0:
+                needed_range = next(
+                    (r for r in self.ranges if abs(voltage) < 1.2 * r), 1000
+                )
+                if needed_range != self.present_range:
+                    self.present_range = needed_range
+                    duration += 0.01
+            elif abs(voltage) > 1.2 * self.range:
+                voltage = 9.9e37
+
+            self.memory.append(voltage)
+            duration += integration_time
+
+        self.busy_until = max(self.busy_until, time.time()) + duration * self.time_scale
+        self.triggers_left -= 1
+
+    def external_trigger(self):
+        """
+        Pulse at the external trigger input
+        """
+        with self.lock:
+            if self.trigger_source == "EXT" and self.triggers_left > 0:
+                self.take_readings()
+
+    def wait_until_idle(self):
+        time.sleep(max(self.busy_until - time.time(), 0))
+
+    def wait_for_triggers(self):
+        """
+        FETCh? only answers once the acquisition got all its triggers (or
+        the VISA timeout passes)
+        """
+        deadline = time.time() + self.timeout / 1000
+        while self.triggers_left > 0 and self.trigger_source != "IMM":
+            if time.time() > deadline:
+                raise pyvisa.errors.VisaIOError(
+                    pyvisa.constants.StatusCode.error_timeout
+                )
+            time.sleep(1e-3)
+
+    def write(self, message):
+        if normalise_header(message.split()[0])[0] == "FETC?":
+            self.wait_for_triggers()
+        return super(SimulatedKeithleyMultimeter, self).write(message)
+
+    def clear(self):
+        # A device clear aborts the acquisition
+        super(SimulatedKeithleyMultimeter, self).clear()
+        with self.lock:
+            self.triggers_left = 0
+
+    def initiate(self):
+        self.memory = []
+        self.triggers_left = self.trigger_count
+        if self.trigger_source == "IMM":
+            while self.triggers_left > 0:
+                self.take_readings()
+
+    def execute_command(self, header, suffixes, arguments):
+        if header == "*RST":
+            self.reset()
+        elif header in ["CONF:VOLT:DC", "CONF:VOLT"]:
+            self.reset()
+            self.nplc = 10
+            if len(arguments) > 0:
+                self.range = float(arguments[0])
+        elif header in ["SENS:VOLT:DC:RANG", "VOLT:DC:RANG", "CONF:VOLT:DC:RANG"]:
+            self.range = float(arguments[0])
+        elif header in ["SENS:VOLT:DC:RANG:AUTO", "VOLT:DC:RANG:AUTO"]:
+            if arguments[0].upper() in ["ON", "1"]:
+                self.range = 0
+            else:
+                self.range = self.present_range
+        elif header in ["VOLT:DC:RESO?", "SENS:VOLT:DC:RESO?"]:
+            return "{0:.6e}".format(3e-6 * max(self.range, self.present_range) / 10)
+        elif header in ["VOLT:NPLC", "VOLT:DC:NPLC", "SENS:VOLT:DC:NPLC"]:
+            self.nplc = float(arguments[0])
+        elif header in ["ZERO:AUTO", "SENS:ZERO:AUTO"]:
+            self.autozero = arguments[0].upper() in ["ON", "1"]
+        elif header == "TRIG:SOUR":
+            self.trigger_source = arguments[0].upper()[:3]
+        elif header == "TRIG:DELA":
+            pass
+        elif header == "TRIG:COUN":
+            self.trigger_count = int(float(arguments[0]))
+        elif header == "SAMP:COUN":
+            self.sample_count = int(float(arguments[0]))
+        elif header == "INIT":
+            self.initiate()
+        elif header == "*TRG":
+            if self.trigger_source == "BUS" and self.triggers_left > 0:
+                self.take_readings()
+            else:
+                self.errors.append('-211,"Trigger ignored"')
+        elif header == "FETC?":
+            self.wait_until_idle()
+            return ",".join(["{0:.9e}".format(value) for value in self.memory])
+        elif header == "READ?":
+            self.initiate()
+            self.wait_until_idle()
+            return ",".join(["{0:.9e}".format(value) for value in self.memory])
+        elif header in ["MEAS:VOLT:DC?", "MEAS:VOLT?"]:
+            # MEASure? configures the multimeter anew (incl. auto range)
+            self.wait(0.02)
+            self.execute_command("CONF:VOLT:DC", [], arguments)
+            return self.execute_command("READ?", [], [])
+        else:
+            raise KeyError(header)
+
+        return None
+
+
+class SimulatedResourceManager:
+    """
+    Stand-in for the pyvisa resource manager that hands out the simulated
+    instruments. It can be handed to the instrument registry with
+    instrument_registry.set_resource_manager.
+    """
+
+    def __init__(
+        self,
+        keithley_source_address="USB0::0x05E6::0x2450::04426583::INSTR",
+        keithley_multimeter_address="USB0::0x05E6::0x2100::8011801::INSTR",
+        model=None,
+        language="SCPI",
+        trigger_cable=True,
+        **kwargs
+    ):
+        if model is None:
+            model = OLEDModel(time_scale=kwargs.get("time_scale", 1))
+        self.model = model
+
+        self.keithley_source = SimulatedKeithleySource(
+            model, language=language, **kwargs
+        )
+        self.keithley_multimeter = SimulatedKeithleyMultimeter(model, **kwargs)
+
+        # Digital I/O line 1 of the source is connected to the external
+        # trigger input of the multimeter (unless the cable is missing)
+        if trigger_cable:
+            self.keithley_source.connect_trigger(1, self.keithley_multimeter)
+
+        self.resources = {
+            keithley_source_address: self.keithley_source,
+            keithley_multimeter_address: self.keithley_multimeter,
+        }
+
+        # Enumerating resources is slow on real hardware
+        self.enumeration_time = 0.5 * kwargs.get("time_scale", 1)
+
+    def list_resources(self):
+        time.sleep(self.enumeration_time)
+        return tuple(
+            [
+                address
+                for address, instrument in self.resources.items()
+                if instrument.connected
+            ]
+        )
+
+    def open_resource(self, address):
+        self.resources[address].open()
+        return self.resources[address]
+
+    def close(self):
+        pass
+
+
+def benchmark(time_scale=1):
+    """
+    Compare the time a JVL sweep of one pixel takes with the different
+    approaches in hardware.py against the simulated instruments
+    """
+    from hardware import KeithleySource, KeithleyMultimeter, instrument_registry
+
+    resource_manager = SimulatedResourceManager(time_scale=time_scale)
+    instrument_registry.set_resource_manager(resource_manager)
+
+    keithley_source = KeithleySource("USB0::0x05E6::0x2450::04426583::INSTR", 1050)
+    keithley_multimeter = KeithleyMultimeter("USB0::0x05E6::0x2100::8011801::INSTR")
+
+    voltages = np.append(np.arange(-2, 2, 0.5), np.arange(2, 4.1, 0.1))
+    multimeter_latency = 0.1
+
+    # Point by point with separate queries
+    starting_time = time.time()
+    keithley_source.activate_output()
+    for voltage in voltages:
+        keithley_source.set_voltage(voltage)
+        time.sleep(multimeter_latency * time_scale)
+        keithley_source.read_current()
+        keithley_multimeter.measure_voltage()
+    keithley_source.deactivate_output()
+    print(
+        "Stepwise sweep with separate queries: "
+        + str(round(time.time() - starting_time, 2))
+        + " s"
+    )
+
+    # Point by point with overlapped readings
+    starting_time = time.time()
+    keithley_source.activate_output()
+    for voltage in voltages:
+        keithley_source.set_voltage(voltage)
+        time.sleep(multimeter_latency * time_scale)
+        keithley_source.measure_with_photodiode(keithley_multimeter)
+    keithley_source.deactivate_output()
+    print(
+        "Stepwise sweep with overlapped readings: "
+        + str(round(time.time() - starting_time, 2))
+        + " s"
+    )
+
+    # Point by point with the integration time chosen from the last reading
+    starting_time = time.time()
+    keithley_source.set_integration_policy(1e-9, 1e-3)
+    keithley_multimeter.set_integration_policy(1e-5, 1e-3)
+    keithley_source.activate_output()
+    for voltage in voltages:
+        keithley_source.set_voltage(voltage)
+        time.sleep(multimeter_latency * time_scale)
+        keithley_source.measure_with_photodiode(keithley_multimeter)
+    keithley_source.deactivate_output()
+    keithley_source.set_integration_policy(0, 0)
+    keithley_multimeter.set_integration_policy(0, 0)
+    print(
+        "Stepwise sweep with adaptive integration time: "
+        + str(round(time.time() - starting_time, 2))
+        + " s"
+    )
+
+    # Sweep on the trigger model of the source
+    starting_time = time.time()
+    keithley_source.init_voltage_sweep(voltages, "OLEDbuffer", multimeter_latency)
+    keithley_multimeter.arm_external_acquisition(len(voltages))
+    keithley_source.run_sweep()
+    voltages_read, currents = keithley_source.fetch_sweep("OLEDbuffer")
+    diode_voltages = keithley_multimeter.fetch_acquisition()
+    keithley_multimeter.reset()
+    print("Buffered sweep: " + str(round(time.time() - starting_time, 2)) + " s")
+
+    # Pulsed sweep on the trigger model of the source
+    starting_time = time.time()
+    keithley_source.init_pulsed_voltage_sweep(voltages, "OLEDbuffer", 0.05, 0.2)
+    keithley_multimeter.arm_external_acquisition(len(voltages))
+    keithley_source.run_sweep()
+    voltages_read, currents = keithley_source.fetch_sweep("OLEDbuffer")
+    diode_voltages = keithley_multimeter.fetch_acquisition()
+    keithley_multimeter.reset()
+    print("Pulsed sweep: " + str(round(time.time() - starting_time, 2)) + " s")
+
+    # Sweep with the TSP script (the source has to be set to TSP first, the
+    # driver reads the language on reset)
+    resource_manager.keithley_source.language = "TSP"
+    keithley_source.as_voltage_source(1050, force=True)
+    starting_time = time.time()
+    keithley_multimeter.arm_external_acquisition(len(voltages))
+    keithley_source.run_script_sweep(voltages, 1050, multimeter_latency)
+    diode_voltages = keithley_multimeter.fetch_acquisition()
+    keithley_multimeter.reset()
+    print("TSP script sweep: " + str(round(time.time() - starting_time, 2)) + " s")
+    keithley_source.check_errors()
+    resource_manager.keithley_source.language = "SCPI"
+    keithley_source.as_voltage_source(1050, force=True)
+
+
+# Run from the src folder with "python -m tests.simulated_instruments"
+if __name__ == "__main__":
+    benchmark()
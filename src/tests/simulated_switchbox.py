@@ -0,0 +1,365 @@
+import os
+import tty
+import time
+import select
+import threading
+import functools
+
+
+class SimulatedSwitchbox:
+    """
+    Emulator of the switchbox firmware (Arduino/switchbox_driver) on a
+    pseudo terminal. ArduinoUno can open the port name of the emulator
+    (e.g. /dev/pts/3) like the real Arduino. The emulator answers with the
+    same text and frames as the firmware and takes as long as the serial
+    transfer at the baud rate would take.
+    """
+
+    # Bytes of the framed protocol
+    FRAME_START = 0xAA
+    SET_RELAYS = ord("M")
+    GET_RELAYS = ord("Q")
+    CLEAR_SCHEDULE = ord("C")
+    SET_STEP = ord("A")
+    RUN_SCHEDULE = ord("R")
+    STOP_SCHEDULE = ord("X")
+    SET_TRIGGER = ord("T")
+    PULSE_TRIGGER = ord("P")
+    ACK = 0x06
+    NAK = 0x15
+    SCHEDULE_DONE = 0x04
+
+    MAX_STEPS = 32
+
+    # Time the firmware waits for the rest of a frame (Serial.setTimeout)
+    FRAME_TIMEOUT = 0.05
+
+    def __init__(self, baudrate=9600, time_scale=1):
+        # One start bit, eight data bits and one stop bit per byte
+        self.byte_time = 10 / baudrate
+        self.time_scale = time_scale
+
+        # The emulator talks on the master side, the driver opens the slave
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.lock = threading.RLock()
+        self.is_killed = False
+        self.input = bytearray()
+
+        # Instruments whose external trigger input is connected to the
+        # trigger output (pin 7)
+        self.trigger_listeners = []
+
+        self.restart()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def restart(self):
+        """
+        State after the Arduino was (re)started
+        """
+        with self.lock:
+            self.relays = 0
+            self.steps = []
+            self.schedule_running = False
+            self.current_step = 0
+            self.step_start = 0
+            self.trigger_settle = 0
+            self.trigger_width = 0
+
+            # Every change of the relays and every trigger pulse with the
+            # time it happened
+            self.relay_log = []
+            self.trigger_pulses = []
+
+        self.send(b"This is Uno. Ready to switch ...\r\n\r\n")
+
+    def wait(self, duration):
+        """
+        Sleep for a duration (in s) of the emulated time
+        """
+        time.sleep(duration * self.time_scale)
+
+    def send(self, data):
+        """
+        Write bytes to the host (it takes the transfer time until they are
+        all there)
+        """
+        self.wait(len(data) * self.byte_time)
+        os.write(self.master, data)
+
+    def send_line(self, text):
+        """
+        Serial.println of the firmware
+        """
+        self.send(text.encode("ascii") + b"\r\n")
+
+    def send_frame(self, status):
+        """
+        Reply with the state the relays are in now
+        """
+        self.send(bytes([self.FRAME_START, status, self.relays, status ^ self.relays]))
+
+    def read_byte(self, timeout):
+        """
+        Return the next byte from the host or None if none arrived in time
+        """
+        deadline = time.monotonic() + timeout
+        while not self.input:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.is_killed:
+                return None
+            readable, _, _ = select.select([self.master], [], [], remaining)
+            if readable:
+                try:
+                    self.input += os.read(self.master, 1024)
+                except OSError:
+                    return None
+
+        # Each byte takes its transfer time to arrive
+        self.wait(self.byte_time)
+        byte = self.input[0]
+        del self.input[0]
+
+        return byte
+
+    def run(self):
+        """
+        Loop of the firmware
+        """
+        while not self.is_killed:
+            with self.lock:
+                self.advance_schedule()
+
+            # Only poll while a schedule has to be kept going
+            byte = self.read_byte(0.001 if self.schedule_running else 0.05)
+            if byte is None:
+                continue
+
+            with self.lock:
+                if byte == self.FRAME_START:
+                    self.handle_frame()
+                else:
+                    self.handle_character(chr(byte))
+
+    def write_relays(self, mask):
+        """
+        Switch every relay to the state of its bit
+        """
+        self.relays = mask
+        self.relay_log.append((time.monotonic(), mask))
+
+    def switch_relays(self, mask):
+        """
+        Switch the relays and send a trigger pulse once they settled
+        """
+        self.write_relays(mask)
+        if self.trigger_width > 0:
+            self.wait(self.trigger_settle * 1e-6)
+            self.pulse_trigger()
+
+    def pulse_trigger(self):
+        """
+        Active-low pulse on the trigger output
+        """
+        self.trigger_pulses.append(time.monotonic())
+        for instrument in self.trigger_listeners:
+            instrument.external_trigger()
+        self.wait(self.trigger_width * 1e-6)
+
+    def advance_schedule(self):
+        """
+        Go to the next step of a running schedule once its dwell time passed
+        """
+        if not self.schedule_running:
+            return
+
+        dwell = self.steps[self.current_step][1] * 1e-3 * self.time_scale
+        if time.monotonic() - self.step_start < dwell:
+            return
+
+        # Count from the planned end of the step so that delays do not add up
+        self.step_start += dwell
+        self.current_step += 1
+
+        if self.current_step < len(self.steps):
+            self.switch_relays(self.steps[self.current_step][0])
+        else:
+            self.schedule_running = False
+            self.send_frame(self.SCHEDULE_DONE)
+
+    def handle_frame(self):
+        """
+        Read the rest of a frame and execute it
+        """
+        status = self.NAK
+
+        command = self.read_byte(self.FRAME_TIMEOUT)
+        if command is not None:
+            # Setting a schedule step or the trigger has four payload bytes,
+            # all other commands one
+            if command in [self.SET_STEP, self.SET_TRIGGER]:
+                length = 5
+            else:
+                length = 2
+
+            rest = []
+            for i in range(length):
+                byte = self.read_byte(self.FRAME_TIMEOUT)
+                if byte is None:
+                    break
+                rest.append(byte)
+
+            payload = rest[:-1]
+            if (
+                len(rest) == length
+                and functools.reduce(lambda a, b: a ^ b, payload, command) == rest[-1]
+            ):
+                status = self.execute(command, payload)
+
+        self.send_frame(status)
+
+    def execute(self, command, payload):
+        """
+        Execute a frame command and return ACK or NAK
+        """
+        if command == self.SET_RELAYS and not self.schedule_running:
+            self.switch_relays(payload[0])
+        elif command == self.GET_RELAYS:
+            pass
+        elif command == self.CLEAR_SCHEDULE and not self.schedule_running:
+            self.steps = []
+        elif (
+            command == self.SET_STEP
+            and not self.schedule_running
+            and payload[0] < self.MAX_STEPS
+            and payload[0] <= len(self.steps)
+        ):
+            step = (payload[1], payload[2] | payload[3] << 8)
+            if payload[0] == len(self.steps):
+                self.steps.append(step)
+            else:
+                self.steps[payload[0]] = step
+        elif command == self.RUN_SCHEDULE and len(self.steps) > 0:
+            self.current_step = 0
+            self.step_start = time.monotonic()
+            self.switch_relays(self.steps[0][0])
+            self.schedule_running = True
+        elif command == self.SET_TRIGGER:
+            self.trigger_settle = payload[0] | payload[1] << 8
+            self.trigger_width = payload[2] | payload[3] << 8
+        elif command == self.PULSE_TRIGGER and self.trigger_width > 0:
+            self.pulse_trigger()
+        elif command == self.STOP_SCHEDULE:
+            self.schedule_running = False
+            self.write_relays(0)
+        else:
+            return self.NAK
+
+        return self.ACK
+
+    def handle_character(self, character):
+        """
+        The single ASCII digit commands (with the echo of the firmware)
+        """
+        self.send_line("received: '" + character + "'")
+
+        if character in "12345678":
+            relay = int(character)
+            bit = 1 << (relay - 1)
+            self.write_relays(self.relays ^ bit)
+            if self.relays & bit:
+                self.send_line("Switched on Relay " + character)
+            else:
+                self.send_line("Switched off Relay " + character)
+        elif character == "9":
+            self.write_relays(0xFF)
+            self.send_line("Switched on all Relays")
+        elif character == "0":
+            self.write_relays(0)
+            self.send_line("Switched off all Relays")
+
+    def connect_trigger(self, instrument):
+        """
+        Connect the trigger output to the external trigger input of a
+        simulated instrument
+        """
+        self.trigger_listeners.append(instrument)
+
+    def close(self):
+        """
+        Stop the emulator and close the pseudo terminal
+        """
+        self.is_killed = True
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def benchmark(time_scale=1):
+    """
+    Compare the time it takes to switch through all pixels with the different
+    relay commands of ArduinoUno against the emulated switchbox and check
+    that the driver keeps track of the relays correctly
+    """
+    from hardware import ArduinoUno
+
+    switchbox = SimulatedSwitchbox(time_scale=time_scale)
+    uno = ArduinoUno(switchbox.port)
+
+    def check(name, starting_time):
+        print(name + ": " + str(round(time.time() - starting_time, 3)) + " s")
+        if uno.relay_mask != switchbox.relays:
+            print(
+                "Relay state of the driver ("
+                + format(uno.relay_mask, "08b")
+                + ") differs from the switchbox ("
+                + format(switchbox.relays, "08b")
+                + ")"
+            )
+
+    # Toggle each pixel on and off again
+    starting_time = time.time()
+    for relay in range(1, 9):
+        uno.trigger_relay(relay)
+        uno.trigger_relay(relay)
+    check("Toggling relays", starting_time)
+
+    # Set each pixel with an absolute relay mask
+    starting_time = time.time()
+    for relay in range(1, 9):
+        uno.set_relays(uno.pixels_to_mask([relay]))
+    uno.set_relays(0)
+    check("Setting relay masks", starting_time)
+
+    # Let the switchbox step through the pixels (10 ms each)
+    starting_time = time.time()
+    uno.run_schedule([(1 << pixel, 10) for pixel in range(8)] + [(0, 0)])
+    check("Relay schedule", starting_time)
+
+    # Switch with a trigger pulse 5 ms after each switching
+    uno.configure_trigger(5e-3)
+    starting_time = time.time()
+    for relay in range(1, 9):
+        uno.set_relays(uno.pixels_to_mask([relay]))
+    uno.set_relays(0)
+    check("Setting relay masks with trigger", starting_time)
+    if len(switchbox.trigger_pulses) != 9:
+        print(str(len(switchbox.trigger_pulses)) + " trigger pulses instead of 9")
+    uno.configure_trigger(0, 0)
+
+    # A ping is all it takes to start a measurement
+    starting_time = time.time()
+    uno.ensure_connection()
+    check("Connection check", starting_time)
+
+    uno.close()
+    switchbox.close()
+
+
+# Run from the src folder with "python -m tests.simulated_switchbox"
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,228 @@
+import numpy as np
+import pytest
+
+
+def test_adaptive_sweep(autotube_measurement, monkeypatch):
+    measurement = autotube_measurement(sweep_mode="adaptive", adaptive_point_budget=60)
+    minimum_step = measurement.measurement_parameters["adaptive_minimum_step"]
+
+    # Record the order the voltages are measured in
+    measured_voltages = []
+    measure_point = measurement.measure_point
+
+    def recording_measure_point(voltage):
+        measured_voltages.append(voltage)
+        return measure_point(voltage)
+
+    monkeypatch.setattr(measurement, "measure_point", recording_measure_point)
+
+    measurement.keithley_source.activate_output()
+    measurement.measure_adaptive_sweep(0)
+    measurement.keithley_source.deactivate_output()
+
+    # Midpoints were measured after the sweep
+    assert len(measured_voltages) <= 60
+    assert np.any(np.diff(measured_voltages) < 0)
+
+    # and sorted into the data
+    voltages = measurement.df_data["voltage"].dropna().to_numpy(dtype=float)
+    assert 0 < len(voltages) <= len(measured_voltages)
+    assert np.all(np.diff(voltages) >= minimum_step * 0.99)
+
+
+def test_shorter_sweep_of_the_next_pixel(autotube_measurement):
+    measurement = autotube_measurement(sweep_mode="adaptive", adaptive_point_budget=30)
+
+    measurement.keithley_source.activate_output()
+    measurement.measure_adaptive_sweep(0)
+    first_points = len(measurement.df_data)
+
+    # The next pixel gets fewer points
+    measurement.measurement_parameters["adaptive_point_budget"] = 5
+    measurement.keithley_source.activate_output()
+    measurement.measure_adaptive_sweep(0)
+    measurement.keithley_source.deactivate_output()
+
+    # No rows of the first pixel are left (the sweep may stop earlier at
+    # the compliance)
+    assert 5 < first_points
+    assert 0 < len(measurement.df_data) <= 5
+    assert not measurement.df_data.isna().any().any()
+    assert np.all(np.diff(measurement.df_data["voltage"].to_numpy(dtype=float)) > 0)
+
+
+def test_multimeter_is_configured_once_per_point(autotube_measurement, sent_commands):
+    measurement = autotube_measurement(photodiode_samples=3, photodiode_nplc=1)
+    multimeter = measurement.resource_manager.keithley_multimeter
+
+    measurement.keithley_source.activate_output()
+    measurement.measure_point(1)
+
+    # The next point settles with the configuration of its photodiode
+    # readings, so the multimeter is only triggered, read and armed again
+    messages = sent_commands(multimeter)
+    measurement.measure_point(1.5)
+    measurement.keithley_source.deactivate_output()
+
+    assert all(message in ["*TRG", "FETCh?", "INITiate"] for message in messages)
+    assert messages.count("INITiate") == messages.count("FETCh?")
+    assert messages.count("FETCh?") >= 3
+
+
+def test_turn_on_is_detected_from_the_light(autotube_measurement):
+    measurement = autotube_measurement()
+
+    voltages = np.arange(0, 4, 0.1)
+    currents = 1e-6 * np.exp(3 * voltages)
+    diode_voltages = np.where(voltages >= 2.5, (voltages - 2.5) * 2, 0)
+
+    # Noise below the detection threshold does not count as light
+    diode_voltages = diode_voltages + 1e-5 * np.sin(17 * voltages)
+
+    turn_on_voltage = measurement.detect_turn_on(
+        voltages, currents, diode_voltages, 0.05
+    )
+    assert 2.4 <= turn_on_voltage <= 2.6
+
+
+def test_turn_on_is_detected_from_the_current(autotube_measurement):
+    measurement = autotube_measurement()
+
+    # No light, but the current of a diode that turns on at 2 V
+    voltages = np.arange(0, 4, 0.1)
+    currents = 1e-9 + 1e-3 * np.maximum(voltages - 2, 0) ** 2
+    diode_voltages = np.zeros(len(voltages))
+
+    turn_on_voltage = measurement.detect_turn_on(
+        voltages, currents, diode_voltages, 0.05
+    )
+    assert 1.9 <= turn_on_voltage <= 2.2
+
+
+def test_refinement_halves_the_bend(autotube_measurement):
+    measurement = autotube_measurement()
+
+    # A kink at 2 V and coarse points around it
+    voltages = [0, 1, 2, 3, 4]
+    currents = [1e-9, 1e-9, 1e-9, 1e-6, 1e-5]
+    diode_voltages = [0, 0, 0, 0.1, 1]
+
+    voltage = measurement.next_refinement(voltages, currents, diode_voltages, 0.05)
+    assert voltage in [1.5, 2.5, 3.5]
+
+    # A straight line is not refined and neither are intervals at the
+    # minimum step
+    assert measurement.next_refinement(voltages, [1e-6] * 5, [0] * 5, 0.05) is None
+    assert measurement.next_refinement(voltages, currents, diode_voltages, 0.6) is None
+
+
+def test_stepwise_sweep_stops_at_compliance(autotube_measurement):
+    # The compliance is given in mA
+    measurement = autotube_measurement(scan_compliance=1)
+    source = measurement.resource_manager.keithley_source
+    voltages = np.arange(-2, 5.01, 0.25)
+
+    measurement.keithley_source.activate_output()
+    measurement.measure_stepwise_sweep(voltages, 0)
+
+    # The sweep ended at the first voltage with more than 1 mA
+    currents = measurement.df_data["current"].dropna().to_numpy(dtype=float)
+    assert 0 < len(currents) < len(voltages)
+    assert np.all(np.abs(currents) < 1)
+    assert source.model.current_at(voltages[len(currents)]) >= 1e-3
+    assert not source.output
+
+
+def test_buffered_sweep(autotube_measurement):
+    measurement = autotube_measurement(sweep_mode="buffered")
+    voltages = np.arange(-2, 4.01, 0.25)
+
+    measurement.keithley_source.init_voltage_sweep(
+        voltages, "OLEDbuffer", measurement.multimeter_latency
+    )
+    # Deleting the configuration list that does not exist yet logs an error
+    measurement.keithley_source.check_errors()
+    measurement.measure_buffered_sweep(voltages, 0)
+
+    # One current and photodiode reading for each voltage
+    np.testing.assert_allclose(measurement.df_data["voltage"], voltages)
+    assert np.all(np.diff(measurement.df_data["current"]) > 0)
+    assert measurement.df_data["pd_voltage"].iloc[-1] > 0.01
+    assert not measurement.resource_manager.keithley_source.output
+    assert measurement.keithley_source.check_errors() == []
+    assert measurement.keithley_multimeter.check_errors() == []
+
+
+def test_pulsed_sweep(autotube_measurement):
+    measurement = autotube_measurement(sweep_mode="pulsed")
+    voltages = np.arange(-2, 4.01, 0.5)
+
+    measurement.pulse_settling_time = (
+        measurement.keithley_source.init_pulsed_voltage_sweep(
+            voltages, "OLEDbuffer", 0.05, 0.2, 1
+        )
+    )
+    measurement.keithley_source.check_errors()
+    measurement.measure_pulsed_sweep(voltages, 0)
+
+    np.testing.assert_allclose(measurement.df_data["voltage"], voltages)
+    assert np.all(np.diff(measurement.df_data["current"]) > 0)
+    assert np.all(measurement.df_data["settling_time"] < 0.05)
+    assert not measurement.resource_manager.keithley_source.output
+    assert measurement.keithley_source.check_errors() == []
+
+
+def test_measurement_has_to_fit_into_the_pulse(simulated_instruments, sent_commands):
+    resource_manager, keithley_source, _ = simulated_instruments()
+    messages = sent_commands(resource_manager.keithley_source)
+
+    # A measurement of 1 NPLC takes at least 16.7 ms
+    with pytest.raises(ValueError):
+        keithley_source.init_pulsed_voltage_sweep([0, 1, 2], "OLEDbuffer", 0.01, 0.2, 1)
+
+    # Nothing was set up
+    assert messages == ["System:LFRequency?"]
+    assert "Trigger:Load" not in keithley_source.state
+
+
+def test_buffered_sweep_without_trigger_cable(simulated_instruments):
+    resource_manager, keithley_source, keithley_multimeter = simulated_instruments(
+        trigger_cable=False
+    )
+    resource_manager.keithley_multimeter.timeout = 200
+    voltages = np.arange(0, 2.01, 0.5)
+
+    keithley_multimeter.arm_external_acquisition(len(voltages))
+    keithley_source.init_voltage_sweep(voltages, "OLEDbuffer", 0.01)
+    keithley_source.empty_buffer("OLEDbuffer")
+    keithley_source.run_sweep()
+    keithley_source.fetch_sweep("OLEDbuffer", len(voltages))
+
+    # The multimeter never got a trigger
+    with pytest.raises(IOError, match="Ext Trig"):
+        keithley_multimeter.fetch_acquisition()
+
+    # and takes commands again
+    assert keithley_multimeter.check_errors() == []
+
+
+def test_acquisition_fits_the_reading_memory(simulated_instruments):
+    _, _, keithley_multimeter = simulated_instruments()
+
+    with pytest.raises(ValueError):
+        keithley_multimeter.arm_external_acquisition(0)
+    with pytest.raises(ValueError):
+        keithley_multimeter.arm_external_acquisition(
+            keithley_multimeter.MAX_READINGS + 1
+        )
+
+
+def test_sweep_with_missing_readings(simulated_instruments):
+    _, keithley_source, _ = simulated_instruments()
+
+    keithley_source.init_voltage_sweep(np.arange(0, 2.01, 0.5), "OLEDbuffer", 0.01)
+    keithley_source.empty_buffer("OLEDbuffer")
+
+    # Nothing was measured yet
+    with pytest.raises(IOError):
+        keithley_source.fetch_sweep("OLEDbuffer")
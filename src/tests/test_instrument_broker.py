@@ -0,0 +1,163 @@
+import threading
+
+import pyvisa
+import pytest
+
+from hardware import MEASUREMENT_PRIORITY, POLLING_PRIORITY, UI_PRIORITY
+
+
+def failing_command(error_code, failures=1):
+    """
+    Command that raises the VISA error the first failures times it is
+    executed and returns the number of calls afterwards
+    """
+    calls = []
+
+    def command():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise pyvisa.errors.VisaIOError(error_code)
+        return len(calls)
+
+    return command, calls
+
+
+@pytest.mark.parametrize(
+    "error_code",
+    [
+        pyvisa.constants.StatusCode.error_connection_lost,
+        pyvisa.constants.StatusCode.error_resource_not_found,
+    ],
+)
+def test_lost_connection_is_recovered(simulated_instruments, error_code):
+    _, keithley_source, _ = simulated_instruments()
+
+    recoveries = []
+    keithley_source.broker.recovery = lambda: recoveries.append(None)
+    command, calls = failing_command(error_code)
+
+    # The command is executed once more after the recovery
+    assert keithley_source.broker.call(command) == 2
+    assert len(recoveries) == 1
+
+
+def test_other_errors_are_raised(simulated_instruments):
+    _, keithley_source, _ = simulated_instruments()
+
+    recoveries = []
+    keithley_source.broker.recovery = lambda: recoveries.append(None)
+    command, calls = failing_command(pyvisa.constants.StatusCode.error_timeout)
+
+    # A timeout (e.g. of *OPC?) is not repeated
+    with pytest.raises(pyvisa.errors.VisaIOError):
+        keithley_source.broker.call(command)
+    assert len(calls) == 1
+    assert len(recoveries) == 0
+
+
+def test_timed_out_read_is_repeated(simulated_instruments):
+    _, keithley_source, _ = simulated_instruments()
+
+    recoveries = []
+    keithley_source.broker.recovery = lambda: recoveries.append(None)
+    command, calls = failing_command(pyvisa.constants.StatusCode.error_timeout)
+    command.idempotent = True
+
+    # A command that only reads is executed once more after the recovery
+    assert keithley_source.broker.call(command) == 2
+    assert len(recoveries) == 1
+
+
+def test_read_iv_after_timeout(simulated_instruments, monkeypatch):
+    resource_manager, keithley_source, _ = simulated_instruments()
+    source = resource_manager.keithley_source
+
+    keithley_source.as_voltage_source(50)
+    keithley_source.set_voltage(3)
+    keithley_source.activate_output()
+
+    # The first reading times out (VI_ERROR_TMO)
+    queries = []
+    query = source.query
+
+    def timing_out_query(message):
+        queries.append(message)
+        if message.startswith("Read?") and len(queries) == 1:
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+        return query(message)
+
+    monkeypatch.setattr(source, "query", timing_out_query)
+    reading = keithley_source.read_iv()
+
+    # The session was probed, the source recovered and the reading repeated
+    assert "*IDN?" in queries
+    assert [message for message in queries if message.startswith("Read?")] == [
+        queries[0]
+    ] * 2
+    assert reading.voltage == pytest.approx(3)
+    assert reading.current > 0
+    assert source.output
+    keithley_source.deactivate_output()
+
+
+def test_power_cycled_source_is_restored(simulated_instruments):
+    resource_manager, keithley_source, _ = simulated_instruments()
+    source = resource_manager.keithley_source
+
+    keithley_source.as_voltage_source(50)
+    keithley_source.set_voltage(3)
+    keithley_source.activate_output()
+
+    source.disconnect(0.5, power_cycle=True)
+    assert not source.output
+
+    # The reading waits for the recovery of the source
+    current = keithley_source.read_current()
+
+    assert current > 0
+    assert source.output
+    assert source.limits["CURR"] == pytest.approx(50e-3)
+    keithley_source.deactivate_output()
+
+
+def test_commands_are_served_by_priority(simulated_instruments):
+    _, keithley_source, _ = simulated_instruments()
+    broker = keithley_source.broker
+
+    # Block the broker until all commands are queued
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    blocking = broker.submit(block)
+    assert started.wait(5)
+
+    executed = []
+    futures = [
+        broker.submit(executed.append, name, priority=priority)
+        for name, priority in [
+            ("ui 1", UI_PRIORITY),
+            ("polling 1", POLLING_PRIORITY),
+            ("measurement 1", MEASUREMENT_PRIORITY),
+            ("ui 2", UI_PRIORITY),
+            ("measurement 2", MEASUREMENT_PRIORITY),
+            ("polling 2", POLLING_PRIORITY),
+        ]
+    ]
+    release.set()
+
+    for future in [blocking] + futures:
+        future.result(5)
+
+    # Measurement before polling before UI, in the order they came in
+    assert executed == [
+        "measurement 1",
+        "measurement 2",
+        "polling 1",
+        "polling 2",
+        "ui 1",
+        "ui 2",
+    ]
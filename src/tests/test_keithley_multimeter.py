@@ -0,0 +1,64 @@
+import pytest
+
+from hardware import RangePlanner
+
+
+def test_wait_for_settling(simulated_instruments, sent_commands):
+    resource_manager, keithley_source, keithley_multimeter = simulated_instruments()
+
+    keithley_source.set_voltage(3)
+    keithley_source.activate_output()
+
+    voltage, settling_time = keithley_multimeter.wait_for_settling(0.005, 0.5)
+    assert voltage > 0
+    assert 0 < settling_time < 0.6
+
+    # The second wait only triggers and fetches readings
+    messages = sent_commands(resource_manager.keithley_multimeter)
+    keithley_multimeter.wait_for_settling(0.005, 0.5)
+    assert len(messages) > 0
+    assert all(message in ["*TRG", "FETCh?", "INITiate"] for message in messages)
+
+
+def test_wait_for_settling_needs_valid_nplc(simulated_instruments):
+    _, _, keithley_multimeter = simulated_instruments()
+
+    with pytest.raises(ValueError):
+        keithley_multimeter.wait_for_settling(0.005, 0.1, nplc=0.1)
+
+
+def test_averaged_voltage_keeps_out_of_the_curve(simulated_instruments):
+    resource_manager, _, keithley_multimeter = simulated_instruments()
+    multimeter = resource_manager.keithley_multimeter
+
+    range_planner = RangePlanner()
+    keithley_multimeter.set_integration_policy(1e-5, 1e-3, 1)
+    keithley_multimeter.set_range_planner(range_planner)
+
+    # A single reading integrates for nplc as well
+    voltage = keithley_multimeter.measure_averaged_voltage(1, 10)
+    assert voltage == pytest.approx(5e-4, abs=2e-4)
+    assert multimeter.nplc == 10
+    assert multimeter.sample_count == 1
+
+    keithley_multimeter.measure_averaged_voltage(4, 0.2)
+    assert multimeter.nplc == 0.2
+    assert multimeter.sample_count == 4
+
+    # Neither the integration policy nor the range planner saw the readings
+    assert keithley_multimeter.integration_policy.last_reading is None
+    assert range_planner.curve == []
+
+
+def test_voltage_readings_only_trigger_and_fetch(simulated_instruments, sent_commands):
+    resource_manager, _, keithley_multimeter = simulated_instruments()
+
+    keithley_multimeter.measure_voltage()
+
+    # The multimeter is configured once, each further reading is a trigger
+    # and a FETCh? (and arming it again)
+    messages = sent_commands(resource_manager.keithley_multimeter)
+    voltages = [keithley_multimeter.measure_voltage() for i in range(3)]
+
+    assert messages == ["*TRG", "FETCh?", "INITiate"] * 3
+    assert all(voltage == pytest.approx(5e-4, abs=2e-4) for voltage in voltages)
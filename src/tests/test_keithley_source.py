@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+
+from hardware import IntegrationTimePolicy, KeithleySource, RangePlanner
+
+
+@pytest.mark.parametrize("language", ["SCPI", "TSP"])
+def test_timestamps_of_a_continuous_buffer(simulated_instruments, language):
+    if language == "TSP":
+        pytest.importorskip("lupa")
+    _, keithley_source, _ = simulated_instruments(language)
+
+    keithley_source.init_buffer("LifetimeBuffer", 10, continuous=True)
+    keithley_source.set_voltage(3)
+    keithley_source.activate_output()
+
+    # More readings than the buffer holds
+    timestamps = [
+        keithley_source.read_iv("LifetimeBuffer").timestamp for i in range(25)
+    ]
+    keithley_source.deactivate_output()
+
+    # The timestamps keep counting after the oldest readings were overwritten
+    assert np.all(np.diff(timestamps) > 0)
+    assert timestamps[-1] - timestamps[0] < 10
+    assert keithley_source.buffer_length("LifetimeBuffer") == 10
+    assert keithley_source.check_errors() == []
+
+
+def test_unchanged_settings_are_not_written(simulated_instruments, sent_commands):
+    resource_manager, keithley_source, _ = simulated_instruments()
+
+    keithley_source.as_voltage_source(50)
+
+    # The second time nothing has to be written
+    messages = sent_commands(resource_manager.keithley_source)
+    keithley_source.as_voltage_source(50)
+    keithley_source.set_voltage(0)
+    assert messages == []
+
+    keithley_source.set_voltage(3)
+    assert len(messages) == 1
+
+
+def test_voltage_and_current_in_one_query(simulated_instruments, sent_commands):
+    resource_manager, keithley_source, _ = simulated_instruments()
+
+    keithley_source.set_voltage(3)
+    keithley_source.activate_output()
+
+    messages = sent_commands(resource_manager.keithley_source)
+    reading = keithley_source.read_iv()
+
+    assert len(messages) == 1
+    keithley_source.deactivate_output()
+    assert reading.voltage == pytest.approx(3)
+    assert reading.current == pytest.approx(
+        resource_manager.model.current_at(3), rel=1e-3
+    )
+
+
+@pytest.mark.parametrize("precision", ["single", "double"])
+def test_binary_buffer_transfer(simulated_instruments, precision):
+    _, keithley_source, keithley_multimeter = simulated_instruments()
+    voltages = np.arange(0, 3.01, 0.5)
+
+    keithley_multimeter.arm_external_acquisition(len(voltages))
+    keithley_source.init_voltage_sweep(voltages, "OLEDbuffer", 0.01)
+    keithley_source.empty_buffer("OLEDbuffer")
+    keithley_source.run_sweep()
+
+    sources, readings = keithley_source.fetch_buffer(
+        "OLEDbuffer", 1, len(voltages), ["SOUR", "READ"], precision
+    )
+
+    np.testing.assert_allclose(sources, voltages, atol=1e-6)
+    assert np.all(np.diff(readings) > 0)
+
+
+def test_integration_time_policy():
+    policy = IntegrationTimePolicy(1e-9, 1e-3, KeithleySource.NPLC_VALUES)
+
+    # The longest integration time as long as there is no previous reading
+    assert policy.next_nplc() == 10
+
+    # Large signals are read quickly, the integration time grows as the
+    # signal gets smaller
+    nplcs = []
+    for reading in [1e-3, 3e-6, 9e-7, 5e-7]:
+        policy.update(reading)
+        nplcs.append(policy.next_nplc())
+    assert nplcs == [0.01, 0.2, 2, 5]
+
+    # It is capped at the longest integration time
+    policy.update(1e-9)
+    assert policy.next_nplc() == 10
+
+    policy.reset()
+    assert policy.next_nplc() == 10
+
+
+def test_integration_policy_of_the_source(simulated_instruments):
+    _, keithley_source, _ = simulated_instruments()
+
+    keithley_source.as_voltage_source(105)
+    keithley_source.set_voltage(0)
+    keithley_source.activate_output()
+
+    # The integration time is capped at maximum_nplc even though there is
+    # hardly any current
+    keithley_source.set_integration_policy(1e-9, 1e-3, 2)
+    readings = [keithley_source.read_iv() for i in range(3)]
+    assert [reading.nplc for reading in readings] == [2, 2, 2]
+
+    # and gets shorter at a large current
+    keithley_source.set_voltage(4)
+    readings = [keithley_source.read_iv() for i in range(3)]
+    assert readings[-1].nplc < 2
+
+    # The fixed integration time is restored
+    keithley_source.set_integration_policy(0, 0)
+    assert keithley_source.read_iv().nplc == 1
+    assert keithley_source.integration_policy is None
+    keithley_source.deactivate_output()
+
+
+def test_range_planner_predictions():
+    planner = RangePlanner(headroom=1.2)
+    ranges = KeithleySource.CURRENT_RANGES
+
+    # Nothing to predict from
+    assert planner.predict(1) is None
+    assert planner.select_range(ranges, 1) == 0
+
+    # Rising readings are extrapolated on a logarithmic scale
+    planner.update(1e-6, 1)
+    planner.update(1e-5, 2)
+    assert planner.predict(3) == pytest.approx(1e-4)
+    assert planner.select_range(ranges, 3) == 1e-3
+    assert planner.select_range(ranges, 2.5) == 1e-4
+
+    # Falling readings are not
+    planner.update(1e-6, 3)
+    assert planner.predict(4) == pytest.approx(1e-6)
+
+    # The next curve reuses the previous one at the same position
+    planner.next_curve()
+    assert planner.predict(1.5) == pytest.approx(10**-5.5)
+    assert planner.select_range(ranges, 2) == 1e-4
+
+    # but only where it covers the position
+    assert planner.predict(5) is None
+
+    # Readings beyond the largest range are auto ranged
+    planner.update(2, 5)
+    assert planner.select_range(ranges, 5) == 0
+
+
+def test_overflow_falls_back_to_auto_range(simulated_instruments, sent_commands):
+    resource_manager, keithley_source, _ = simulated_instruments()
+
+    keithley_source.as_voltage_source(105)
+    keithley_source.set_voltage(4)
+    keithley_source.activate_output()
+
+    # The planner expects hardly any current
+    planner = RangePlanner()
+    planner.update(1e-9, 4)
+    keithley_source.set_range_planner(planner)
+
+    messages = sent_commands(resource_manager.keithley_source)
+    reading = keithley_source.read_iv()
+    keithley_source.deactivate_output()
+
+    # The reading beyond the planned range was repeated with auto range
+    queries = [message for message in messages if message.startswith("Read?")]
+    assert len(queries) == 2
+    assert 1e-5 < reading.current < 1
+    assert keithley_source.state["Current:Range:AUTO"] == "ON"
+    assert planner.curve[-1] == (4, pytest.approx(abs(reading.current)))
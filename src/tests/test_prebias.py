@@ -0,0 +1,33 @@
+import types
+
+from prebias import Prebias
+
+
+def test_prebias_holds_the_output_on(simulated_instruments, switchbox, monkeypatch):
+    resource_manager, keithley_source, _ = simulated_instruments()
+    emulator, uno = switchbox
+    keithley_source.set_voltage(3)
+
+    # Stand-in for the main window
+    voltages = []
+    main_window = types.SimpleNamespace(
+        sw_ct_voltage_spinBox=types.SimpleNamespace(setValue=voltages.append),
+        sw_prebias_pushButton=types.SimpleNamespace(setEnabled=lambda enabled: None),
+    )
+    prebias = Prebias(keithley_source, uno, -2, 3, [1, 2, 3], 0.05, main_window)
+
+    # The output is never switched off in between
+    monkeypatch.setattr(
+        keithley_source, "deactivate_output", lambda: voltages.append("off")
+    )
+    prebias.prebias()
+
+    # Each pixel on its own with all relays off in between
+    masks = [mask for _, mask in emulator.relay_log]
+    masks = masks[masks.index(1) :]
+    assert [mask for mask in masks if mask != 0] == [1, 2, 4]
+    assert all(mask == 0 or next_mask == 0 for mask, next_mask in zip(masks, masks[1:]))
+    assert masks[-1] == 0
+    assert voltages == [-2, 3]
+    assert resource_manager.keithley_source.output
+    assert uno.read_relays() == 0
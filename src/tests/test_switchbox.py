@@ -0,0 +1,212 @@
+import time
+
+import pytest
+
+from hardware import ArduinoReader, ArduinoUno
+
+
+def test_set_relays(switchbox):
+    emulator, uno = switchbox
+
+    assert uno.set_relays(uno.pixels_to_mask([2, 5])) == 0b10010
+    assert emulator.relays == 0b10010
+    assert uno.read_relays() == 0b10010
+
+    # The ASCII commands of the firmware still work
+    uno.trigger_relay(1)
+    assert emulator.relays == 0b10011
+    assert uno.relay_mask == 0b10011
+
+
+def test_frame_is_resent_after_nak(switchbox, monkeypatch):
+    emulator, uno = switchbox
+
+    # The firmware rejects the first frame
+    commands = []
+    execute = emulator.execute
+
+    def rejecting_execute(command, payload):
+        commands.append(command)
+        if len(commands) == 1:
+            return emulator.NAK
+        return execute(command, payload)
+
+    monkeypatch.setattr(emulator, "execute", rejecting_execute)
+
+    assert uno.set_relays(0b100) == 0b100
+    assert commands == [uno.SET_RELAYS, uno.SET_RELAYS]
+    assert emulator.relays == 0b100
+
+
+def test_unacknowledged_frame_raises(switchbox, monkeypatch):
+    emulator, uno = switchbox
+
+    monkeypatch.setattr(emulator, "execute", lambda command, payload: emulator.NAK)
+
+    with pytest.raises(IOError):
+        uno.set_relays(0b100)
+    assert emulator.relays == 0
+
+
+def test_corrupted_frame_is_ignored(switchbox):
+    emulator, uno = switchbox
+
+    # Frame to switch relays 1 and 3 on with a wrong checksum
+    uno.uno.write(bytes([uno.FRAME_START, uno.SET_RELAYS, 0b101, 0]))
+    time.sleep(0.1)
+    assert emulator.relays == 0
+
+    # The next frame is not mistaken for the rest of the corrupted one
+    assert uno.set_relays(0b10) == 0b10
+    assert emulator.relays == 0b10
+
+
+def frame(status, mask):
+    """
+    Reply frame of the firmware
+    """
+    return bytes([ArduinoUno.FRAME_START, status, mask, status ^ mask])
+
+
+def parse(*chunks):
+    """
+    Feed the chunks one after the other to a reader and return its replies
+    """
+    reader = ArduinoReader(None)
+    for chunk in chunks:
+        reader.buffer += chunk
+        reader.parse()
+
+    replies = []
+    while not reader.replies.empty():
+        replies.append(reader.replies.get())
+    return replies
+
+
+def test_parse_text_and_frames():
+    # A frame right after a complete line, with a mask that is a line feed
+    assert parse(b"Switched on Relay 2\n" + frame(ArduinoUno.ACK, 0x0A)) == [
+        ("line", "Switched on Relay 2"),
+        ("frame", ArduinoUno.ACK, 0x0A),
+    ]
+
+    # A frame in the middle of text (e.g. after an echo) ends the text
+    assert parse(b"1" + frame(ArduinoUno.ACK, 0b101) + b"Switched\n") == [
+        ("line", "1"),
+        ("frame", ArduinoUno.ACK, 0b101),
+        ("line", "Switched"),
+    ]
+
+    # A mask that is a frame start byte
+    assert parse(frame(ArduinoUno.ACK, 0xAA) + b"ok\n") == [
+        ("frame", ArduinoUno.ACK, 0xAA),
+        ("line", "ok"),
+    ]
+
+
+def test_parse_split_input():
+    # Frames and lines that arrive in pieces are put together
+    ack = frame(ArduinoUno.ACK, 3)
+    assert parse(b"Switch", b"ed off all Relays\n" + ack[:2], ack[2:]) == [
+        ("line", "Switched off all Relays"),
+        ("frame", ArduinoUno.ACK, 3),
+    ]
+
+    # Text without a line feed waits for the rest
+    assert parse(b"Switched on") == []
+
+    # Corrupted frames are dropped without losing the text after them
+    corrupted = bytes([ArduinoUno.FRAME_START, ArduinoUno.ACK, 1, 0])
+    assert parse(corrupted + b"next\n") == [("line", "next")]
+
+
+def test_schedule_limits(switchbox):
+    emulator, uno = switchbox
+
+    # Long dwell times are split into several steps
+    uno.upload_schedule([(1, uno.MAX_DWELL + 100), (0, 0)])
+    assert emulator.steps == [(1, uno.MAX_DWELL), (1, 100), (0, 0)]
+
+    # As many steps as the firmware holds
+    uno.upload_schedule([(i % 2, 1) for i in range(uno.MAX_SCHEDULE_STEPS)])
+    assert len(emulator.steps) == uno.MAX_SCHEDULE_STEPS
+
+    # One more is rejected before anything is sent
+    with pytest.raises(ValueError):
+        uno.upload_schedule([(i % 2, 1) for i in range(uno.MAX_SCHEDULE_STEPS + 1)])
+    assert len(emulator.steps) == uno.MAX_SCHEDULE_STEPS
+
+    # A split dwell time counts as several steps
+    with pytest.raises(ValueError):
+        uno.upload_schedule(
+            [(1, uno.MAX_DWELL + 1)] + [(0, 1)] * (uno.MAX_SCHEDULE_STEPS - 1)
+        )
+
+
+def test_run_schedule(switchbox):
+    emulator, uno = switchbox
+
+    steps = [(1 << pixel, 10) for pixel in range(8)] + [(0, 0)]
+    assert uno.run_schedule(steps) == 0
+
+    # Every step was switched in order, not before its planned time (the
+    # firmware counts from the planned end of the previous step)
+    switchings = [entry for entry in emulator.relay_log if entry[1] != 0]
+    assert [mask for _, mask in switchings] == [mask for mask, _ in steps[:-1]]
+    assert all(
+        switching_time - switchings[0][0] >= 0.01 * k - 1e-3
+        for k, (switching_time, _) in enumerate(switchings)
+    )
+
+
+def test_trigger_output(switchbox):
+    emulator, uno = switchbox
+
+    # A pulse after every switching once the trigger is configured
+    uno.set_relays(1)
+    assert emulator.trigger_pulses == []
+
+    uno.configure_trigger(5e-3)
+    uno.set_relays(2)
+    uno.send_trigger()
+    assert len(emulator.trigger_pulses) == 2
+    assert (emulator.trigger_settle, emulator.trigger_width) == (5000, 10)
+
+    # Switched off again
+    uno.configure_trigger(0, 0)
+    uno.set_relays(0)
+    assert len(emulator.trigger_pulses) == 2
+    with pytest.raises(IOError):
+        uno.send_trigger()
+
+    with pytest.raises(ValueError):
+        uno.configure_trigger(ArduinoUno.MAX_TRIGGER_TIME * 2)
+
+
+def test_connection_check_keeps_the_session(switchbox):
+    emulator, uno = switchbox
+
+    uno.set_relays(0b1)
+    restarts = len(emulator.relay_log)
+
+    # The Uno answers the ping, so the port is not opened again (which
+    # would restart it and switch all relays off)
+    uno.ensure_connection()
+    assert emulator.relays == 0b1
+    assert len(emulator.relay_log) == restarts
+
+
+def test_serial_port_names():
+    # VISA addresses (as in the settings) are mapped to their COM port
+    assert ArduinoUno.serial_port("ASRL3::INSTR") == "COM3"
+    assert ArduinoUno.serial_port("asrl12::INSTR") == "COM12"
+
+    # Names of serial ports are used as they are
+    assert ArduinoUno.serial_port("COM4") == "COM4"
+    assert ArduinoUno.serial_port("/dev/ttyACM0") == "/dev/ttyACM0"
+
+
+def test_missing_serial_port_exits():
+    # Like a missing VISA address
+    with pytest.raises(SystemExit):
+        ArduinoUno("/dev/missing_switchbox")
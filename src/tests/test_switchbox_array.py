@@ -0,0 +1,112 @@
+import pytest
+
+from hardware import ArduinoUno, SwitchboxArray
+from tests.simulated_switchbox import SimulatedSwitchbox
+
+
+@pytest.fixture
+def switchbox_array():
+    """
+    SwitchboxArray of eight emulated boards (64 pixels). Returns the
+    emulators and the driver.
+    """
+    emulators = [SimulatedSwitchbox() for i in range(8)]
+    array = SwitchboxArray([emulator.port for emulator in emulators])
+
+    yield emulators, array
+
+    array.close()
+    for emulator in emulators:
+        emulator.close()
+
+
+def test_schedule_of_all_pixels(switchbox_array):
+    emulators, array = switchbox_array
+
+    # Each pixel for 10 ms, more steps than a single board can hold
+    steps = [(1 << pixel, 10) for pixel in range(array.number_of_pixels)]
+    assert len(steps) > ArduinoUno.MAX_SCHEDULE_STEPS
+
+    assert array.run_schedule(steps + [(0, 0)]) == 0
+
+    for i, emulator in enumerate(emulators):
+        # Off until its first pixel, its eight pixels, off again
+        board_steps = [mask for mask, dwell in emulator.steps]
+        if i == 0:
+            assert board_steps == [1 << j for j in range(8)] + [0]
+        else:
+            assert board_steps == [0] + [1 << j for j in range(8)] + [0]
+
+        # All boards run as long as the whole schedule
+        assert sum(dwell for mask, dwell in emulator.steps) == 10 * len(steps)
+
+    # The pixels were switched on one after the other
+    switchings = sorted(
+        (switching_time, mask << (8 * i))
+        for i, emulator in enumerate(emulators)
+        for switching_time, mask in emulator.relay_log
+        if mask != 0
+    )
+    assert [mask for switching_time, mask in switchings] == [
+        mask for mask, dwell in steps
+    ]
+
+
+def test_schedule_that_does_not_fit_a_board(switchbox_array):
+    _, array = switchbox_array
+
+    # A single board can not toggle one of its pixels 40 times
+    with pytest.raises(ValueError):
+        array.upload_schedule([((i % 2) << 3, 10) for i in range(40)])
+
+
+def test_trigger_relay_semantics(switchbox_array, switchbox):
+    emulators, array = switchbox_array
+    _, uno = switchbox
+
+    # Pixel 9 is the first pixel of the second board
+    array.trigger_relay(9)
+    assert array.relay_mask == 1 << 8
+    assert emulators[1].relays == 1
+
+    # number_of_pixels + 1 turns all pixels on, like 9 on a single board
+    array.trigger_relay(array.number_of_pixels + 1)
+    assert array.relay_mask == (1 << array.number_of_pixels) - 1
+    uno.trigger_relay(uno.number_of_pixels + 1)
+    assert uno.relay_mask == 0xFF
+
+    array.trigger_relay(0)
+    uno.trigger_relay(0)
+    assert array.relay_mask == 0
+    assert uno.relay_mask == 0
+
+
+def test_all_pixels_on_every_board(switchbox_array):
+    emulators, array = switchbox_array
+
+    # Some pixels of the second board are already on
+    array.trigger_relay(9)
+    array.trigger_relay(12)
+
+    # The code after the last pixel turns every relay of every board on
+    # instead of toggling a pixel
+    array.trigger_relay(array.number_of_pixels + 1)
+    assert [emulator.relays for emulator in emulators] == [0xFF] * len(emulators)
+    assert array.read_relays() == (1 << array.number_of_pixels) - 1
+
+    # Pixel 9 is still a pixel on the second board
+    array.trigger_relay(0)
+    array.trigger_relay(9)
+    assert [emulator.relays for emulator in emulators] == [0, 1] + [0] * 6
+
+
+def test_boards_are_closed_if_one_is_missing():
+    emulator = SimulatedSwitchbox()
+
+    # ArduinoUno exits if its port can not be opened
+    with pytest.raises(SystemExit):
+        SwitchboxArray([emulator.port, "/dev/missing_switchbox"])
+
+    # The board that was opened was switched off and closed again
+    assert emulator.relay_log[-1][1] == 0
+    emulator.close()
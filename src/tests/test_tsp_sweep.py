@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+# The simulated source runs the TSP scripts with a Lua interpreter
+pytest.importorskip("lupa")
+
+VOLTAGES = np.arange(-2, 4.01, 0.25)
+
+
+def test_settings_are_written_as_tsp(simulated_instruments):
+    resource_manager, keithley_source, _ = simulated_instruments("TSP")
+
+    assert keithley_source.script_engine_available()
+
+    keithley_source.as_voltage_source(50)
+    keithley_source.set_voltage(3)
+    keithley_source.activate_output()
+    reading = keithley_source.read_iv()
+    current = keithley_source.read_current()
+    keithley_source.deactivate_output()
+
+    # The instrument rejects every command that is no TSP (the query also
+    # waits until all commands were executed)
+    assert keithley_source.check_errors() == []
+
+    assert reading.voltage == pytest.approx(3)
+    assert reading.current > 0
+    assert current == pytest.approx(reading.current, rel=1e-3)
+    assert resource_manager.keithley_source.limits["CURR"] == pytest.approx(50e-3)
+    assert not resource_manager.keithley_source.output
+
+
+def test_scpi_commands_are_rejected_in_tsp_mode(simulated_instruments):
+    _, keithley_source, _ = simulated_instruments("TSP")
+
+    keithley_source.keith.write("Source:Volt 1")
+    errors = keithley_source.check_errors()
+
+    assert len(errors) == 1
+    assert errors[0].startswith("-285")
+
+    # The trigger model can not be programmed in TSP mode
+    with pytest.raises(IOError):
+        keithley_source.init_voltage_sweep(VOLTAGES, "OLEDbuffer", 0.01)
+
+
+def test_script_sweep(simulated_instruments):
+    resource_manager, keithley_source, keithley_multimeter = simulated_instruments(
+        "TSP"
+    )
+
+    keithley_multimeter.arm_external_acquisition(len(VOLTAGES))
+    voltages, currents, timestamps, status = keithley_source.run_script_sweep(
+        VOLTAGES, 105, 0.01, chunk_size=4
+    )
+    diode_voltages = keithley_multimeter.fetch_acquisition()
+
+    assert status == "DONE"
+    np.testing.assert_allclose(voltages, VOLTAGES, atol=1e-6)
+    assert len(currents) == len(VOLTAGES)
+    assert np.all(np.diff(timestamps) > 0)
+    assert len(diode_voltages) == len(VOLTAGES)
+
+    # The sweep ran the uploaded script text
+    assert resource_manager.keithley_source.lua.globals().jvl_sweep is not None
+    assert not resource_manager.keithley_source.output
+    assert keithley_source.check_errors() == []
+
+
+def test_script_sweep_stops_at_compliance(simulated_instruments):
+    resource_manager, keithley_source, keithley_multimeter = simulated_instruments(
+        "TSP"
+    )
+
+    keithley_multimeter.arm_external_acquisition(len(VOLTAGES))
+    voltages, currents, _, status = keithley_source.run_script_sweep(
+        VOLTAGES, 0.01, 0.01
+    )
+
+    assert status == "COMPLIANCE"
+    assert 0 < len(currents) < len(VOLTAGES)
+    assert abs(currents[-1]) >= 0.99e-5
+    assert not resource_manager.keithley_source.output
+
+    # The multimeter still gets a trigger for each voltage
+    assert len(keithley_multimeter.fetch_acquisition()) == len(VOLTAGES)
+    assert keithley_source.check_errors() == []
+
+
+def test_script_sweep_can_be_aborted(simulated_instruments):
+    resource_manager, keithley_source, _ = simulated_instruments("TSP")
+
+    voltages, currents, _, status = keithley_source.run_script_sweep(
+        VOLTAGES,
+        105,
+        0.01,
+        notify_digital_line=0,
+        chunk_size=4,
+        chunk_callback=lambda voltages, currents: False,
+    )
+
+    # The instrument takes commands again
+    assert keithley_source.check_errors() == []
+
+    assert status == "ABORTED"
+    assert len(currents) == 4
+    assert not resource_manager.keithley_source.output
+    assert keithley_source.read_current() == pytest.approx(0, abs=1e-9)
+
+
+def test_autotube_script_sweep_of_several_pixels(autotube_measurement):
+    measurement = autotube_measurement("TSP", sweep_mode="tsp")
+
+    # The steps of run() for each pixel
+    for pixel in measurement.selected_pixels:
+        background = measurement.keithley_multimeter.measure_averaged_voltage(1, 1)
+        measurement.uno.trigger_relay(pixel)
+        measurement.measure_script_sweep(VOLTAGES, background)
+        measurement.keithley_source.deactivate_output()
+        measurement.uno.trigger_relay(pixel)
+
+        assert measurement.keithley_source.check_errors() == []
+        assert measurement.keithley_multimeter.check_errors() == []
+        assert len(measurement.df_data) > 0
+        assert measurement.uno.relay_mask == 0
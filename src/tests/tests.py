@@ -1,7 +1,8 @@
 import psutil
 import numpy as np
 import time
-from hardware import MotorMoveThread
+import concurrent.futures
+from hardware import MotorMoveThread, IVReading
 
 
 class MockArduinoUno:
@@ -9,6 +10,8 @@ class MockArduinoUno:
     Mock class for testing
     """
 
+    number_of_pixels = 8
+
     def __init__(self, com2_address):
         print(com2_address)
 
@@ -18,9 +21,52 @@ class MockArduinoUno:
     def trigger_relay(self, relay):
         print("relay " + str(relay) + " opened or closed")
 
+    @staticmethod
+    def pixels_to_mask(pixels):
+        mask = 0
+        for pixel in pixels:
+            mask |= 1 << (int(pixel) - 1)
+        return mask
+
+    def set_relays(self, mask):
+        print("relays set to " + format(mask, "08b"))
+        return mask
+
+    def read_relays(self):
+        return 0
+
+    def upload_schedule(self, steps):
+        print("relay schedule with " + str(len(steps)) + " steps uploaded")
+
+    def start_schedule(self):
+        print("relay schedule started")
+
+    def await_schedule(self, timeout=1):
+        return 0
+
+    def run_schedule(self, steps):
+        self.upload_schedule(steps)
+        self.start_schedule()
+        return self.await_schedule()
+
+    def stop_schedule(self):
+        return 0
+
+    def configure_trigger(self, settling_time, pulse_width=1e-5):
+        print("Trigger output configured")
+
+    def send_trigger(self):
+        print("Trigger sent")
+
     def init_serial_connection(self):
         print("Serial connection initiated")
 
+    def ping(self):
+        return True
+
+    def ensure_connection(self):
+        print("Serial connection checked")
+
 
 class MockKeithleySource:
     """
@@ -30,16 +76,39 @@ class MockKeithleySource:
     def __init__(self, keithley_source_address, current_compliance):
         print(keithley_source_address + str(current_compliance))
 
-    def as_voltage_source(self, current_compliance):
+    def submit(self, method_name, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(getattr(self, method_name)(*args, **kwargs))
+        return future
+
+    def as_voltage_source(self, current_compliance, force=False):
         print("Keithley initialised as voltage source")
 
-    def as_current_source(self, voltage_compliance):
+    def as_current_source(self, voltage_compliance, force=False):
         print("Keithley initialised as current source")
 
     def reset(self):
         print("Keithley source resetted")
 
-    def init_buffer(self, buffer_name, buffer_length):
+    def check_errors(self):
+        return []
+
+    def recover(self):
+        print("Keithley source recovered")
+
+    def configure_trigger_input(self, trigger_digital_line):
+        print("Trigger input configured")
+
+    def init_triggered_measurement(
+        self,
+        buffer_name,
+        number_of_points,
+        trigger_digital_line=2,
+        notify_digital_line=1,
+    ):
+        print("Triggered measurement initialised")
+
+    def init_buffer(self, buffer_name, buffer_length, continuous=False):
         print("Buffer written")
 
     def empty_buffer(self, buffer_name):
@@ -57,12 +126,123 @@ class MockKeithleySource:
     def read_voltage(self):
         return float(psutil.cpu_percent() / 100)
 
+    def read_iv(self, buffer_name="defbuffer1"):
+        print("Voltage and current read")
+        return IVReading(
+            float(psutil.cpu_percent() / 100), float(psutil.cpu_percent() / 100), 0, 1
+        )
+
+    def read_current_and_voltage(self):
+        return self.read_current(), self.read_voltage()
+
+    def measure_with_photodiode(self, keithley_multimeter, number_of_samples=1, nplc=1):
+        return (
+            self.read_current(),
+            self.read_voltage(),
+            keithley_multimeter.measure_averaged_voltage(number_of_samples, nplc),
+        )
+
+    def measure_iv_with_photodiode(
+        self, keithley_multimeter, number_of_samples=1, nplc=1, buffer_name="defbuffer1"
+    ):
+        return (
+            self.read_iv(buffer_name),
+            keithley_multimeter.measure_averaged_voltage(number_of_samples, nplc),
+            nplc,
+        )
+
+    def set_nplc(self, nplc):
+        print("Integration time set to " + str(nplc) + " NPLC")
+
+    def set_integration_policy(self, noise_floor, target_noise, maximum_nplc=1):
+        print("Integration policy set")
+
+    def set_current_range(self, current_range):
+        print("Current range set to " + str(current_range))
+
+    def set_range_planner(self, range_planner):
+        print("Range planner set")
+
+    def source_level(self):
+        return None
+
     def set_voltage(self, voltage):
         print("Voltage set to " + str(voltage))
 
     def set_current(self, current):
         print("Current set to " + str(current))
 
+    def store_source_list(self, list_name, levels):
+        print("Source list " + list_name + " stored")
+
+    def init_voltage_sweep(
+        self, voltages, buffer_name, source_delay, notify_digital_line=1
+    ):
+        self.sweep_voltages = np.array(voltages, dtype=float)
+        print("Voltage sweep loaded")
+
+    def init_pulsed_voltage_sweep(
+        self,
+        voltages,
+        buffer_name,
+        pulse_width,
+        duty_cycle,
+        nplc=1,
+        off_voltage=0,
+        notify_digital_line=1,
+    ):
+        self.sweep_voltages = np.array(voltages, dtype=float)
+        print("Pulsed voltage sweep loaded")
+        return pulse_width
+
+    def run_sweep(self, timeout=60):
+        print("Sweep executed")
+
+    def script_engine_available(self):
+        return False
+
+    def load_script(self, script_name, script):
+        print("Script " + script_name + " loaded")
+
+    def run_script_sweep(
+        self,
+        voltages,
+        current_compliance,
+        source_delay,
+        nplc=1,
+        notify_digital_line=1,
+        chunk_size=10,
+        chunk_callback=None,
+        timeout=60,
+    ):
+        print("Script sweep run")
+        return (
+            np.array(voltages),
+            np.random.rand(len(voltages)),
+            np.arange(len(voltages)) * source_delay,
+            "DONE",
+        )
+
+    def fetch_sweep(self, buffer_name, points=None):
+        if points is None:
+            points = len(self.sweep_voltages)
+        return self.sweep_voltages[:points], np.random.rand(points) * 1e-3
+
+    def buffer_length(self, buffer_name):
+        return 10
+
+    def fetch_buffer(
+        self,
+        buffer_name,
+        start=1,
+        end=None,
+        elements=["READ", "SOUR", "REL"],
+        precision="double",
+    ):
+        if end is None:
+            end = self.buffer_length(buffer_name)
+        return [np.random.rand(end - start + 1) for element in elements]
+
 
 class MockKeithleyMultimeter:
     """
@@ -72,19 +252,77 @@ class MockKeithleyMultimeter:
     def __init__(self, keithley_multimeter_address):
         print(keithley_multimeter_address)
 
-    def reset(self):
+    def submit(self, method_name, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_result(getattr(self, method_name)(*args, **kwargs))
+        return future
+
+    def reset(self, force=False):
         print("Multimeter resetted")
 
+    def check_errors(self):
+        return []
+
+    def recover(self):
+        print("Multimeter recovered")
+
     def set_fixed_range(self, value):
         print("Fixed range set")
 
     def set_auto_range(self):
         print("Auto range set")
 
-    def measure_voltage(self):
+    def configure_voltage_measurement(
+        self, multimeter_range=0, number_of_samples=1, nplc=1
+    ):
+        print("Multimeter configured for voltage measurement")
+
+    def set_range(self, multimeter_range, arm=True):
+        print("Multimeter range set to " + str(multimeter_range))
+
+    def measure_voltage(self, multimeter_range=0):
         print("Voltage read")
         return float(psutil.cpu_percent() / 100)
 
+    def arm_external_acquisition(self, number_of_samples, nplc=1):
+        self.number_of_samples = number_of_samples
+        print("External acquisition armed")
+
+    def fetch_acquisition(self):
+        return np.random.rand(self.number_of_samples)
+
+    def set_burst(self, number_of_samples, nplc):
+        print("Multimeter set to " + str(number_of_samples) + " samples per trigger")
+
+    def set_integration_policy(self, noise_floor, target_noise, maximum_nplc=1):
+        print("Integration policy set")
+
+    def set_range_planner(self, range_planner):
+        print("Range planner set")
+
+    def measure_burst(self, number_of_samples, nplc=1, position=None):
+        samples = np.random.rand(int(number_of_samples))
+        return samples, np.mean(samples), np.std(samples), nplc
+
+    def configure_burst(self, number_of_samples, nplc=1, position=None):
+        print("Multimeter configured for a burst")
+        return nplc
+
+    def trigger_measurement(self, number_of_samples=1, nplc=1, multimeter_range=None):
+        self.number_of_samples = int(number_of_samples)
+        print("Multimeter triggered")
+
+    def fetch_measurement(self):
+        return np.random.rand(self.number_of_samples)
+
+    def measure_averaged_voltage(self, number_of_samples=1, nplc=1):
+        return self.measure_voltage()
+
+    def wait_for_settling(
+        self, tolerance, max_wait, nplc=0.1, noise_floor=1e-4, consecutive=2
+    ):
+        return self.measure_voltage(), 0
+
 
 class MockOceanSpectrometer:
     """